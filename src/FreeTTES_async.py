@@ -0,0 +1,141 @@
+"""asyncio facade for stepping many TES tanks concurrently.
+
+An asyncio orchestrator (e.g. a district model with a dozen tanks) awaits the
+steps of its tanks instead of blocking on them::
+
+    pool = Rechenpool("prozess", max_worker=4)
+    tanks = [AsyncSpeicher("tank_%d" % i, pool) for i in range(12)]
+    await asyncio.gather(*(tank.init() for tank in tanks))
+    ergebnisse = await asyncio.gather(*(tank.step(900, 20, -20, 80, 10.0) for tank in tanks))
+
+Every :class:`AsyncSpeicher` owns its :class:`~FreeTTES_zustand.Modellzustand`.
+A step sends the state and the inputs to a worker of the :class:`Rechenpool`,
+runs :func:`FreeTTES_model.main` there on the state in memory and takes over the
+new state when the worker is done. A process pool runs tanks in parallel; in a
+thread pool the model calls are serialized, because the model reads its
+parameters from module globals.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import FreeTTES_config as cfg
+import FreeTTES_model as model
+from FreeTTES_simulator import modell_sperre
+from FreeTTES_zustand import Modellzustand
+
+# Ausgaben, die ein Schritt zurückgibt (Kennzahlen werden nur dafür berechnet)
+AUSGABEN = ("t", "T_Austritt", "T_Austritt_sub", "E_nutz", "m_nutz", "H_WS", "degradationen")
+
+
+def _start(zustand, parameter, t):
+    """Worker: initial state of a tank."""
+    with modell_sperre:
+        modellzustand = model.startzustand(zustand, parameter=parameter)
+    modellzustand.t = t
+    return modellzustand
+
+
+def _schritt(modellzustand, parameter, dt, eingaben, optionen, ausgaben):
+    """Worker: one step of a tank on `modellzustand`; returns the new state and the outputs."""
+    with modell_sperre:
+        result = model.main(t=modellzustand.t, dt=dt, **eingaben, modellzustand=modellzustand,
+                            parameter=parameter, **optionen)
+        return modellzustand, {key: result[key] for key in ausgaben}
+
+
+class _JeSchleife:
+    """asyncio primitive created for the running event loop (a pool may outlive asyncio.run)."""
+
+    def __init__(self, erzeugen):
+        self._erzeugen = erzeugen
+        self._schleife = None
+        self._objekt = None
+
+    def get(self):
+        schleife = asyncio.get_running_loop()
+        if schleife is not self._schleife:
+            self._schleife, self._objekt = schleife, self._erzeugen()
+        return self._objekt
+
+
+class Rechenpool:
+    """Process or thread pool that runs the tank steps, with a limit on concurrent steps.
+
+    art: ``"prozess"`` (parallel) or ``"thread"``
+    max_worker: number of workers (default: number of CPUs)
+    max_gleichzeitig: steps submitted at the same time (default: `max_worker`);
+        further steps wait in the event loop and can be cancelled there
+    """
+
+    def __init__(self, art="prozess", max_worker=None, max_gleichzeitig=None):
+        if art not in ("prozess", "thread"):
+            raise ValueError("art must be 'prozess' or 'thread', not %r" % art)
+        self.art = art
+        self.max_worker = max_worker or os.cpu_count() or 1
+        self.executor = (ProcessPoolExecutor if art == "prozess" else ThreadPoolExecutor)(self.max_worker)
+        self.max_gleichzeitig = max_gleichzeitig or self.max_worker
+        self._grenze = _JeSchleife(lambda: asyncio.Semaphore(self.max_gleichzeitig))
+
+    async def ausfuehren(self, func, *args):
+        """Run `func(*args)` in the pool within the concurrency limit."""
+        async with self._grenze.get():
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def schliessen(self, abbrechen=False):
+        self.executor.shutdown(wait=not abbrechen, cancel_futures=abbrechen)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.schliessen()
+
+
+class AsyncSpeicher:
+    """One tank whose steps are awaited; state and parameters belong to the instance.
+
+    Steps of the same tank run one after the other in the order they were
+    awaited. A cancelled step leaves the tank at its state before the step; a
+    step already running in a worker is finished there and its result dropped.
+    """
+
+    def __init__(self, name, pool, parameter=None):
+        self.name = name
+        self.pool = pool
+        self.parameter = cfg.parameter(parameter) if parameter else None
+        self.zustand = Modellzustand()
+        self._reihe = _JeSchleife(asyncio.Lock)
+
+    def __repr__(self):
+        return "AsyncSpeicher(%r, %r)" % (self.name, self.zustand)
+
+    async def init(self, zustand=None, t=0.0):
+        """Initialize the tank, optionally from a measured profile height:temperature."""
+        async with self._reihe.get():
+            self.zustand = await self.pool.ausfuehren(_start, zustand, self.parameter, t)
+        return self.zustand
+
+    async def step(self, dt, m_VL, m_RL, T_Zustrom, T_amb, ausgaben=AUSGABEN, **optionen):
+        """Advance the tank by `dt` seconds; arguments as :func:`FreeTTES_model.main`.
+
+        Returns a dict with the keys of `ausgaben`.
+        """
+        eingaben = {"m_VL": m_VL, "m_RL": m_RL, "T_Zustrom": T_Zustrom, "T_amb": T_amb}
+        async with self._reihe.get():
+            if not self.zustand:
+                self.zustand = await self.pool.ausfuehren(_start, None, self.parameter, self.zustand.t)
+            zustand = self.zustand if self.pool.art == "prozess" else self.zustand.kopie()
+            neu, ergebnis = await self.pool.ausfuehren(_schritt, zustand, self.parameter, dt,
+                                                       eingaben, optionen, tuple(ausgaben))
+            self.zustand = neu                                      # erst nach dem Schritt übernehmen
+        return ergebnis
+
+    def get_state(self) -> Modellzustand:
+        return self.zustand.kopie()
+
+    def set_state(self, zustand):
+        self.zustand = zustand.kopie()
@@ -0,0 +1,801 @@
+"""Benchmark suite for the TES tank model.
+
+Run from ``src/``::
+
+    python FreeTTES_benchmark.py              # all benchmarks
+    python FreeTTES_benchmark.py mischzone    # selected benchmarks
+
+Every benchmark prints a short report and returns its numbers as a dict, so it
+can also be called from a notebook. The model writes its usual output files
+into ``datei/`` while the benchmarks run.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import copy
+import glob
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+import FreeTTES_async as tankasync
+import FreeTTES_cache as tankcache
+import FreeTTES_checkpoint as checkpoint
+import FreeTTES_config as cfg
+import FreeTTES_kernels as kernels
+import FreeTTES_linear as linear
+import FreeTTES_model as model
+import FreeTTES_parareal as parareal_zeit
+import FreeTTES_sensitivitaet as sensitivitaet
+import FreeTTES_server as tankserver
+import FreeTTES_stream as stream
+import FreeTTES_surrogat as surrogat
+from FreeTTES_simulator import Speicher
+from FreeTTES_zustand import Modellzustand
+
+_BENCHMARKS = {}
+
+# Startprofil aus example.py (Hoehe in m : Temperatur in °C)
+START_PROFIL = {
+    2.0: 27.63, 6.0: 28.39, 10.0: 28.39, 14.0: 28.39, 18.0: 28.39,
+    22.0: 28.39, 26.0: 28.39, 30.0: 28.42, 34.0: 31.07, 38.0: 44.13,
+}
+
+
+def benchmark(func):
+    """Register `func` under its name in the benchmark suite."""
+    _BENCHMARKS[func.__name__] = func
+    return func
+
+
+def _idle_schritt(t, dt=900, T_amb=10.0):
+    return model.main(t=t, dt=dt, m_VL=0, m_RL=0, T_Zustrom=60, T_amb=T_amb,
+                      zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+
+
+@contextlib.contextmanager
+def _config(**aenderungen):
+    """Run with `config.json` plus the given SPEICHER_PARAMETER changes."""
+    with open(cfg.CONFIG_PATH, encoding="utf-8") as f:
+        daten = json.load(f)
+    daten["SPEICHER_PARAMETER"].update(aenderungen)
+    fd, pfad = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(daten, f)
+    alt = cfg.CONFIG_PATH
+    cfg.CONFIG_PATH = pfad
+    try:
+        yield
+    finally:
+        cfg.CONFIG_PATH = alt
+        os.remove(pfad)
+
+
+def _report(titel, werte):
+    print("== %s" % titel)
+    for key, value in werte.items():
+        if isinstance(value, float):
+            print("   %-32s %12.6g" % (key, value))
+        else:
+            print("   %-32s %12s" % (key, value))
+    return werte
+
+
+@benchmark
+def mischzone(n_schritte=10):
+    """Cost of the thermocline metrics relative to one `main()` step."""
+    _idle_schritt(0)
+    t_schritt = []
+    t_mischzone = []
+    for t in range(1, n_schritte + 1):
+        start = time.perf_counter()
+        result = _idle_schritt(t)
+        mitte = time.perf_counter()
+        result["beladefaktor_nach_mischzone"]                           # berechnet alle sechs Kennzahlen
+        ende = time.perf_counter()
+        t_schritt.append(mitte - start)
+        t_mischzone.append(ende - mitte)
+    schritt = statistics.median(t_schritt)
+    kennzahlen = statistics.median(t_mischzone)
+    return _report("thermocline metrics", {
+        "zellen": len(result["speicherzustand"]),
+        "schritt_s": schritt,
+        "mischzone_s": kennzahlen,
+        "anteil_prozent": 100 * kennzahlen / schritt,
+    })
+
+
+def _bodenwaermestrom():
+    """Heat flux density from the lowest water cell into the foundation in W/m2."""
+    Speicherzustand, Fundamentzustand, _ = model.__Modell_letzter_Zustand()
+    theta_W, dh_W = Speicherzustand[min(Speicherzustand)][:2]
+    theta_F, dh_F = Fundamentzustand[max(Fundamentzustand)][:2]
+    R = (dh_W / 2 / model.__Modell_Stoffwerte("lambda", theta_W)
+         + dh_F / 2 / model.__Modell_Stoffwerte("lambda_Fundament"))
+    return (theta_W - theta_F) / R
+
+
+@benchmark
+def fundament(n_schritte=8):
+    """Graded foundation grid against the 500-cell uniform reference."""
+    def lauf():
+        q = []
+        start = time.perf_counter()
+        for t in range(n_schritte):
+            if t % 4:
+                model.main(t=t, dt=3600, m_VL=0, m_RL=0, T_Zustrom=60, T_amb=10.0,
+                           zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+            else:                                                       # jede vierte Stunde entladen
+                model.main(t=t, dt=3600, m_VL=-20, m_RL=20, T_Zustrom=25, T_amb=10.0,
+                           zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+            q.append(_bodenwaermestrom())
+        n_zellen = len(model.__Modell_letzter_Zustand()[1])
+        return q, time.perf_counter() - start, n_zellen
+
+    with _config(fundament_gitter="uniform", n_Fundament=500):
+        q_ref, t_ref, n_ref = lauf()
+    with _config(fundament_gitter="geometrisch"):
+        q, t_lauf, n = lauf()
+    abw = max(abs(a - b) for a, b in zip(q, q_ref))
+    return _report("foundation grid", {
+        "zellen_referenz": n_ref,
+        "zellen_gestuft": n,
+        "laufzeit_referenz_s": t_ref,
+        "laufzeit_gestuft_s": t_lauf,
+        "q_boden_referenz_W_m2": q_ref[-1],
+        "q_boden_max_abw_W_m2": abw,
+        "q_boden_max_abw_prozent": 100 * abw / max(abs(x) for x in q_ref),
+    })
+
+
+def _profil(Speicherzustand, hoehen):
+    """Water temperatures at fixed `hoehen`, interpolated between cell centres."""
+    h = sorted(Speicherzustand)
+    return np.interp(hoehen, h, [Speicherzustand[k][0] for k in h])
+
+
+@benchmark
+def mehrraten(n_schritte=6, takte=(1, 5, 15, 60)):
+    """Foundation and wall on a slower clock: accuracy against speed."""
+    hoehen = np.linspace(0.5, 38.0, 76)
+
+    def lauf():
+        T_aus = []
+        E = []
+        start = time.perf_counter()
+        for t in range(n_schritte):
+            entladen = t % 3 == 1
+            result = model.main(t=t, dt=3600, m_VL=-20 if entladen else 0, m_RL=20 if entladen else 0,
+                                T_Zustrom=25, T_amb=10.0,
+                                zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+            T_aus.append(result["T_Austritt"])
+            E.append(result["E_ges"])
+        laufzeit = time.perf_counter() - start
+        return T_aus, E, _profil(result["speicherzustand"], hoehen), laufzeit
+
+    ergebnisse = {}
+    for takt in takte:
+        with _config(n_sub_fundament=takt, n_sub_mantel=takt):
+            ergebnisse[takt] = lauf()
+    T_ref, E_ref, profil_ref, t_ref = ergebnisse[takte[0]]
+    werte = {"laufzeit_referenz_s": t_ref}
+    for takt in takte[1:]:
+        T_aus, E, profil, laufzeit = ergebnisse[takt]
+        werte["takt_%d_laufzeit_s" % takt] = laufzeit
+        werte["takt_%d_speedup" % takt] = t_ref / laufzeit
+        werte["takt_%d_T_Austritt_abw_K" % takt] = max(abs(a - b) for a, b in zip(T_aus, T_ref))
+        werte["takt_%d_profil_abw_K" % takt] = float(np.max(np.abs(profil - profil_ref)))
+        werte["takt_%d_E_ges_abw_GJ" % takt] = max(abs(a - b) for a, b in zip(E, E_ref))
+    return _report("multi-rate foundation and wall", werte)
+
+
+@benchmark
+def mantel(n_schritte=6, n_wiederholungen=20):
+    """Adaptive wall grid against the 1000 uniform wall cells."""
+    def lauf():
+        T_aus = []
+        E = []
+        start = time.perf_counter()
+        for t in range(n_schritte):
+            entladen = t % 3 == 1
+            result = model.main(t=t, dt=3600, m_VL=-20 if entladen else 0, m_RL=20 if entladen else 0,
+                                T_Zustrom=25, T_amb=10.0,
+                                zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+            T_aus.append(result["T_Austritt"])
+            E.append(result["E_ges"])
+        laufzeit = time.perf_counter() - start
+        Speicherzustand, _, Kapazitaeten = model.__Modell_letzter_Zustand()
+        start = time.perf_counter()
+        for _ in range(n_wiederholungen):                               # Kosten eines Mantelschritts (mit Energiesumme)
+            K = copy.deepcopy(Kapazitaeten)
+            model.__Modell_Kapazitaeten(60, 10.0, K, copy.deepcopy(Speicherzustand))
+            sum(v[0] * v[2] for v in K.values())
+        mantelschritt = (time.perf_counter() - start) / n_wiederholungen
+        E_Mantel = sum(v[0] * v[2] for v in Kapazitaeten.values())
+        return T_aus, E, laufzeit, len(Kapazitaeten), mantelschritt, E_Mantel
+
+    with _config(mantel_gitter="uniform"):
+        T_ref, E_ref, t_ref, n_ref, s_ref, EM_ref = lauf()
+    with _config(mantel_gitter="adaptiv"):
+        T_aus, E, t_lauf, n, s, EM = lauf()
+    return _report("wall grid", {
+        "zellen_uniform": n_ref,
+        "zellen_adaptiv": n,
+        "mantelschritt_uniform_s": s_ref,
+        "mantelschritt_adaptiv_s": s,
+        "laufzeit_uniform_s": t_ref,
+        "laufzeit_adaptiv_s": t_lauf,
+        "T_Austritt_abw_K": max(abs(a - b) for a, b in zip(T_aus, T_ref)),
+        "E_ges_abw_GJ": max(abs(a - b) for a, b in zip(E, E_ref)),
+        "E_mantel_abw_prozent": 100 * abs(EM - EM_ref) / EM_ref,
+    })
+
+
+@benchmark
+def plateau(n_schritte=9):
+    """Plateau compression against the uncompressed cell stack."""
+    def lauf():
+        T_aus = []
+        E = []
+        zellen = []
+        start = time.perf_counter()
+        for t in range(n_schritte):
+            m = (0, -20, 20)[t % 3]                                    # Stillstand, entladen, beladen
+            result = model.main(t=t, dt=3600, m_VL=m, m_RL=-m, T_Zustrom=80 if m > 0 else 25,
+                                T_amb=10.0, zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+            T_aus.append(result["T_Austritt"])
+            E.append(result["E_ges"])
+            zellen.append(len(result["speicherzustand"]))
+        return T_aus, E, zellen, result["m_ges"], time.perf_counter() - start
+
+    with _config(plateau_dh_max=0):
+        T_ref, E_ref, n_ref, m_ref, t_ref = lauf()
+    with _config(plateau_dh_max=4.0):
+        T_aus, E, n, m, t_lauf = lauf()
+    return _report("plateau compression", {
+        "zellen_ohne": statistics.mean(n_ref),
+        "zellen_mit": statistics.mean(n),
+        "laufzeit_ohne_s": t_ref,
+        "laufzeit_mit_s": t_lauf,
+        "T_Austritt_abw_K": max(abs(a - b) for a, b in zip(T_aus, T_ref)),
+        "E_ges_abw_GJ": max(abs(a - b) for a, b in zip(E, E_ref)),
+        "m_ges_abw_t": abs(m - m_ref),
+    })
+
+
+@benchmark
+def nebenstrom(n_schritte=4, n_laeufe=2):
+    """Side-stream solver: Brent iterations and cache hits, run repeated from t = 0."""
+    loesen_ab = model.__dict__["__Modell_Nebenstrom_ab_loesen"]
+    loesen_zu = model.__dict__["__Modell_Nebenstrom_zu_loesen"]
+    loesen_ab.cache_clear()
+    loesen_zu.cache_clear()
+    werte = {}
+    with _config(nebenstrom_loeser="brent", nebenstrom_stellen=6):
+        for lauf in range(1, n_laeufe + 1):
+            for key in model.nebenstrom_statistik:
+                model.nebenstrom_statistik[key] = 0
+            treffer = loesen_ab.cache_info().hits + loesen_zu.cache_info().hits
+            start = time.perf_counter()
+            for t in range(n_schritte):
+                m = (-20, 0)[t % 2]                                    # oben entladen, Stillstand
+                model.main(t=t, dt=3600, m_VL=m, m_RL=-m, T_Zustrom=25, T_amb=10.0,
+                           zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+            statistik = model.nebenstrom_statistik
+            treffer = loesen_ab.cache_info().hits + loesen_zu.cache_info().hits - treffer
+            werte["lauf_%d_laufzeit_s" % lauf] = time.perf_counter() - start
+            werte["lauf_%d_loesungen" % lauf] = statistik["loesungen"]
+            werte["lauf_%d_cache_treffer" % lauf] = treffer
+            werte["lauf_%d_iterationen_mittel" % lauf] = (statistik["iterationen"] / statistik["loesungen"]
+                                                         if statistik["loesungen"] else 0.0)
+            werte["lauf_%d_iterationen_max" % lauf] = statistik["max_iterationen"]
+    return _report("side-stream solver", werte)
+
+
+_KERNEL_ROUTINEN = ("__Modell_Inversion", "__Modell_Impuls", "__Modell_Horizontalmischung")
+
+_START_SKRIPT = """
+import time
+start = time.perf_counter()
+import FreeTTES_kernels
+mitte = time.perf_counter()
+FreeTTES_kernels.aufwaermen()
+print(mitte - start, time.perf_counter() - mitte)
+"""
+
+
+@benchmark
+def numba(n_schritte=6):
+    """Numba kernels: start-up with JIT and disk cache, steady-state speedup."""
+    if not kernels.VERFUEGBAR:
+        return _report("numba kernels", {"verfuegbar": False})
+
+    werte = {}
+    with tempfile.TemporaryDirectory() as cache:                        # leerer Cache: erst kompilieren, dann laden
+        umgebung = dict(os.environ, NUMBA_CACHE_DIR=cache)
+        for name in ("kalt", "cache"):
+            ausgabe = subprocess.run([sys.executable, "-c", _START_SKRIPT], env=umgebung, check=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)),
+                                     capture_output=True, text=True).stdout.split()
+            werte["start_%s_import_s" % name] = float(ausgabe[0])
+            werte["start_%s_aufwaermen_s" % name] = float(ausgabe[1])
+
+    zeiten = dict.fromkeys(_KERNEL_ROUTINEN, 0.0)
+    originale = {name: model.__dict__[name] for name in _KERNEL_ROUTINEN}
+
+    def gemessen(name):
+        def routine(*args):
+            start = time.perf_counter()
+            try:
+                return originale[name](*args)
+            finally:
+                zeiten[name] += time.perf_counter() - start
+        return routine
+
+    def lauf():
+        for name in zeiten:
+            zeiten[name] = 0.0
+        T_aus = []
+        start = time.perf_counter()
+        for t in range(n_schritte):
+            m, T_zu = ((20, 80), (-20, 25), (-20, 80))[t % 3]          # beladen, entladen, heiß unten ein
+            result = model.main(t=t, dt=3600, m_VL=m, m_RL=-m, T_Zustrom=T_zu, T_amb=10.0,
+                                zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+            T_aus.append(result["T_Austritt"])
+        return T_aus, time.perf_counter() - start, dict(zeiten)
+
+    kernels.aufwaermen()
+    ergebnisse = {}
+    for name in _KERNEL_ROUTINEN:
+        model.__dict__[name] = gemessen(name)
+    try:
+        for modus in ("aus", "alle", "auto"):
+            with _config(numba_kernels=modus):
+                ergebnisse[modus] = lauf()
+    finally:
+        model.__dict__.update(originale)
+    T_ref, t_ref, z_ref = ergebnisse["aus"]
+    _, _, z = ergebnisse["alle"]
+    for name in _KERNEL_ROUTINEN:
+        kurz = name.replace("__Modell_", "").lower()
+        werte["%s_python_s" % kurz] = z_ref[name]
+        werte["%s_numba_s" % kurz] = z[name]
+        werte["%s_speedup" % kurz] = z_ref[name] / z[name] if z[name] else 0.0
+    werte["laufzeit_python_s"] = t_ref
+    for modus in ("alle", "auto"):
+        T_aus, t_lauf, _ = ergebnisse[modus]
+        werte["laufzeit_%s_s" % modus] = t_lauf
+        werte["T_Austritt_abw_%s_K" % modus] = max(abs(a - b) for a, b in zip(T_aus, T_ref))
+    return _report("numba kernels", werte)
+
+
+@benchmark
+def echtzeit(n_schritte=6, anteil=0.5):
+    """Deadline mode: latency percentiles and degradations at a tight budget."""
+    def lauf():
+        model.latenzen.reset()
+        T_aus = []
+        stufen = []
+        for t in range(n_schritte):
+            m, T_zu = ((20, 80), (-20, 25), (-20, 80))[t % 3]          # beladen, entladen, heiß unten ein
+            result = model.main(t=t, dt=3600, m_VL=m, m_RL=-m, T_Zustrom=T_zu, T_amb=10.0,
+                                zustand_uebernehmen=(t == 0), zustand=START_PROFIL.copy())
+            T_aus.append(result["T_Austritt"])
+            stufen.append(result["degradationen"])
+        return T_aus, stufen, model.latenzen.statistik()
+
+    with _config(echtzeit_budget=0):
+        T_ref, _, frei = lauf()
+    budget = anteil * frei["p50"]
+    with _config(echtzeit_budget=budget):
+        T_aus, stufen, frist = lauf()
+    werte = {"budget_s": budget}
+    for name, statistik in (("frei", frei), ("frist", frist)):
+        for p in ("p50", "p95", "p99", "max"):
+            werte["%s_%s_s" % (name, p)] = statistik[p]
+    werte["aufrufe_degradiert"] = frist["degradiert"]
+    for stufe in ("inversionen", "teilschritte", "zellhoehe"):
+        werte["stufe_%s" % stufe] = frist["stufe_" + stufe]
+    werte["T_Austritt_abw_K"] = max(abs(a - b) for a, b in zip(T_aus, T_ref))
+    return _report("deadline mode", werte)
+
+
+def _stream_eingabe(pfad, n):
+    """CSV input with `n` minute rows: charge, discharge and idle blocks of 20 minutes."""
+    with open(pfad, "w", encoding="utf-8") as f:
+        f.write("m_VL;m_RL;T_Zustrom;T_amb\n")
+        for i in range(n):
+            m, T_zu = ((20, 80), (-20, 25), (0, 60))[i // 20 % 3]
+            f.write("%g;%g;%g;10.0\n" % (m, -m, T_zu))
+
+
+@benchmark
+def streaming(n_schritte=(20, 80), n_zeilen=(10 ** 4, 10 ** 5)):
+    """Streaming pipeline: peak traced memory for short and long series."""
+    werte = {}
+    with tempfile.TemporaryDirectory() as ordner:
+        for n in n_zeilen:                                              # nur lesen und schreiben
+            eingabe = os.path.join(ordner, "zeilen_%d.csv" % n)
+            _stream_eingabe(eingabe, n)
+            tracemalloc.start()
+            start = time.perf_counter()
+            with stream.Spaltenspeicher(os.path.join(ordner, "aus_%d" % n)) as senke:
+                senke.alle_schreiben(stream.zeilen(eingabe))
+            werte["lesen_%d_s" % n] = time.perf_counter() - start
+            werte["lesen_%d_spitze_kB" % n] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+        werte["neue_sz_dateien"] = 0
+        for k, n in enumerate(n_schritte):                              # mit Modell, Minutenschritte
+            eingabe = os.path.join(ordner, "schritte_%d.csv" % n)
+            _stream_eingabe(eingabe, n)
+            if k == 0:                                                  # Caches einmal füllen
+                stream.pipeline(eingabe, os.path.join(ordner, "warm"), 60, zustand=START_PROFIL)
+            sz_dateien = set(glob.glob(cfg.SCRIPT_DIR + "*sz*.dat"))
+            tracemalloc.start()
+            stream.pipeline(eingabe, os.path.join(ordner, "sim_%d" % n), 60,
+                            zustand=START_PROFIL, puffer=16)
+            werte["simulation_%d_spitze_kB" % n] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+            werte["neue_sz_dateien"] += len(set(glob.glob(cfg.SCRIPT_DIR + "*sz*.dat")) - sz_dateien)
+    return _report("streaming pipeline", werte)
+
+
+@benchmark
+def profil(n_minuten=60):
+    """Hourly call with minute input profiles against one call per minute."""
+    m_VL = [float(20 * np.sin(np.pi * (i + 0.5) / 30)) for i in range(n_minuten)]   # laden, entladen
+    T_zu = [80.0 if m > 0 else 30.0 for m in m_VL]
+
+    def start():
+        model.main(t=0, dt=3600, m_VL=0, m_RL=0, T_Zustrom=60, T_amb=10.0,
+                   zustand_uebernehmen=True, zustand=START_PROFIL.copy())
+
+    start()
+    beginn = time.perf_counter()
+    T_ref = []
+    for i in range(n_minuten):
+        result = model.main(t=1 + i / 60, dt=60, m_VL=m_VL[i], m_RL=-m_VL[i],
+                            T_Zustrom=T_zu[i], T_amb=10.0)
+        T_ref.append(result["T_Austritt"])
+    t_ref = time.perf_counter() - beginn
+    hoehen = np.linspace(1, 39, 39)
+    profil_ref = _profil(result["speicherzustand"], hoehen)
+
+    start()
+    beginn = time.perf_counter()
+    result = model.main(t=1, dt=60 * n_minuten, m_VL=m_VL, m_RL=[-m for m in m_VL],
+                        T_Zustrom=T_zu, T_amb=10.0)
+    t_profil = time.perf_counter() - beginn
+    return _report("substep input profiles", {
+        "laufzeit_minutenaufrufe_s": t_ref,
+        "laufzeit_profil_s": t_profil,
+        "speedup": t_ref / t_profil,
+        "T_Austritt_sub_abw_K": float(np.max(np.abs(result["T_Austritt_sub"] - T_ref))),
+        "profil_abw_K": float(np.max(np.abs(_profil(result["speicherzustand"], hoehen) - profil_ref))),
+    })
+
+
+@benchmark
+def server(n_tanks=4, n_schritte=6, batch=4):
+    """Co-simulation server: round-trip latency and step throughput, single and batched."""
+    with tempfile.TemporaryDirectory() as ordner:
+        adresse = os.path.join(ordner, "freettes.sock") if hasattr(socket, "AF_UNIX") else "127.0.0.1:0"
+        srv = tankserver.server(adresse)
+        if not isinstance(srv.server_address, str):                     # TCP: vom System vergebener Port
+            adresse = "%s:%d" % srv.server_address
+        faden = threading.Thread(target=srv.serve_forever, daemon=True)
+        faden.start()
+        try:
+            werte = {}
+            for n in (1, batch):
+                for key, value in tankserver.last(adresse, n_tanks, n_schritte, batch=n,
+                                                  zustand=START_PROFIL).items():
+                    werte["batch_%d_%s" % (n, key)] = value
+            with tankserver.Client(adresse) as client:
+                start = time.perf_counter()
+                for _ in range(20):
+                    zustand = client.get_state("tank_0")
+                werte["get_state_s"] = (time.perf_counter() - start) / 20
+                werte["zustand_bytes"] = len(zustand)
+                client.snapshot("tank_0", "vorher")
+                vorher = client.step("tank_0", 900, -20, 20, 25, 10.0)
+                client.restore("tank_0", "vorher")
+                werte["restore_abw_K"] = abs(client.step("tank_0", 900, -20, 20, 25, 10.0)["T_Austritt"]
+                                             - vorher["T_Austritt"])
+                metriken = client.metriken()
+            werte["server_step_p50_s"] = metriken["latenzen"]["step"]["p50"]
+            werte["server_batch_p50_s"] = metriken["latenzen"]["batch"]["p50"]
+        finally:
+            srv.shutdown()
+            srv.server_close()
+    return _report("co-simulation server", werte)
+
+
+@benchmark
+def zwei_tanks(dt=900):
+    """Lazy outputs of a tank read after another tank with other parameters has stepped."""
+    klein = Speicher("klein", parameter={"R_innen": 10.0, "Vp_max": 250.0})
+    gross = Speicher("gross")
+    sofort = {}
+    for tank in (klein, gross):
+        tank.init(START_PROFIL)
+        sofort[tank.name] = tank.step(dt, 20, -20, 80, 10.0).copy()      # sofort ausgewertet
+    for tank in (klein, gross):
+        tank.init(START_PROFIL)
+    spaet = klein.step(dt, 20, -20, 80, 10.0)
+    gross.step(dt, 20, -20, 80, 10.0)                                   # setzt speicher_param auf die Standardwerte
+    keys = ("E_nutz", "m_nutz_max", "Q_V_Erd", "mp_max_BL", "mp_min", "obere_hoehe_mischzone")
+    return _report("two tanks with different parameters", {
+        "E_nutz_klein_GJ": sofort["klein"]["E_nutz"],
+        "E_nutz_gross_GJ": sofort["gross"]["E_nutz"],
+        "spaet_abw_max": max(abs(spaet[key] - sofort["klein"][key]) for key in keys),
+    })
+
+
+@benchmark
+def parallel(n_tanks=8, n_schritte=2, max_worker=None):
+    """asyncio facade: gather over many tanks in a process and a thread pool against serial steps."""
+    eingaben = [((20, -20, 80), (-20, 20, 25))[k % 2] for k in range(n_schritte)]
+    seriell = Speicher()
+    seriell.init(START_PROFIL)
+    start = time.perf_counter()
+    for _ in range(n_tanks):                                            # alle Tanks gleich: einmal rechnen, n-mal zählen
+        zustand = seriell.get_state()
+        for m_VL, m_RL, T_zu in eingaben:
+            T_ref = seriell.step(900, m_VL, m_RL, T_zu, 10.0)["T_Austritt"]
+        seriell.set_state(zustand)
+    werte = {"kerne": os.cpu_count(), "seriell_s": time.perf_counter() - start}
+
+    async def lauf(pool):
+        tanks = [tankasync.AsyncSpeicher("tank_%d" % i, pool) for i in range(n_tanks)]
+        await asyncio.gather(*(tank.init(START_PROFIL) for tank in tanks))    # Worker starten
+        start = time.perf_counter()
+        for m_VL, m_RL, T_zu in eingaben:
+            ergebnisse = await asyncio.gather(*(tank.step(900, m_VL, m_RL, T_zu, 10.0) for tank in tanks))
+        laufzeit = time.perf_counter() - start
+        vorher = tanks[0].get_state()                                   # abgebrochener Schritt ändert nichts
+        schritt = asyncio.ensure_future(tanks[0].step(900, -20, 20, 25, 10.0))
+        await asyncio.sleep(0.01)
+        schritt.cancel()
+        try:
+            await schritt
+        except asyncio.CancelledError:
+            pass
+        return (laufzeit, max(abs(e["T_Austritt"] - T_ref) for e in ergebnisse),
+                tanks[0].zustand.to_bytes() == vorher.to_bytes())
+
+    for art in ("prozess", "thread"):
+        with tankasync.Rechenpool(art, max_worker=max_worker) as pool:
+            laufzeit, abw, unveraendert = asyncio.run(lauf(pool))
+        werte["%s_s" % art] = laufzeit
+        werte["%s_speedup" % art] = werte["seriell_s"] / laufzeit
+        werte["%s_T_Austritt_abw_K" % art] = abw
+        werte["%s_abbruch_unveraendert" % art] = unveraendert
+    return _report("asyncio facade", werte)
+
+
+@benchmark
+def schrittcache(horizont=3, dt=900):
+    """Step cache: all charge/idle/discharge sequences of an MPC horizon from one state."""
+    aktionen = ((20, -20, 80), (0, 0, 60), (-20, 20, 25))
+    folgen = list(itertools.product(aktionen, repeat=horizont))
+    start = Speicher()
+    start.init(START_PROFIL)
+
+    def lauf(cache):
+        tank = Speicher(cache=cache)
+        ergebnisse = []
+        beginn = time.perf_counter()
+        for folge in folgen:
+            tank.set_state(start.zustand)
+            for m_VL, m_RL, T_zu in folge:
+                result = tank.step(dt, m_VL, m_RL, T_zu, 10.0)
+            ergebnisse.append((result["T_Austritt"], result["E_nutz"]))
+        return ergebnisse, time.perf_counter() - beginn
+
+    ref, t_ref = lauf(None)
+    cache = tankcache.SchrittCache(ausgaben=("t", "T_Austritt", "E_nutz", "H_WS"))
+    ergebnisse, t_cache = lauf(cache)
+    statistik = cache.statistik()
+    return _report("step cache", {
+        "folgen": len(folgen),
+        "schritte": len(folgen) * horizont,
+        "ohne_cache_s": t_ref,
+        "mit_cache_s": t_cache,
+        "speedup": t_ref / t_cache,
+        "trefferquote": statistik["trefferquote"],
+        "eintraege": statistik["eintraege"],
+        "speicher_kB": statistik["bytes"] / 1024,
+        "abw_max": float(np.max(np.abs(np.array(ergebnisse) - np.array(ref)))),
+    })
+
+
+@benchmark
+def checkpoints(n_schritte=48, alle=8, dt=900, erste=37, n_segment=4):
+    """Checkpoint store: cost of the snapshots, lookup and resume against a replay from t = 0."""
+    zeilen = [{"m_VL": m, "m_RL": -m, "T_Zustrom": 80.0 if m > 0 else 25.0, "T_amb": 10.0}
+              for m in (20.0, 0.0, -20.0, 0.0) for _ in range(n_schritte // 4)]
+    t_start = erste * dt / 3600
+    with tempfile.TemporaryDirectory() as ordner:
+        pfad = os.path.join(ordner, "lauf.ftc")
+        beginn = time.perf_counter()
+        zustand = Modellzustand()
+        ref = list(stream.simulieren(zeilen, dt, zustand=START_PROFIL, modellzustand=zustand))
+        t_ohne = time.perf_counter() - beginn
+        ref_zustand = zustand.to_bytes()
+        with checkpoint.Checkpointspeicher(pfad, alle=alle) as cp:
+            list(stream.simulieren(zeilen, dt, zustand=START_PROFIL, checkpoints=cp))
+        with checkpoint.Checkpointspeicher(os.path.join(ordner, "schreiben.ftc")) as cp:
+            zustand = Modellzustand.from_bytes(ref_zustand)
+            beginn = time.perf_counter()
+            for i in range(20):
+                zustand.t = i
+                cp.schreiben(zustand)
+            t_schreiben = (time.perf_counter() - beginn) / 20
+        with checkpoint.Checkpointspeicher(pfad) as cp:                 # Index aus der Datei
+            beginn = time.perf_counter()
+            for t in cp.zeiten:
+                cp.laden(t)
+            t_laden = (time.perf_counter() - beginn) / len(cp)
+            beginn = time.perf_counter()
+            wieder = list(cp.resume_from(t_start, iter(zeilen), dt, bis=t_start + n_segment * dt / 3600))
+            t_resume = time.perf_counter() - beginn
+            n_cp = len(cp)
+        abw = max(abs(a[k] - b[k]) for a, b in zip(wieder, ref[erste:erste + n_segment])
+                  for k in stream.AUSGABEN)
+        return _report("checkpoint store", {
+            "checkpoints": n_cp,
+            "datei_kB": os.path.getsize(pfad) / 1024,
+            "schreiben_s": t_schreiben,
+            "schritt_s": t_ohne / n_schritte,
+            "laden_s": t_laden,
+            "resume_segment_s": t_resume,
+            "replay_ab_0_s": t_ohne * (erste + n_segment) / n_schritte,
+            "segment_schritte": len(wieder),
+            "abw_max": abw,
+        })
+
+
+@benchmark
+def was_waere(n_schritte=64, alle=8, dt=900, toleranz=0.05):
+    """What-if runs from the checkpoint before the change against full re-runs."""
+    def zeile(m, T_amb=10.0):
+        return {"m_VL": m, "m_RL": -m, "T_Zustrom": 80.0 if m > 0 else 25.0, "T_amb": T_amb}
+
+    # laden, ruhen, entladen, ruhen (je ein Viertel)
+    plan = [20.0 if i < 16 else -20.0 if 32 <= i < 48 else 0.0 for i in range(n_schritte)]
+    eingaben = [zeile(m) for m in plan]
+    szenarien = {
+        "spaeter_entladen": [zeile(m) for m in plan[:32] + [0.0] * 4 + plan[32:n_schritte - 4]],
+        "kalte_nacht": [zeile(m, -5.0 if 40 <= i < 44 else 10.0) for i, m in enumerate(plan)],
+    }
+    werte = {}
+    with tempfile.TemporaryDirectory() as ordner:
+        with checkpoint.Checkpointspeicher(os.path.join(ordner, "lauf.ftc"), alle=alle) as cp:
+            original = list(stream.simulieren(eingaben, dt, zustand=START_PROFIL, checkpoints=cp))
+            for name, neu in szenarien.items():
+                beginn = time.perf_counter()
+                bericht = checkpoint.was_waere(cp, eingaben, original, neu, dt, toleranz=toleranz)
+                t_was_waere = time.perf_counter() - beginn
+                beginn = time.perf_counter()
+                ref = list(stream.simulieren(neu, dt, zustand=START_PROFIL, modellzustand=Modellzustand()))
+                t_ref = time.perf_counter() - beginn
+                werte["%s_anteil_gespart" % name] = bericht["anteil_gespart"]
+                werte["%s_konvergiert" % name] = bericht["konvergiert"]
+                werte["%s_speedup" % name] = t_ref / t_was_waere
+                werte["%s_T_Austritt_abw_K" % name] = max(abs(a["T_Austritt"] - b["T_Austritt"])
+                                                          for a, b in zip(bericht["ausgaben"], ref))
+                werte["%s_E_nutz_abw_rel" % name] = max(abs(a["E_nutz"] / b["E_nutz"] - 1)
+                                                        for a, b in zip(bericht["ausgaben"], ref))
+    return _report("what-if re-simulation", werte)
+
+
+@benchmark
+def parareal(n_stunden=48, fenster=8, toleranz=0.05):
+    """Parareal over the compressed example.py schedule against the serial run."""
+    start = model.startzustand(START_PROFIL)
+    return _report("parareal", parareal_zeit.vergleich(parareal_zeit.beispiel(n_stunden), 3600, start,
+                                                       fenster=fenster, toleranz=toleranz))
+
+
+@benchmark
+def surrogatmodell(n_szenarien=30, n_schritte=8, n_test=4, dt=900):
+    """Surrogate: training from the full model and open-loop errors on hold-out scenarios."""
+    beginn = time.perf_counter()
+    daten = surrogat.trainingsdaten(n_szenarien, n_schritte, dt, seed=0)
+    werte = {"proben": len(daten["x"]), "trainingsdaten_s": time.perf_counter() - beginn}
+    modell = surrogat.Surrogat.trainieren(daten)
+    werte.update(surrogat.fehlerbericht(modell, surrogat.szenarien(n_test, 12, dt, seed=1)))
+    return _report("surrogate model", werte)
+
+
+@benchmark
+def linearisierung(n_wiederholungen=3, dt=900, u0=(40.0, 85.0, 10.0), du=(10.0, 2.0, 5.0)):
+    """Time per A, B, c linearization and its prediction for changed inputs against a full step."""
+    _idle_schritt(0)                                                    # CSV-Zustand anlegen
+    csv = {pfad: os.stat(pfad).st_mtime_ns for pfad in glob.glob(cfg.SCRIPT_DIR + "*last_profile_*.csv")}
+    tank = Speicher()
+    tank.init(START_PROFIL)
+    for _ in range(2):
+        tank.step(dt, u0[0], -u0[0], u0[1], u0[2])
+    zustand = tank.get_state()
+    with linear.Linearisierer() as linearisierer:
+        linearisierer.linearisieren(zustand, dt, *u0)                   # Worker starten
+        beginn = time.perf_counter()
+        for _ in range(n_wiederholungen):
+            lin = linearisierer.linearisieren(zustand, dt, *u0)
+        t_lin = (time.perf_counter() - beginn) / n_wiederholungen
+    laeufe = 1 + len(lin["hoehen"]) + len(lin["eingaben"])
+
+    u = np.add(u0, du)
+    tank.step(dt, u[0], -u[0], u[1], u[2])
+    y_wahr = linear.ausgangshoehen(tank.zustand)
+    y_linear = lin["A"] @ lin["y0"] + lin["B"] @ u + lin["c"]
+    return _report("linearization", {
+        "worker": linearisierer.max_worker,
+        "laeufe": laeufe,
+        "linearisierung_s": t_lin,
+        "je_lauf_s": t_lin / laeufe,
+        "vorhersage_abw_K": float(np.max(np.abs(y_linear - y_wahr))),
+        "ohne_B_abw_K": float(np.max(np.abs(lin["y1"] - y_wahr))),
+        "csv_unveraendert": bool(csv) and csv == {pfad: os.stat(pfad).st_mtime_ns for pfad in csv},
+    })
+
+
+@benchmark
+def sensitivitaet_morris(n=3, faktoren=("inversion_d", "inversion_unten_d", "impuls_an_b_teiler", "U_Mantel"),
+                         abbruch=7):
+    """Morris study over four factors; a study stopped after `abbruch` runs and resumed gives the same indices."""
+    faktoren = {name: sensitivitaet.FAKTOREN[name] for name in faktoren}
+    szenario = sensitivitaet.standardszenario(1, 1)
+    durchgehend = sensitivitaet.studie("morris", n, faktoren, szenario)
+    with tempfile.TemporaryDirectory() as ordner:
+        pfad = os.path.join(ordner, "morris.jsonl")
+        teil = sensitivitaet.studie("morris", n, faktoren, szenario, pfad=pfad, max_laeufe=abbruch)
+        fortgesetzt = sensitivitaet.studie("morris", n, faktoren, szenario, pfad=pfad)
+    laeufe = durchgehend["laeufe"]
+    wichtigste = {ziel: max(je_faktor, key=lambda faktor: je_faktor[faktor]["mu_stern"])
+                  for ziel, je_faktor in durchgehend["indizes"].items()}
+    return _report("sensitivity (Morris)", {
+        "worker": os.cpu_count(),
+        "laeufe": laeufe,
+        "je_lauf_s": durchgehend["laufzeit_s"] / laeufe,
+        "abbruch_nach": teil["laeufe"],
+        "fortgesetzt_laeufe": fortgesetzt["laeufe"],
+        "fortgesetzt_abw": max(abs(werte[kennwert] - fortgesetzt["indizes"][ziel][faktor][kennwert])
+                               for ziel, je_faktor in durchgehend["indizes"].items()
+                               for faktor, werte in je_faktor.items() for kennwert in werte),
+        **{"wichtigster_" + ziel: faktor for ziel, faktor in wichtigste.items()},
+    })
+
+
+def run(namen=None):
+    """Run the benchmarks in `namen` (all if empty) and return their results."""
+    ergebnisse = {}
+    for name in namen or list(_BENCHMARKS):
+        ergebnisse[name] = _BENCHMARKS[name]()
+    return ergebnisse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("namen", nargs="*", metavar="name",
+                        help="benchmarks to run, one of %s (default: all)" % ", ".join(_BENCHMARKS))
+    args = parser.parse_args()
+    unbekannt = set(args.namen) - set(_BENCHMARKS)
+    if unbekannt:
+        parser.error("unknown benchmark(s): %s" % ", ".join(sorted(unbekannt)))
+    run(args.namen)
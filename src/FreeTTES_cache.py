@@ -0,0 +1,183 @@
+"""Cross-call caches for the TES tank model.
+
+Sweep and MPC workflows restart the model from ``t = 0`` thousands of times with
+the same configuration. :class:`ZustandsCache` keeps results keyed by a hash of
+their inputs in memory (LRU eviction) and optionally on disk. Entries are stored
+pickled, so every lookup returns an independent copy that the model may mutate.
+
+Optimization loops (MPC, dispatch search) evaluate the same step from the same
+state many times. :class:`SchrittCache` keeps whole time steps, keyed by the
+state record and the quantized inputs, within a memory budget.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+from FreeTTES_zustand import Modellzustand
+
+logger = logging.getLogger(__name__)
+
+
+# Module, deren Code das Ergebnis eines Schritts bestimmt
+_MODELL_MODULE = ("FreeTTES_model.py", "FreeTTES_kernels.py", "FreeTTES_index.py", "FreeTTES_io.py",
+                  "FreeTTES_config.py", "FreeTTES_zustand.py", "FreeTTES_outputs.py", "FreeTTES_echtzeit.py")
+
+
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    """Hash of the model sources, so that entries on disk are not reused after a code change."""
+    h = hashlib.blake2b(digest_size=8)
+    ordner = os.path.dirname(os.path.abspath(__file__))
+    for name in _MODELL_MODULE:
+        with open(os.path.join(ordner, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def schluessel(*teile) -> str:
+    """Stable hash of JSON-serialisable parts (dicts with float keys allowed)."""
+    h = hashlib.blake2b(digest_size=20)
+    for teil in teile:
+        if isinstance(teil, dict):
+            teil = sorted(teil.items(), key=lambda kv: str(kv[0]))
+        h.update(json.dumps(teil, sort_keys=True, default=repr).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class ZustandsCache:
+    """LRU cache of model states with optional on-disk persistence.
+
+    max_eintraege: number of entries held in memory
+    pfad: directory for the on-disk copy (``None`` = memory only)
+    max_bytes: memory budget of the pickled entries (``None`` = no limit)
+    """
+
+    def __init__(self, max_eintraege: int = 16, pfad: str | None = None, max_bytes: int | None = None):
+        self.max_eintraege = max_eintraege
+        self.pfad = pfad
+        self.max_bytes = max_bytes
+        self._eintraege: OrderedDict[str, bytes] = OrderedDict()
+        self.belegt = 0
+        self.treffer = 0
+        self.fehlgriffe = 0
+
+    def __len__(self):
+        return len(self._eintraege)
+
+    def __contains__(self, key):
+        return key in self._eintraege or (self.pfad is not None and os.path.exists(self._datei(key)))
+
+    def _datei(self, key):
+        return os.path.join(self.pfad, key + ".pkl")
+
+    def get(self, key):
+        """Return a fresh copy of the entry for `key`, or ``None``."""
+        daten = self._eintraege.get(key)
+        if daten is not None:
+            self._eintraege.move_to_end(key)
+        elif self.pfad is not None and os.path.exists(self._datei(key)):
+            with open(self._datei(key), "rb") as f:
+                daten = f.read()
+            self._merken(key, daten)
+        if daten is None:
+            self.fehlgriffe += 1
+            return None
+        self.treffer += 1
+        return pickle.loads(daten)
+
+    def put(self, key, wert):
+        """Store a copy of `wert` under `key`."""
+        daten = pickle.dumps(wert, protocol=pickle.HIGHEST_PROTOCOL)
+        self._merken(key, daten)
+        if self.pfad is not None:
+            os.makedirs(self.pfad, exist_ok=True)
+            tmp = self._datei(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(daten)
+            os.replace(tmp, self._datei(key))
+
+    def _merken(self, key, daten):
+        self.belegt += len(daten) - len(self._eintraege.get(key, b""))
+        self._eintraege[key] = daten
+        self._eintraege.move_to_end(key)
+        while self._eintraege and (len(self._eintraege) > self.max_eintraege
+                                   or self.max_bytes is not None and self.belegt > self.max_bytes):
+            alt, daten = self._eintraege.popitem(last=False)
+            self.belegt -= len(daten)
+            logger.debug("ZustandsCache: evicting %s", alt)
+
+    def statistik(self) -> dict:
+        """Entries, memory use in bytes, hits, misses and hit rate."""
+        anfragen = self.treffer + self.fehlgriffe
+        return {"eintraege": len(self._eintraege), "bytes": self.belegt, "treffer": self.treffer,
+                "fehlgriffe": self.fehlgriffe, "trefferquote": self.treffer / anfragen if anfragen else 0.0}
+
+    def clear(self):
+        """Drop all in-memory entries (files on disk are kept)."""
+        self._eintraege.clear()
+        self.belegt = 0
+        self.treffer = 0
+        self.fehlgriffe = 0
+
+
+class SchrittCache(ZustandsCache):
+    """Whole time steps of `main()`: state before the step and inputs -> state after it and outputs.
+
+    `main()` is deterministic given its state, inputs and parameters, so a hit
+    returns exactly what the step would compute. Inputs are rounded to multiples
+    of `quant` before hashing; steps closer than that share one entry.
+
+    max_bytes: memory budget, the least recently used steps are evicted beyond it
+    quant: resolution of the inputs in the key (0 = exact)
+    ausgaben: outputs kept per step (``None`` = all; every metric is then computed
+        once when the step is stored). Hits and misses both return only these.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2 ** 20, quant: float = 1e-6, ausgaben=None,
+                 pfad: str | None = None):
+        super().__init__(max_eintraege=float("inf"), pfad=pfad, max_bytes=max_bytes)
+        self.quant = quant
+        self.ausgaben = None if ausgaben is None else tuple(ausgaben)
+
+    @staticmethod
+    def zulaessig(*eingaben) -> bool:
+        """Only steps with scalar inputs are cached (no substep profiles)."""
+        return not any(callable(w) or np.ndim(w) > 0 for w in eingaben)
+
+    def schluessel(self, zustand: Modellzustand, eingaben, kontext: str = "") -> str:
+        """Hash of the state record (including its time), the quantized inputs, `kontext` and the code version.
+
+        kontext: hash of everything else the step depends on (parameters, options)
+        """
+        if self.quant:
+            eingaben = [round(float(w) / self.quant) for w in eingaben]
+        h = hashlib.blake2b(zustand.to_bytes(), digest_size=20)
+        h.update(repr(tuple(eingaben)).encode("ascii"))
+        h.update(kontext.encode("ascii"))
+        h.update(code_version().encode("ascii"))
+        return h.hexdigest()
+
+    def laden(self, key):
+        """``(Modellzustand, outputs)`` stored for `key`, or ``None``."""
+        eintrag = self.get(key)
+        if eintrag is None:
+            return None
+        zustand, ergebnis = eintrag
+        return Modellzustand.from_bytes(zustand), ergebnis
+
+    def speichern(self, key, zustand: Modellzustand, ergebnis):
+        """Store the state after the step and its outputs under `key`; returns the outputs as stored."""
+        if self.ausgaben is not None:
+            ergebnis = {k: ergebnis[k] for k in self.ausgaben}
+        self.put(key, (zustand.to_bytes(), ergebnis))
+        return ergebnis
@@ -0,0 +1,250 @@
+"""Indexed checkpoint store for restarting a long simulation at any past time.
+
+The ``sz/sz<t>.dat`` files only hold ``hPos;T`` and ``last_profile_*.csv`` only
+the latest state, so a segment of a long run can only be repeated from
+``t = 0``. :class:`Checkpointspeicher` appends the full state
+(:meth:`~FreeTTES_zustand.Modellzustand.to_bytes`) every `alle` time steps to
+one file::
+
+    b"FTC1"
+    per checkpoint: t in h (float64), length (uint32), state record
+
+The index time -> position is rebuilt from the record headers when the file is
+opened, so a state is found by its time in O(1) and read with one seek.
+:meth:`Checkpointspeicher.resume_from` re-runs a segment from the nearest
+earlier checkpoint::
+
+    with Checkpointspeicher("jahr.ftc", alle=24) as cp:
+        for ausgabe in stream.simulieren(zeilen("jahr.csv"), 3600, checkpoints=cp):
+            ...
+        for ausgabe in cp.resume_from(4000, zeilen("jahr.csv"), 3600, bis=4048):
+            ...
+
+:func:`was_waere` answers "what if" questions on a finished run: it re-simulates
+a modified input series only from the checkpoint before its first change and
+can stop as soon as the state is back on the original trajectory.
+"""
+
+from __future__ import annotations
+
+import bisect
+import itertools
+import os
+import struct
+
+import numpy as np
+
+import FreeTTES_stream as stream
+from FreeTTES_zustand import Modellzustand
+
+_KENNUNG = b"FTC1"
+_EINTRAG = struct.Struct("<dI")                 # Modellzeit in h, Länge des Zustandsdatensatzes
+
+
+def _schluessel(t):
+    """Index key of the time `t` in hours (milliseconds, robust against rounding of t)."""
+    return round(t * 3600e3)
+
+
+class Checkpointspeicher:
+    """Full model states of one simulation in a single indexed file.
+
+    pfad: checkpoint file; an existing file is opened and appended to
+    alle: a checkpoint is written every `alle` time steps (see :func:`FreeTTES_stream.simulieren`)
+    """
+
+    def __init__(self, pfad, alle=24):
+        self.pfad = pfad
+        self.alle = alle
+        self._index = {}                        # Schlüssel -> (Position, Länge)
+        self._zeiten = []                       # Zeiten der Checkpoints, sortiert
+        if os.path.exists(pfad) and os.path.getsize(pfad) > 0:
+            self._datei = open(pfad, "r+b")
+            self._einlesen()
+        else:
+            self._datei = open(pfad, "w+b")
+            self._datei.write(_KENNUNG)
+
+    def _einlesen(self):
+        """Rebuild the index from the record headers; a record cut off at the end is dropped."""
+        if self._datei.read(len(_KENNUNG)) != _KENNUNG:
+            raise ValueError("%s is no FreeTTES checkpoint file" % self.pfad)
+        groesse = os.fstat(self._datei.fileno()).st_size
+        pos = len(_KENNUNG)
+        while pos + _EINTRAG.size <= groesse:
+            self._datei.seek(pos)
+            t, laenge = _EINTRAG.unpack(self._datei.read(_EINTRAG.size))
+            if pos + _EINTRAG.size + laenge > groesse:
+                break
+            self._eintragen(t, pos + _EINTRAG.size, laenge)
+            pos += _EINTRAG.size + laenge
+        self._datei.truncate(pos)
+
+    def _eintragen(self, t, pos, laenge):
+        if _schluessel(t) not in self._index:
+            bisect.insort(self._zeiten, t)
+        self._index[_schluessel(t)] = (pos, laenge)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, t):
+        return _schluessel(t) in self._index
+
+    def __repr__(self):
+        return "Checkpointspeicher(%r, %d Checkpoints)" % (self.pfad, len(self))
+
+    @property
+    def zeiten(self):
+        """Times of all checkpoints in hours, ascending."""
+        return list(self._zeiten)
+
+    def schreiben(self, zustand: Modellzustand):
+        """Append `zustand` as the checkpoint at its time ``zustand.t``."""
+        daten = zustand.to_bytes()
+        pos = self._datei.seek(0, os.SEEK_END)
+        self._datei.write(_EINTRAG.pack(zustand.t, len(daten)) + daten)
+        self._datei.flush()
+        self._eintragen(zustand.t, pos + _EINTRAG.size, len(daten))
+
+    def laden(self, t) -> Modellzustand:
+        """State of the checkpoint at time `t` (KeyError if there is none)."""
+        try:
+            pos, laenge = self._index[_schluessel(t)]
+        except KeyError:
+            raise KeyError("no checkpoint at t = %g h in %s" % (t, self.pfad)) from None
+        self._datei.seek(pos)
+        return Modellzustand.from_bytes(self._datei.read(laenge))
+
+    def vor(self, t) -> float:
+        """Time of the latest checkpoint at or before `t`."""
+        k = bisect.bisect_right(self._zeiten, t + 0.5 / 3600e3)
+        if k == 0:
+            raise KeyError("no checkpoint at or before t = %g h in %s" % (t, self.pfad))
+        return self._zeiten[k - 1]
+
+    def resume_from(self, t, eingaben, dt, t0=0, bis=None, **kwargs):
+        """Re-run the simulation from time `t` without replaying it from `t0`.
+
+        The state is restored from the latest checkpoint at or before `t`; the
+        steps up to `t` are simulated again but not yielded.
+
+        Parameters:
+            t (float): first time step to yield, in hours
+            eingaben: the input rows of the whole run, starting at `t0` (e.g. :func:`FreeTTES_stream.zeilen`);
+                the rows before the checkpoint are skipped without simulating them
+            dt (int): timestep of the rows in seconds
+            t0 (float): time of the first row in hours
+            bis (float): end of the segment in hours (default: end of `eingaben`)
+            kwargs: further arguments of :func:`FreeTTES_stream.simulieren`
+
+        Yields:
+            one output record per time step from `t` on
+        """
+        t_cp = self.vor(t)
+        erste = round((t_cp - t0) * 3600 / dt)
+        letzte = None if bis is None else round((bis - t0) * 3600 / dt)
+        ueberspringen = round((t - t_cp) * 3600 / dt)
+        segment = stream.simulieren(itertools.islice(eingaben, erste, letzte), dt, t0=t_cp,
+                                    modellzustand=self.laden(t_cp), **kwargs)
+        yield from itertools.islice(segment, ueberspringen, None)
+
+    def schliessen(self):
+        self._datei.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.schliessen()
+
+
+def zustand_abweichung(a: Modellzustand, b: Modellzustand) -> dict:
+    """Largest differences between two states, per quantity.
+
+    Temperatures of water, foundation and wall and the impulse and mixing
+    proxies of the layers are compared on the cell positions of both states
+    (the cell grids of two runs differ), interpolating linearly. The layer
+    heights are compared through the water level, which sums them.
+
+    Returns:
+        dict: ``T`` in K, ``H_WS`` in m, ``I`` and ``M`` in m/s
+    """
+    abweichung = {"T": 0.0, "H_WS": 0.0, "I": 0.0, "M": 0.0}
+    for teil_a, teil_b, groessen in ((a.speicher, b.speicher, (("T", 0), ("I", 2), ("M", 3))),
+                                     (a.fundament, b.fundament, (("T", 0),)),
+                                     (a.kapazitaeten, b.kapazitaeten, (("T", 0),))):
+        if not teil_a or not teil_b:
+            continue
+        h_a, h_b = sorted(teil_a), sorted(teil_b)
+        h = np.union1d(h_a, h_b)
+        for groesse, i in groessen:
+            werte_a = [teil_a[k][i] for k in h_a]
+            werte_b = [teil_b[k][i] for k in h_b]
+            abweichung[groesse] = max(abweichung[groesse],
+                                      float(np.max(np.abs(np.interp(h, h_a, werte_a) - np.interp(h, h_b, werte_b)))))
+    if a.speicher and b.speicher:
+        h_WS_a = max(a.speicher) + a.speicher[max(a.speicher)][1] / 2
+        h_WS_b = max(b.speicher) + b.speicher[max(b.speicher)][1] / 2
+        abweichung["H_WS"] = abs(h_WS_a - h_WS_b)
+    return abweichung
+
+
+def was_waere(checkpoints, eingaben, original, neu, dt, t0=0, toleranz=None, toleranz_H_WS=1e-3,
+              toleranz_IM=1e-3, **kwargs):
+    """Outputs of a run with modified inputs, re-simulating only from where the inputs differ.
+
+    The state is restored from the latest checkpoint before the first changed
+    row. With `toleranz`, the run stops at the first checkpoint after the last
+    changed row where the state is back on the original one: temperatures
+    within `toleranz` K, water level within `toleranz_H_WS` m, impulse and mixing
+    proxies within `toleranz_IM` m/s. The original outputs are taken from there on.
+
+    Parameters:
+        checkpoints (Checkpointspeicher): checkpoints written by the original run
+        eingaben: input rows of the original run (sequence of dicts)
+        original: output records of the original run, one per row
+        neu: modified input rows, as many as `eingaben`
+        dt (int): timestep of the rows in seconds
+        t0 (float): time of the first row in hours
+        toleranz (float): convergence tolerance in K (``None``: simulate to the end)
+        toleranz_H_WS (float): convergence tolerance of the water level in m
+        toleranz_IM (float): convergence tolerance of the impulse and mixing proxies in m/s
+        kwargs: further arguments of :func:`FreeTTES_stream.simulieren`; `ausgaben`
+            must match the records in `original`
+
+    Returns:
+        dict with the outputs of the modified run (``ausgaben``), the first
+        changed row, the restored checkpoint, the row after which the state had
+        converged (``None`` if not), the simulated and total number of steps and
+        the fraction of steps saved against a full run
+    """
+    if len(neu) != len(eingaben) or len(original) != len(eingaben):
+        raise ValueError("eingaben, original and neu must have the same length")
+    geaendert = [i for i, (alt, zeile) in enumerate(zip(eingaben, neu)) if alt != zeile]
+    bericht = {"ausgaben": list(original), "erste_abweichung": None, "checkpoint": None,
+               "konvergiert": None, "simuliert": 0, "schritte": len(neu), "anteil_gespart": 1.0}
+    if not geaendert:
+        return bericht
+    erste, letzte = geaendert[0], geaendert[-1]
+    t_cp = checkpoints.vor(t0 + erste * dt / 3600)
+    start = round((t_cp - t0) * 3600 / dt)
+    zustand = checkpoints.laden(t_cp)
+    ausgaben = list(original[:erste])
+    konvergiert = None
+    for i, ausgabe in enumerate(stream.simulieren(iter(neu[start:]), dt, t0=t_cp,
+                                                  modellzustand=zustand, **kwargs), start):
+        if i >= erste:
+            ausgaben.append(ausgabe)
+        # Zustand nach Schritt i mit dem ursprünglichen Checkpoint vergleichen
+        if toleranz is not None and i >= letzte and zustand.t in checkpoints:
+            abweichung = zustand_abweichung(zustand, checkpoints.laden(zustand.t))
+            konvergiert = i if (abweichung["T"] <= toleranz and abweichung["H_WS"] <= toleranz_H_WS
+                                and max(abweichung["I"], abweichung["M"]) <= toleranz_IM) else None
+        if konvergiert is not None:
+            ausgaben.extend(original[i + 1:])
+            break
+    simuliert = i - start + 1
+    bericht.update(ausgaben=ausgaben, erste_abweichung=erste, checkpoint=t_cp, konvergiert=konvergiert,
+                   simuliert=simuliert, anteil_gespart=1 - simuliert / len(neu))
+    return bericht
@@ -73,6 +73,17 @@ def load_speicher_param(*, force_reload: bool = False) -> dict:
     return speicher_param
 
 
+def parameter(aenderungen=None) -> dict:
+    """Independent copy of the storage parameters from config.json with `aenderungen` applied.
+
+    Used for tank instances that run with their own parameters (``main(..., parameter=...)``).
+    """
+    param = dict(load_speicher_param())
+    param.update(aenderungen or {})
+    param["A_Quer"] = pi * param["R_innen"] ** 2
+    return param
+
+
 def ensure_initialized(*, force_config_reload: bool = False, **_ignored) -> dict:
     """Ensure folders exist and parameters are loaded; returns `speicher_param`.
 
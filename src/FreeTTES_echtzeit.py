@@ -0,0 +1,175 @@
+"""Deadline control and latency instrumentation for online use of the TES model.
+
+An online controller needs every `main()` call to return within a fixed budget.
+:class:`Frist` measures the elapsed time of one call, projects the time of the
+remaining substeps and switches on degradations one by one when the projection
+exceeds the budget. :class:`Latenzen` keeps the latencies of the last calls and
+reports their percentiles.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+# Degradationen in der Reihenfolge, in der sie zugeschaltet werden
+INVERSIONEN = "inversionen"     # Inversionsdurchläufe pro Schleife begrenzen
+TEILSCHRITTE = "teilschritte"   # verbleibende Subzeitschritte verlängern
+ZELLHOEHE = "zellhoehe"         # max_cell_height vergröbern
+STUFEN = (INVERSIONEN, TEILSCHRITTE, ZELLHOEHE)
+
+
+class Frist:
+    """Deadline of one `main()` call and the degradations applied to meet it.
+
+    With ``budget = 0`` the deadline is off: no stage is ever applied and the
+    attributes keep their neutral values. Otherwise :meth:`pruefen` is called
+    after every substep. If the elapsed time plus the remaining substeps at the
+    mean substep time since the last stage exceeds ``budget * (1 - reserve)``,
+    the next stage in `STUFEN` is applied:
+
+    - ``inversionen``: at most `max_inversionen` passes per inversion loop. The
+      remaining inversions are resolved in the following substeps.
+    - ``teilschritte``: the remaining substeps are `verlaengerung` times longer.
+    - ``zellhoehe``: `max_cell_height` is multiplied by `zellhoehe_faktor` for
+      the rest of the call.
+
+    When all stages are applied and the projection still exceeds the budget,
+    the substeps are lengthened again as long as more than one is left.
+    `stufen` lists the applied stages in order, `dt_faktor` is the total
+    lengthening of the substeps.
+
+    The inversion cap also applies as soon as the deadline itself has passed,
+    so that a single long inversion loop cannot overrun the budget by much.
+    """
+
+    def __init__(self, budget=0, start=None, reserve=0.1, max_inversionen=5,
+                 dt_faktor=2, zellhoehe_faktor=2.0):
+        self.budget = budget or 0
+        self.start = time.perf_counter() if start is None else start
+        self.reserve = reserve
+        self.stufen = []                                # angewendete Degradationen
+        self._max_inversionen = max_inversionen
+        self.verlaengerung = dt_faktor
+        self._zellhoehe_faktor = zellhoehe_faktor
+        # neutrale Werte, solange keine Stufe angewendet ist
+        self.max_inversionen = float("inf")
+        self.dt_faktor = 1
+        self.zellhoehe_faktor = 1.0
+        self._seit = self.start                         # Beginn der Mittelung (letzte Stufe)
+        self._schritte = 0
+
+    @classmethod
+    def aus_parametern(cls, speicher_param, start=None):
+        """Deadline from the ``echtzeit_*`` keys of the configuration."""
+        return cls(budget=speicher_param.get("echtzeit_budget", 0), start=start,
+                   reserve=speicher_param.get("echtzeit_reserve", 0.1),
+                   max_inversionen=speicher_param.get("echtzeit_max_inversionen", 5),
+                   dt_faktor=speicher_param.get("echtzeit_dt_faktor", 2),
+                   zellhoehe_faktor=speicher_param.get("echtzeit_zellhoehe_faktor", 2.0))
+
+    def verstrichen(self) -> float:
+        """Seconds since the start of the call."""
+        return time.perf_counter() - self.start
+
+    def _anwenden(self, stufe, jetzt):
+        if stufe == INVERSIONEN:
+            self.max_inversionen = self._max_inversionen
+        elif stufe == TEILSCHRITTE:
+            self.dt_faktor *= self.verlaengerung
+        elif stufe == ZELLHOEHE:
+            self.zellhoehe_faktor = self._zellhoehe_faktor
+        self.stufen.append(stufe)
+        self._seit = jetzt                              # Wirkung der Stufe neu mitteln
+        self._schritte = 0
+        return stufe
+
+    def pruefen(self, offen):
+        """Apply the next stage if `offen` more substeps would overrun the budget.
+
+        Returns the stage applied after this substep, or None.
+        """
+        if not self.budget:
+            return None
+        jetzt = time.perf_counter()
+        self._schritte += 1
+        if offen <= 0:
+            return None
+        dauer = (jetzt - self._seit) / self._schritte
+        prognose = jetzt - self.start + offen * dauer
+        if prognose <= self.budget * (1 - self.reserve):
+            return None
+        for stufe in STUFEN:
+            if stufe not in self.stufen:
+                return self._anwenden(stufe, jetzt)
+        if offen > 1:                                   # alle Stufen aktiv: weiter verlängern
+            return self._anwenden(TEILSCHRITTE, jetzt)
+        return None
+
+    def weiter(self, durchlauf) -> bool:
+        """True if another inversion pass may run after `durchlauf` passes of this loop.
+
+        Called before every pass of each inversion loop, with the passes that loop
+        has run so far. This is also where the deadline is checked inside a substep;
+        a pass that has started is not interrupted.
+        """
+        if durchlauf < self.max_inversionen:
+            return True
+        if self.max_inversionen < float("inf"):
+            return False
+        if (self.budget and durchlauf >= self._max_inversionen
+                and time.perf_counter() - self.start > self.budget):
+            self._anwenden(INVERSIONEN, time.perf_counter())    # Frist schon überschritten
+            return False
+        return True
+
+
+class Latenzen:
+    """Latencies of the last `max_eintraege` calls in seconds."""
+
+    def __init__(self, max_eintraege=10000):
+        self._werte = deque(maxlen=max_eintraege)
+        self.anzahl = 0                                 # alle Aufrufe seit dem letzten reset()
+        self.degradiert = 0                             # davon mit mindestens einer Degradation
+        self.stufen = dict.fromkeys(STUFEN, 0)
+
+    def __len__(self):
+        return len(self._werte)
+
+    def add(self, sekunden, stufen=()):
+        self._werte.append(sekunden)
+        self.anzahl += 1
+        if stufen:
+            self.degradiert += 1
+        for stufe in stufen:
+            self.stufen[stufe] += 1
+
+    def reset(self):
+        self._werte.clear()
+        self.anzahl = 0
+        self.degradiert = 0
+        self.stufen = dict.fromkeys(STUFEN, 0)
+
+    def perzentile(self, p=(50, 90, 95, 99)) -> dict:
+        """Percentiles of the kept latencies, e.g. ``{"p50": ..., "p99": ...}``."""
+        if not self._werte:
+            return {"p%g" % q: 0.0 for q in p}
+        werte = np.percentile(np.fromiter(self._werte, float), p)
+        return {"p%g" % q: float(w) for q, w in zip(p, werte)}
+
+    def statistik(self) -> dict:
+        """Call counts, degradations, mean, maximum and percentiles."""
+        werte = {"anzahl": self.anzahl, "degradiert": self.degradiert}
+        werte.update(("stufe_" + k, v) for k, v in self.stufen.items())
+        werte["mittel"] = float(np.mean(self._werte)) if self._werte else 0.0
+        werte["max"] = max(self._werte, default=0.0)
+        werte.update(self.perzentile())
+        return werte
+
+    def speichern(self, pfad):
+        """Write :meth:`statistik` as JSON to `pfad`."""
+        with open(pfad, "w", encoding="utf-8") as f:
+            json.dump(self.statistik(), f, indent=2)
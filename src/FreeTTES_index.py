@@ -0,0 +1,96 @@
+"""Height index over the layer stack of the TES tank model.
+
+The model state is a dict ``{hPos: [T, dh, I, M]}`` that the routines scan from
+the bottom or the top to find the layers in a diffuser band. :class:`Hoehenindex`
+holds the sorted positions and the cell edges, so that band lookups are a
+binary search; band averages then run over the band cells only.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+def naechster_index(h_such, all_h_pos) -> int:
+    """Index of the position in the sorted list `all_h_pos` closest to `h_such`.
+
+    On a tie the upper position wins, as in the former bisection loop.
+    """
+    og = min(max(bisect_left(all_h_pos, h_such), 1), len(all_h_pos) - 1)
+    ug = og - 1
+    if abs(h_such - all_h_pos[ug]) < abs(h_such - all_h_pos[og]):
+        return ug
+    return og
+
+
+class Hoehenindex:
+    """Sorted view of a `Speicherzustand` with cell edges.
+
+    The index is a snapshot: it refers to the cell lists of the state, but
+    positions, edges and sums are not updated when cells are added, removed or
+    resized. Build a new index after such changes.
+    """
+
+    def __init__(self, Speicherzustand):
+        self.h_pos = sorted(Speicherzustand)
+        self.zellen = [Speicherzustand[h] for h in self.h_pos]
+        self.theta = np.array([z[0] for z in self.zellen])
+        self.dh = np.array([z[1] for z in self.zellen])
+        h = np.array(self.h_pos)
+        # Kanten wie in den Modellroutinen aus hPos -/+ dh/2; nach __Modell_Aufraumen
+        # sind das die aufsummierten Zellhöhen
+        self.unten = h - self.dh / 2
+        self.oben = h + self.dh / 2
+
+    def __len__(self):
+        return len(self.h_pos)
+
+    @property
+    def h_WS(self) -> float:
+        """Water level (top edge of the highest cell)."""
+        return float(self.oben[-1])
+
+    def naechster(self, h_such) -> int:
+        """Index of the cell whose centre is closest to `h_such`."""
+        return naechster_index(h_such, self.h_pos)
+
+    def mitten(self, h_min, h_max) -> slice:
+        """Cells whose centre lies in ``[h_min, h_max]``."""
+        return slice(bisect_left(self.h_pos, h_min), bisect_right(self.h_pos, h_max))
+
+    def bereich(self, h_min, h_max) -> slice:
+        """Cells that overlap the band ``(h_min, h_max)``."""
+        return slice(int(np.searchsorted(self.oben, h_min, side="right")),
+                     int(np.searchsorted(self.unten, h_max, side="left")))
+
+    def anteile(self, h_min, h_max, hoehe=None):
+        """Cells overlapping the band and their overlap relative to the band height.
+
+        The shares are computed as in the former scan over all cells: 1 for a cell
+        covering the band, otherwise the overlap (from the edges or, inside the
+        band, the cell height) divided by `hoehe` (default ``h_max - h_min``).
+        """
+        s = self.bereich(h_min, h_max)
+        if hoehe is None:
+            hoehe = h_max - h_min
+        unten, oben = self.unten[s], self.oben[s]
+        anteile = np.where((unten <= h_min) & (oben >= h_max), 1.0,
+                           np.where(unten <= h_min, (oben - h_min) / hoehe,
+                                    np.where(oben <= h_max, self.dh[s] / hoehe,
+                                             (h_max - unten) / hoehe)))
+        return s, anteile
+
+    def mittel_theta(self, h_min, h_max, hoehe=None, von_oben=False) -> float:
+        """Height-weighted mean temperature in the band ``[h_min, h_max]``.
+
+        Summed cell by cell from the bottom or, with `von_oben`, from the top, in
+        the order of the former scan over all cells, which it reproduces exactly.
+        """
+        s, anteile = self.anteile(h_min, h_max, hoehe)
+        paare = list(zip(anteile.tolist(), self.theta[s].tolist()))
+        summe = 0
+        for anteil, theta in (reversed(paare) if von_oben else paare):
+            summe += anteil * theta
+        return summe
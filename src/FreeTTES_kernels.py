@@ -0,0 +1,432 @@
+"""Optional Numba kernels for the inversion, impulse and mixing loops.
+
+The loops in ``__Modell_Inversion``, ``__Modell_Impuls`` and
+``__Modell_Horizontalmischung`` walk from cell to cell and branch on every
+step, so NumPy cannot vectorize them. This module holds the same loops on a
+flat layer store (one float64 array each for position, T, dh, I and M) and
+compiles them with ``numba.njit`` when Numba can be imported. Without Numba the
+functions are plain Python and :data:`VERFUEGBAR` is ``False``; the model then
+keeps its own dict-based routines, which stay the reference implementation.
+The key ``numba_kernels`` selects the kernels in the model.
+
+The kernels repeat the property polynomials of
+``FreeTTES_model.__Temperatur_Abhaengige_Stoffwerte``. Compiled code evaluates
+``x**2`` as ``x*x``, so results can differ from the reference in the last bits.
+The ``numba`` benchmark reports the deviation.
+"""
+
+from __future__ import annotations
+
+import logging
+from itertools import chain
+from math import log
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numba
+except ImportError:                                                     # optional
+    numba = None
+
+VERFUEGBAR = numba is not None
+
+
+def _njit(func):
+    """Compile `func` with Numba (cached on disk) if available."""
+    if numba is None:
+        return func
+    return numba.njit(cache=True)(func)
+
+
+def felder(Speicherzustand):
+    """Flat layer store of `Speicherzustand`: the cell lists and the arrays h, T, dh, I, M."""
+    h_pos = sorted(Speicherzustand)
+    zellen = [Speicherzustand[h] for h in h_pos]
+    werte = np.fromiter(chain.from_iterable(zellen), np.float64, 4 * len(zellen)).reshape(-1, 4).T.copy()
+    return zellen, (np.array(h_pos, dtype=np.float64), werte[0], werte[1], werte[2], werte[3])
+
+
+def zurueckschreiben(zellen, arrays):
+    """Write T, dh, I, M back into the cell lists of the state."""
+    _, T, dh, I, M = arrays
+    for zelle, T_k, dh_k, I_k, M_k in zip(zellen, T.tolist(), dh.tolist(), I.tolist(), M.tolist()):
+        zelle[0] = T_k
+        zelle[1] = dh_k
+        zelle[2] = I_k
+        zelle[3] = M_k
+
+
+# Stoffwerte wie in FreeTTES_model.__Temperatur_Abhaengige_Stoffwerte
+@_njit
+def rho(theta):
+    return -2.525726E-03 * theta**2 - 2.123038E-01 * theta + 1.005011E+03
+
+
+@_njit
+def cp(theta):
+    return 9.776500E-03 * theta**2 - 7.677243E-01 * theta + 4.194836E+03
+
+
+@_njit
+def h(theta):
+    return 4.394221E-01 * theta**2 + 4.129877E+03 * theta + 1.987100E+03
+
+
+@_njit
+def beta_rho(theta):
+    return 9.699776E-09 * theta**2 - 7.361887E-06 * theta - 1.135069E-04
+
+
+@_njit
+def h_rev(enthalpie):
+    h_k = enthalpie / 1000
+    wert = -5.911685E-06 * h_k**2 + 2.420544E-01 * h_k - 4.700638E-01
+    for _ in range(2):
+        wert += (h_k * 1000 - h(wert)) / cp(wert)
+    return wert
+
+
+@_njit
+def _bilanz(T, dh, A_Quer):
+    masse = 0.0
+    energie = 0.0
+    for k in range(T.shape[0]):
+        masse += dh[k] * rho(T[k])
+        energie += dh[k] * rho(T[k]) * h(T[k])
+    return A_Quer * masse, A_Quer * energie
+
+
+@_njit
+def inversion(steigend, unten, Vp_zu, dt, A_Quer, konstanten, h_pos, T, dh, I, M):
+    """Kernel of ``__Modell_Inversion``.
+
+    konstanten: entrainment constants (d, e, f, g, h, j, d_unten, e_unten, f_unten, g_unten, h_unten, j_unten)
+
+    Returns 0, or 1 if a vanishing resting cell was merged with its neighbour
+    and the routine stopped early (the caller cleans up in both cases). Returns
+    2 if such a cell has no neighbour; the reference fails there as well.
+    """
+    n = T.shape[0]
+    # empirische Konstanten; im Modell überdeckt alt_g = 1.08 auch die Erdbeschleunigung g
+    d, e, f, g, h_, j, d_unten, e_unten, f_unten, g_unten, h_unten, j_unten = konstanten
+    any_inv = True
+    while any_inv:
+        any_inv = False
+        for schritt in range(n - 1):
+            i = n - 2 - schritt if steigend else schritt
+            V_b_lin_frac = 0.0
+            k_r_next = -1
+            if steigend:
+                k_b = i
+                k_r = i + 1
+                if i + 2 <= n - 1:
+                    k_r_next = i + 2
+            else:
+                k_b = i + 1
+                k_r = i
+                if i - 1 >= 0:
+                    k_r_next = i - 1
+            theta_r = T[k_r]
+            theta_b_kern = T[k_b]
+            theta_b_grenz = theta_r
+            theta_r_next = T[k_r_next] if k_r_next > -1 else 0.0
+            d_theta_inv = theta_b_kern - theta_r if steigend else theta_r - theta_b_kern
+            inv = False
+            BilanzMasse_1 = 0.0
+            BilanzEnergie_1 = 0.0
+            if d_theta_inv > 1.0E-09:
+                any_inv = True
+                inv = True
+                if d_theta_inv > 1E-00:
+                    BilanzMasse_1, BilanzEnergie_1 = _bilanz(T, dh, A_Quer)
+            counter = 0
+            while inv:
+                inv = False
+                if unten:
+                    f_inv_an_b = max(f_unten * dt, (d_unten * Vp_zu - e_unten) * dt)
+                else:
+                    f_inv_an_b = max(f * dt, (d * Vp_zu - e) * dt)
+                if M[k_b] == 0:
+                    f_inv_an_b = f * dt
+                if unten:
+                    f_inv_an_r = g_unten - d_theta_inv / h_unten - Vp_zu * j_unten
+                else:
+                    f_inv_an_r = g - d_theta_inv / h_ - Vp_zu * j
+                f_inv_an_r = max(f_inv_an_r, 0.0)
+                if M[k_b] == 0:
+                    f_inv_an_r = 0.5
+
+                V_b = dh[k_b] * A_Quer
+                if V_b < 1.0E-9:
+                    T[k_b] = T[k_r]
+                    break
+
+                V_b_lin = V_b * V_b_lin_frac
+                V_b_kern = V_b - V_b_lin
+                dh_r = dh[k_r]
+
+                if dh_r < 1.0E-12:                                      # ruhende Zelle mit der nächsten vermischen
+                    if k_r_next < 0:
+                        return 2
+                    m_r = A_Quer * dh_r * rho(T[k_r])
+                    m_r_next = A_Quer * dh[k_r_next] * rho(T[k_r_next])
+                    E_r = m_r * h(T[k_r])
+                    E_r_next = m_r_next * h(T[k_r_next])
+                    theta_misch = h_rev((E_r + E_r_next) / (m_r + m_r_next))
+                    dh[k_r] = 0.0
+                    T[k_r_next] = theta_misch
+                    dh[k_r_next] = (m_r + m_r_next) / rho(theta_misch) / A_Quer
+                    return 1
+
+                rho_b = rho(T[k_b])
+                rho_r = rho(theta_r)
+                d_rho_inv = rho_b - rho_r if steigend else rho_r - rho_b
+                d_V_an_b = min(f_inv_an_b * dh_r, dh_r * A_Quer * 0.99)
+
+                impulsQuad = I[k_b] ** 2
+                impulsQuad = (impulsQuad * (1 - 2 * log((V_b*rho_b + d_V_an_b*rho_r) / (V_b*rho_b)))
+                              - 2 * g * (d_rho_inv/rho_b) * dh_r)
+                impulsQuad = max(0.0, impulsQuad)
+                I[k_b] = impulsQuad**0.5
+                M[k_b] = M[k_b] * V_b / (d_V_an_b + V_b)
+
+                A = (V_b_kern + V_b_lin / 2) * (theta_b_kern - theta_b_grenz)\
+                    + d_V_an_b * (theta_r - theta_b_grenz)
+                C = V_b_kern + V_b_lin + d_V_an_b
+                if A / (theta_b_kern - theta_b_grenz) >= C / 2:
+                    V_b_kern = 2 * A / (theta_b_kern - theta_b_grenz) - C
+                    V_b_lin = C - V_b_kern
+                else:
+                    V_b_kern = 0.0
+                    V_b_lin = C
+                    theta_b_kern = 2 * A / C + theta_b_grenz
+
+                d_V_an_r = 0.0
+                if k_r_next > -1:
+                    beta = beta_rho(theta_r)
+                    d_hPos_next = abs(h_pos[k_r] - h_pos[k_r_next])
+                    if steigend:
+                        theta_grenz_impuls = theta_r_next - f_inv_an_r * impulsQuad / (-2 * g * beta * d_hPos_next)
+                    else:
+                        theta_grenz_impuls = theta_r_next - f_inv_an_r * impulsQuad / (2 * g * beta * d_hPos_next)
+                    if theta_b_kern != theta_b_grenz:
+                        d_V_an_r = V_b_lin * (theta_grenz_impuls - theta_b_grenz) / (theta_b_kern - theta_b_grenz)
+                    if steigend and (theta_grenz_impuls > theta_b_kern or theta_grenz_impuls < theta_b_grenz):
+                        d_V_an_r = 0.0
+                    if not steigend and (theta_grenz_impuls < theta_b_kern or theta_grenz_impuls > theta_b_grenz):
+                        d_V_an_r = 0.0
+                if d_V_an_r / A_Quer < 1E-06:
+                    d_V_an_r = 0.0
+
+                d_theta_b_grenz = 0.0
+                if d_V_an_r > 0:
+                    d_theta_b_grenz = (theta_b_kern - theta_b_grenz) * d_V_an_r / V_b_lin
+                theta_b_grenz += d_theta_b_grenz
+
+                dh_r -= d_V_an_b / A_Quer
+                theta_r = ((theta_r * dh_r * A_Quer + (theta_b_grenz - 0.5 * d_theta_b_grenz) * d_V_an_r)
+                           / (dh_r * A_Quer + d_V_an_r))
+                dh_r += d_V_an_r / A_Quer
+                V_b_lin -= d_V_an_r
+
+                V_b = V_b_lin + V_b_kern
+                if V_b == 0:
+                    break
+                V_b_lin_frac = V_b_lin / V_b
+                theta_b_misch = (V_b_kern * theta_b_kern + (theta_b_kern + theta_b_grenz) / 2 * V_b_lin) / V_b
+
+                dh[k_r] = V_b / A_Quer
+                dh[k_b] = dh_r
+                T[k_r] = theta_b_misch
+                T[k_b] = theta_r
+                I[k_r], I[k_b] = I[k_b], I[k_r]
+                M[k_r], M[k_b] = M[k_b], M[k_r]
+
+                counter += 1
+                k_r_next = -1
+                if steigend:
+                    if i + counter + 2 > n - 1:
+                        break
+                    k_b = i + counter
+                    k_r = i + counter + 1
+                    k_r_next = i + counter + 2
+                else:
+                    if i - counter - 1 < 0:
+                        break
+                    k_b = i - counter + 1
+                    k_r = i - counter
+                    k_r_next = i - counter - 1
+
+                theta_r = T[k_r]
+                theta_r_next = T[k_r_next]
+                d_theta_inv = T[k_b] - theta_r if steigend else theta_r - T[k_b]
+                inv = d_theta_inv > 0
+
+            if BilanzMasse_1 > 0:
+                BilanzMasse_2, BilanzEnergie_2 = _bilanz(T, dh, A_Quer)
+                m_alt = A_Quer * dh[k_b] * rho(T[k_b])
+                E_alt = m_alt * h(T[k_b])
+                m_neu = m_alt - (BilanzMasse_2 - BilanzMasse_1)
+                E_neu = E_alt - (BilanzEnergie_2 - BilanzEnergie_1)
+                theta_neu = h_rev(E_neu / m_neu)
+                T[k_b] = theta_neu
+                dh[k_b] = m_neu / A_Quer / rho(theta_neu)
+    return 0
+
+
+@_njit
+def impuls(steigend, Zeitabstand, teiler, A_Quer, T, dh, I, M):
+    """Kernel of ``__Modell_Impuls``; the caller zeroes small impulses and the boundary cell."""
+    n = T.shape[0]
+    g = 9.81
+    f_imp_an_b = Zeitabstand / teiler
+    richtung = 1 if steigend else -1
+    for schritt in range(n - 1):
+        k_start = n - 2 - schritt if steigend else schritt + 1
+        if I[k_start] <= 0 and M[k_start] <= 0:
+            continue
+        if M[k_start] > 0:
+            f_imp_an_b = 0.1 * dh[k_start] * A_Quer
+        f_imp_an_b = min(f_imp_an_b, A_Quer)
+        Impuls = I[k_start]
+        k_b = k_start
+        k_r = k_start + richtung
+        rho_b = rho(T[k_b])
+        while Impuls > 0:
+            theta_b = T[k_b]
+            theta_r = T[k_r]
+            V_b = dh[k_b] * A_Quer
+            dh_r = dh[k_r]
+            rho_r = rho(theta_r)
+            d_rho_inv = rho_b - rho_r if steigend else rho_r - rho_b
+
+            d_V_an_b = f_imp_an_b * dh_r
+            M[k_b] = M[k_b] * V_b / (d_V_an_b + V_b)
+
+            if Impuls**2 - g * d_rho_inv / rho_b * dh_r < 0:
+                Impuls = 0.0
+                I[k_b] = 0.0
+                break
+            Impuls_qdrt = (Impuls**2 * (1 - 2 * log((V_b * rho_b + d_V_an_b * rho_r) / (V_b * rho_b)))
+                           - 2 * g * d_rho_inv / rho_b * dh_r)
+            Impuls = 0.0 if Impuls_qdrt < 0 else Impuls_qdrt**0.5
+
+            theta_b = (V_b * theta_b * rho_b + d_V_an_b * theta_r * rho_r) / (V_b * rho_b + d_V_an_b * rho_r)
+            rho_neu = rho(theta_b)
+            V_b = (V_b * rho_b + d_V_an_b * rho_r) / rho_neu
+            dh_r -= d_V_an_b / A_Quer
+
+            dh[k_r] = V_b / A_Quer
+            dh[k_b] = dh_r
+            T[k_r] = theta_b
+            T[k_b] = theta_r
+            I[k_r], I[k_b] = Impuls, I[k_r]
+            M[k_r], M[k_b] = M[k_b], M[k_r]
+            rho_b = rho_neu
+
+            k_b = k_r
+            k_r += richtung
+            if k_r < 0 or k_r > n - 1:
+                break
+
+
+@_njit
+def horizontalmischung(i, dh_max, h_f_minus, h_pos, T, dh, M):
+    """Kernel of ``__Modell_Horizontalmischung`` for the active cell `i`."""
+    n = T.shape[0]
+    g = 9.81
+    counter_plus = 1
+    counter_minus = 1
+    mix_plus = True
+    mix_minus = True
+    v_wirk = M[i]
+    dh_drho_plus = 0.0
+    dh_drho_minus = 0.0
+    dh_plus_sum = 0.0
+    dh_minus_sum = 0.0
+    oberste_start = i >= n - 2
+    unterste_start = i <= 1
+    if oberste_start:
+        counter_plus = 0
+    if unterste_start:
+        counter_minus = 0
+
+    rho_i = rho(T[i])
+    while mix_plus or mix_minus:
+        k_plus = i + counter_plus
+        k_minus = i - counter_minus
+        dh_plus = dh[k_plus]
+        dh_plus_sum += dh_plus
+        dh_minus = dh[k_minus]
+        dh_minus_sum += dh_minus
+        theta_plus = T[k_plus]
+        theta_minus = T[k_minus]
+        rho_plus = rho(theta_plus)
+        rho_minus = rho(theta_minus)
+
+        dh_pot_plus = 0.0
+        if not (oberste_start or not mix_plus):
+            if rho_i == rho_plus:
+                dh_pot_plus = dh_plus
+            else:
+                dh_pot_plus = (rho_i / (2 * g) * v_wirk**2 - dh_drho_plus) / abs(rho_i - rho_plus)
+        dh_pot_minus = 0.0
+        if not (unterste_start or not mix_minus):
+            if rho_i == rho_minus:
+                dh_pot_minus = dh_minus
+            else:
+                dh_pot_minus = (rho_i / (2 * g) * v_wirk**2 - dh_drho_minus) / abs(rho_i - rho_minus)
+        dh_pot_minus = min(dh_pot_minus, dh_minus)
+        dh_pot_plus = min(dh_pot_plus, dh_plus)
+
+        mix_plus = dh_pot_plus > 1.0E-09 and not (dh_plus_sum > dh_max or oberste_start)
+        mix_minus = dh_pot_minus > 1.0E-09 and not (dh_minus_sum > dh_max or unterste_start)
+        if k_plus == n - 2 and dh_plus == 0:
+            mix_plus = False
+        if k_minus == 1 and dh_minus == 0:
+            mix_minus = False
+
+        dh_drho_plus += 1 * dh_pot_plus * abs(rho_i - rho_plus)
+        f_minus = (h_pos[k_minus] / h_f_minus) ** 2
+        f_minus = max(min(f_minus, 1.0), 0.1)
+        dh_drho_minus += f_minus * dh_pot_minus * abs(rho_i - rho_minus)
+
+        if mix_plus:
+            m = dh[i] * rho_i
+            m_plus = rho_plus * dh_pot_plus
+            H = m * h(T[i]) + m_plus * h(theta_plus)
+            T[i] = h_rev(H / (m + m_plus))
+            rho_i = rho(T[i])
+            dh[i] = (m + m_plus) / rho_i
+            M[i] = M[i] * m / (m + m_plus)
+            dh[k_plus] -= dh_pot_plus
+            if k_plus < n - 2:
+                counter_plus += 1
+
+        if mix_minus:
+            m = dh[i] * rho_i
+            m_minus = rho_minus * dh_pot_minus
+            H = m * h(T[i]) + m_minus * h(theta_minus)
+            T[i] = h_rev(H / (m + m_minus))
+            rho_i = rho(T[i])
+            dh[i] = (m + m_minus) / rho_i
+            M[i] = M[i] * m / (m + m_minus)
+            dh[k_minus] -= dh_pot_minus
+            if k_minus > 1:
+                counter_minus += 1
+
+
+def aufwaermen():
+    """Compile (or load from the disk cache) all kernels on a small dummy stack."""
+    h_pos = np.arange(0.1, 2.0, 0.2)
+    T = np.linspace(60.0, 40.0, h_pos.size)
+    dh = np.full(h_pos.size, 0.2)
+    I = np.zeros(h_pos.size)
+    M = np.zeros(h_pos.size)
+    konstanten = (15.6, 0.165, 0.123, 1.08, 25.0, 5.54, 3.0, 0.04, 0.03, 3.0, 10.0, 10.0)
+    inversion(True, False, 0.01, 60.0, 280.0, konstanten, h_pos, T.copy(), dh.copy(), I.copy(), M.copy())
+    impuls(True, 60.0, 3.0, 280.0, T.copy(), dh.copy(), I.copy(), M.copy())
+    M[5] = 0.1
+    horizontalmischung(5, 1.2, 2.25, h_pos, T.copy(), dh.copy(), M)
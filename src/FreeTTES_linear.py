@@ -0,0 +1,144 @@
+"""Linearized state-space model of one time step around an operating point.
+
+Linear MPC needs the tank as
+
+    y[k+1] = A y[k] + B u[k] + c
+
+with `y` the temperatures at a few heights (:data:`HOEHEN`) and
+``u = (m_VL, T_Zustrom, T_amb)`` (``m_RL = -m_VL``). :func:`linearisieren`
+computes A, B and the affine term c by finite differences of one
+:func:`FreeTTES_model.main` step:
+
+- a state perturbation adds ``delta`` to the cell temperatures, weighted with
+  the piecewise-linear hat function of one height (so exactly ``y_i`` changes
+  by ``delta``);
+- an input perturbation changes one input by its step in :data:`SCHRITTE`.
+
+Where the profile is nearly homogeneous, a warmer perturbation forms an
+inversion and is mixed upward, a colder one stays in place. The columns of A
+are then one-sided derivatives and do not add up like those of a linear
+model; ``zentral=True`` averages both directions.
+
+All runs start from copies of one in-memory base state: every worker of the
+process pool receives the state record once and decodes it once for all its
+perturbations. The runs use ``main(..., modellzustand=...)``, so the
+``last_profile_*.csv`` files of the process are neither read nor written.
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import FreeTTES_config as cfg
+import FreeTTES_model as model
+from FreeTTES_zustand import Modellzustand
+
+HOEHEN = (2.0, 6.0, 10.0, 14.0, 18.0, 22.0, 26.0, 30.0, 34.0, 38.0)
+EINGABEN = ("m_VL", "T_Zustrom", "T_amb")
+# Schrittweiten der finiten Differenzen: Temperaturen in K, Massenstrom in kg/s
+SCHRITTE = {"T": 0.1, "m_VL": 1.0, "T_Zustrom": 0.5, "T_amb": 1.0}
+
+
+def ausgangshoehen(zustand, hoehen=HOEHEN) -> np.ndarray:
+    """Water temperatures of `zustand` at `hoehen`, interpolated linearly between the cells."""
+    h = sorted(zustand.speicher)
+    return np.interp(hoehen, h, [zustand.speicher[k][0] for k in h])
+
+
+def _stoeren(zustand, hoehen, i, delta):
+    """Copy of `zustand` with the temperatures raised by `delta` times the hat function of height `i`."""
+    gestoert = zustand.kopie()
+    einheit = np.zeros(len(hoehen))
+    einheit[i] = delta
+    for hPos, werte in gestoert.speicher.items():
+        werte[0] += float(np.interp(hPos, hoehen, einheit))
+    return gestoert
+
+
+def _rechnen(basis, aufgaben, dt, eingaben, hoehen, parameter):
+    """Worker: one step per perturbation from the base state record; output temperatures per task."""
+    basis = Modellzustand.from_bytes(basis)                             # einmal je Worker dekodieren
+    ergebnisse = []
+    for art, i, delta in aufgaben:
+        if art == "zustand":
+            zustand = _stoeren(basis, hoehen, i, delta)
+        else:
+            zustand = basis.kopie()
+        u = dict(eingaben)
+        if art == "eingabe":
+            u[EINGABEN[i]] += delta
+        model.main(t=zustand.t, dt=dt, m_VL=u["m_VL"], m_RL=-u["m_VL"], T_Zustrom=u["T_Zustrom"],
+                   T_amb=u["T_amb"], modellzustand=zustand, parameter=parameter)
+        ergebnisse.append(ausgangshoehen(zustand, hoehen))
+    return ergebnisse
+
+
+class Linearisierer:
+    """Process pool computing linearizations; keep it open across MPC steps.
+
+    max_worker: number of processes (default: number of CPUs)
+    parameter: changes to SPEICHER_PARAMETER of config.json
+    """
+
+    def __init__(self, max_worker=None, parameter=None):
+        self.max_worker = max_worker or os.cpu_count() or 1
+        self.parameter = cfg.parameter(parameter) if parameter else None
+        self.pool = ProcessPoolExecutor(self.max_worker)
+
+    def linearisieren(self, zustand, dt, m_VL, T_Zustrom, T_amb, hoehen=HOEHEN, schritte=None, zentral=False):
+        """A, B and c of one step of `dt` seconds around `zustand` and the inputs.
+
+        schritte: step sizes replacing entries of :data:`SCHRITTE`
+        zentral: central instead of forward differences (twice the runs)
+
+        Returns a dict with ``A`` (len(hoehen) x len(hoehen)), ``B``
+        (len(hoehen) x 3), ``c``, the temperatures before (``y0``) and after the
+        unperturbed step (``y1``), ``hoehen`` and ``eingaben``.
+        """
+        schritte = dict(SCHRITTE, **(schritte or {}))
+        hoehen = tuple(float(h) for h in hoehen)
+        u0 = {"m_VL": float(m_VL), "T_Zustrom": float(T_Zustrom), "T_amb": float(T_amb)}
+        vorzeichen = (1, -1) if zentral else (1,)
+        aufgaben = [("basis", 0, 0.0)]
+        aufgaben += [("zustand", i, s * schritte["T"]) for i in range(len(hoehen)) for s in vorzeichen]
+        aufgaben += [("eingabe", i, s * schritte[name]) for i, name in enumerate(EINGABEN) for s in vorzeichen]
+
+        # Aufgaben gleichmäßig auf die Worker verteilen: je Worker ein Zustandsdatensatz
+        basis = zustand.to_bytes()
+        n = min(self.max_worker, len(aufgaben))
+        teile = [aufgaben[k::n] for k in range(n)]
+        laeufe = [self.pool.submit(_rechnen, basis, teil, dt, u0, hoehen, self.parameter) for teil in teile]
+        y = {}
+        for teil, lauf in zip(teile, laeufe):
+            y.update(zip(teil, lauf.result()))
+
+        def ableitung(art, i, schritt):
+            if zentral:
+                return (y[(art, i, schritt)] - y[(art, i, -schritt)]) / (2 * schritt)
+            return (y[(art, i, schritt)] - y[aufgaben[0]]) / schritt
+
+        A = np.column_stack([ableitung("zustand", i, schritte["T"]) for i in range(len(hoehen))])
+        B = np.column_stack([ableitung("eingabe", i, schritte[name]) for i, name in enumerate(EINGABEN)])
+        y0 = ausgangshoehen(zustand, hoehen)
+        y1 = y[aufgaben[0]]
+        u = np.array([u0[name] for name in EINGABEN])
+        return {"A": A, "B": B, "c": y1 - A @ y0 - B @ u, "y0": y0, "y1": y1,
+                "hoehen": hoehen, "eingaben": EINGABEN}
+
+    def schliessen(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.schliessen()
+
+
+def linearisieren(zustand, dt, m_VL, T_Zustrom, T_amb, max_worker=None, parameter=None, **kwargs):
+    """One linearization with a pool of its own (see :meth:`Linearisierer.linearisieren`)."""
+    with Linearisierer(max_worker, parameter) as linearisierer:
+        return linearisierer.linearisieren(zustand, dt, m_VL, T_Zustrom, T_amb, **kwargs)
@@ -15,9 +15,12 @@ import warnings
 import os
 #import sys
 import json
-from scipy import special, interpolate
+from scipy import special, interpolate, optimize
+from functools import lru_cache
 from math import log, pi, tan, exp
 import csv
+import time
+import threading
 # fuer excel datei lesen
 import numpy as np
 
@@ -31,6 +34,12 @@ import numpy as np
 
 import FreeTTES_config as _cfg
 import FreeTTES_io as _io
+import FreeTTES_index as _index
+import FreeTTES_outputs as _outputs
+import FreeTTES_cache as _cache
+import FreeTTES_kernels as _kernels
+import FreeTTES_echtzeit as _echtzeit
+import FreeTTES_zustand as _zustand
 
 import logging
 logger = logging.getLogger(__name__)
@@ -43,8 +52,12 @@ sz_folder = _cfg.sz_folder
 config_path = _cfg.config_path
 speicher_param = _cfg.speicher_param
 
+# Das Modell liest seine Parameter aus Modulglobalen: in einem Prozess läuft immer nur ein Aufruf
+modell_sperre = threading.RLock()
+
 # Backwards compatible aliases for the moved I/O functions
 __Modell_Ausgabe_Zeitschritt = _io.ausgabe_zeitschritt
+__Modell_find_index_h_pos = _index.naechster_index
 __Modell_letzter_Zustand = _io.letzter_zustand
 # // Speicherparameter definieren
 Speicherzustand_ = {}
@@ -65,8 +78,19 @@ def _sync_legacy_globals():
 vorgang = ""
 flag = False
 
+# Cache für den Startzustand bei t = 0, Schlüssel aus Konfiguration, vorgegebenem Profil und Modellcode.
+# Für einen Cache auf der Festplatte ersetzen: init_cache = _cache.ZustandsCache(pfad="...")
+init_cache = _cache.ZustandsCache(max_eintraege=16)
+# Nebenstrom-Hydraulik: gelöste Druckbilanzen (ohne Cache-Treffer), Brent-Iterationen und größte Iterationszahl
+nebenstrom_statistik = {"loesungen": 0, "iterationen": 0, "max_iterationen": 0}
+# Laufzeit der letzten main()-Aufrufe (Perzentile mit latenzen.statistik())
+latenzen = _echtzeit.Latenzen()
+# Frist des laufenden main()-Aufrufs (echtzeit_budget), liefert die aktuellen Degradationen
+_frist = _echtzeit.Frist()
+
 # // Routine, die die Speicherberechnungen durchführt und über ein Skript aufgerufen wird
-def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_uebernehmen=False, zustand={}, T_Abstrom=0, T_DR=None, T_RL = 60):
+def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_uebernehmen=False, zustand={}, T_Abstrom=0, T_DR=None, T_RL = 60,
+         modellzustand=None, parameter=None):
     """
     Hauptroutine, in der die gesamte Speichersimulation für einen Zeitschritt stattfindet. Wird über ein separates Skript aufgerufen.
 
@@ -77,35 +101,58 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
         m_RL (float): Massflow return line (!=-m_VL)
         T_Zustrom (float): Temeperature of entering water in °C
         T_amb (float): Ambient temperature in °C
+            m_VL, m_RL, T_Zustrom, T_amb and T_Abstrom may also be given per substep, as an
+            array splitting dt into equal intervals or as a function of the time in hours
         eingabe_volumen (bool): Whether volumetric or massflow is given 
         zustand_uebernehmen (bool): Start simulation with a given state (measured)
         zustand (dict): the actual height:temperature measured values if zustand_uebernehmen
         T_Abstrom (float): for validation purpose only (or when Volumetric flow is given) in °C
         T_DR (float): Temperature of the steam layer above water, in case its dynamic in °C
         T_RL (float): Temperature which defines the minimal useful temperature in °C
+        modellzustand (Modellzustand): state held in memory instead of the CSV files in datei/;
+            it is read at the start (if not empty) and updated at the end, no files are written
+        parameter (dict): SPEICHER_PARAMETER of this tank instead of config.json (see FreeTTES_config.parameter)
 
     Returns:
         outputs: Dictionary will various output values
+            (T_Austritt_sub: outlet temperature of every substep, -1 without outflow)
     """
-    # // Vorlauf- und Rücklaufvolumenströme korrekt zuordnen
-
-    # Normalerweise T_Abstrom ist eine gesuchte Größe, aber wenn man mit den Messwerten vergleicht,
-    # man weisst vorher die T_Abstrom aus den Begleitdaten des Betreibers
-    # die Eingaben des Betreibers sind nrmlws volumenstrom, und die das ganze Modell arbeitet mit Massestrom
-    # also an dieser Stelle muss man die Größen berechnen. 
-    if m_VL > 0:
-        vorgang = "beladen"
-        if eingabe_volumen:                                    
-            m_VL = m_VL * __Modell_Stoffwerte("rho",T_Zustrom) 
-            m_RL = m_RL * __Modell_Stoffwerte("rho",T_Abstrom) 
-    elif m_VL < 0:
-        vorgang = "entladen"
-        if eingabe_volumen:
-            m_VL = m_VL * __Modell_Stoffwerte("rho",T_Abstrom) 
-            m_RL = m_RL * __Modell_Stoffwerte("rho",T_Zustrom)
-    else:
-        vorgang = "stillstand"
-    logger.debug("vorgang=%s m_VL=%s m_RL=%s T_Zustrom=%s", vorgang, m_VL, m_RL, T_Zustrom)
+    global _frist, speicher_param
+    start_aufruf = time.perf_counter()
+    # // Eingaben je Subzeitschritt (konstant, Array über dt oder Funktion der Zeit)
+    profil = any(callable(w) or np.ndim(w) > 0 for w in (m_VL, m_RL, T_Zustrom, T_amb, T_Abstrom))
+    eingabe_profile = [__Modell_Profil(w, t, dt) for w in (m_VL, m_RL, T_Zustrom, T_amb, T_Abstrom)]
+
+    def eingaben(sekunden):
+        """Eingaben zum Zeitpunkt `sekunden` nach Beginn des Zeitschritts, Massenströme in kg/s."""
+        m_VL, m_RL, T_Zustrom, T_amb, T_Abstrom = (p(sekunden) for p in eingabe_profile)
+        # // Vorlauf- und Rücklaufvolumenströme korrekt zuordnen
+
+        # Normalerweise T_Abstrom ist eine gesuchte Größe, aber wenn man mit den Messwerten vergleicht,
+        # man weisst vorher die T_Abstrom aus den Begleitdaten des Betreibers
+        # die Eingaben des Betreibers sind nrmlws volumenstrom, und die das ganze Modell arbeitet mit Massestrom
+        # also an dieser Stelle muss man die Größen berechnen. 
+        if m_VL > 0:
+            vorgang = "beladen"
+            if eingabe_volumen:                                    
+                m_VL = m_VL * __Modell_Stoffwerte("rho",T_Zustrom) 
+                m_RL = m_RL * __Modell_Stoffwerte("rho",T_Abstrom) 
+        elif m_VL < 0:
+            vorgang = "entladen"
+            if eingabe_volumen:
+                m_VL = m_VL * __Modell_Stoffwerte("rho",T_Abstrom) 
+                m_RL = m_RL * __Modell_Stoffwerte("rho",T_Zustrom)
+        else:
+            vorgang = "stillstand"
+        logger.debug("vorgang=%s m_VL=%s m_RL=%s T_Zustrom=%s", vorgang, m_VL, m_RL, T_Zustrom)
+
+        # // Prüfen, ob Speichereintrittstemperatur innerhalb der Temperaturgrenzen liegt
+        if T_Zustrom > 105 or T_Zustrom < 25:
+            logger.error("T_Zustrom out of bounds: %s", T_Zustrom)
+            raise ValueError(f"Speichereintrittstemperatur ({T_Zustrom}) liegt nicht in den Temperaturgrenzen zwischen 25 und 105 °C")
+        return m_VL, m_RL, T_Zustrom, T_amb, T_Abstrom
+
+    m_VL, m_RL, T_Zustrom, T_amb, T_Abstrom = eingaben(0)
 
     t = t
     dt = dt
@@ -119,15 +166,12 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
     _cfg.ensure_initialized(force_config_reload=(t == 0), T_DR=T_DR)
     # Config loading re-binds the underlying dict; resync module-level aliases.
     _sync_legacy_globals()
+    if parameter is not None:                                                  # eigene Parameter der Speicherinstanz
+        speicher_param = parameter
     if T_DR is not None:                                                       # falls DR-Temperatur vorgegeben wurde, wird diese in eine Variable geschrieben
         speicher_param["T_DR"] = T_DR
-
-        
-
-    # // Prüfen, ob Speichereintrittstemperatur innerhalb der Temperaturgrenzen liegt
-    if T_Zustrom > 105 or T_Zustrom < 25:
-        logger.error("T_Zustrom out of bounds: %s", T_Zustrom)
-        raise ValueError(f"Speichereintrittstemperatur ({T_Zustrom}) liegt nicht in den Temperaturgrenzen zwischen 25 und 105 °C")
+    # Echtzeitbetrieb: bei drohender Überschreitung von echtzeit_budget wird der Aufruf vergröbert
+    _frist = frist = _echtzeit.Frist.aus_parametern(speicher_param, start_aufruf)
 
     # // Weitere Speicherparameter definieren
     # Diese Sachen hier finden keine Verwendung, aber können nutzvoll sein für tiefere Analyse
@@ -149,18 +193,19 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
     E_Verlust_Mantel_alle_dt_sub = 0
     Q_oben = 0
     H_Abstrom = 0
+    M_Abstrom = 0                                                       # abgeströmte Masse über alle Subzeitschritte
+    T_Austritt_sub = []                                                 # Austrittstemperatur je Subzeitschritt
     Fundamentzustand = {}
     Kapazitaeten = {}
     alle_Temperaturprofile  = {}
 
     # // Initialisierung des Speichers durchführen
+    # \\ aus dem Zustand im Speicher (Instanz), unabhängig von t
+    if modellzustand:
+        Speicherzustand, Fundamentzustand, Kapazitaeten = modellzustand.teile()
     # \\ bei t = 0 mit vorgegebenen Speicherparametern
-    if t == 0:
-        initial_Zustand = __Modell_Initialisierung(
-                                                speicher_param["H_UEB_start"],
-                                                speicher_param["Beladefaktor_start"],
-                                                0.00,
-                                                alle_Temperaturprofile={}, spline_uebernehmen=zustand_uebernehmen, zustand=zustand)
+    elif t == 0 or modellzustand is not None:
+        initial_Zustand = __Modell_Startzustand(zustand_uebernehmen, zustand)
         alle_Temperaturprofile = initial_Zustand[0]
         Speicherzustand = initial_Zustand[1]
         Fundamentzustand = initial_Zustand[2]
@@ -192,13 +237,28 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
 
     # // Schleife ueber alle Sub-Zeitschritte
     # ------------------------------------
-    dt_Modell = 60                                          # angestrebte Subzeitschrittweite
-    n_sub = round(dt / dt_Modell)                           # Anzahl an Subzeitschritten - berechnet mit Zeitschrittweite des Modells und übergebenem Zeitschritt von außen
+    dt_Modell = speicher_param.get("dt_sub", 60)             # angestrebte Subzeitschrittweite
+    n_sub = max(1, round(dt / dt_Modell))                   # Anzahl an Subzeitschritten - berechnet mit Zeitschrittweite des Modells und übergebenem Zeitschritt von außen
     dt_sub = dt / n_sub                                     # finale Subzeitschrittweite
-    for j in range(1, n_sub+1):                             # hier startet ein Subzeitschritt
-        counterInv = 0
+    # Fundament und Mantel reagieren viel langsamer als das Wasser und werden nur alle
+    # n_sub_fundament bzw. n_sub_mantel Subzeitschritte (und immer im letzten) nachgeführt.
+    # Die Wärme, die das Wasser in der Zwischenzeit an das Fundament abgibt, wird
+    # gesammelt und beim nächsten Fundamentschritt vollständig übergeben.
+    n_sub_Fundament = max(1, int(speicher_param.get("n_sub_fundament", 1)))
+    n_sub_Mantel = max(1, int(speicher_param.get("n_sub_mantel", 1)))
+    Q_Fundament_offen = 0                                   # J/m², vom Wasser abgegeben, im Fundament noch nicht verbucht
+    dt_Fundament_offen = 0
+    dt_Mantel_offen = 0
+    zeit_versatz = 0                                        # Zeit und Schritte vor der letzten Verlängerung der Subzeitschritte
+    j_versatz = 0
+    j = 0
+    while j < n_sub:                                        # hier startet ein Subzeitschritt
+        j += 1
         aktuellSekunden = t * 3600
-        ausgabezeit = (aktuellSekunden + dt_sub * j) / 3600 # in perl es ist string
+        ausgabezeit = (aktuellSekunden + zeit_versatz + dt_sub * (j - j_versatz)) / 3600 # in perl es ist string
+        if profil and j > 1:                                # Eingaben dieses Subzeitschritts
+            m_VL, m_RL, T_Zustrom, T_amb, T_Abstrom = eingaben(zeit_versatz + dt_sub * (j - 1 - j_versatz))
+        theta_ab = -1
         #print(j, ausgabezeit)
 
         # // Fall: Entladung durchführen - Zustrom
@@ -216,19 +276,19 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
                                                Speicherzustand)                     # neuen Speicherzustand nach Hinzufügen von Zellen unten berechnen
             Speicherzustand = __Modell_Aufraumen(Speicherzustand)                   # manchmal noetig weil dh wird zu 0
             # \\ Inversionen auflösen
-            counterInv = 0
+            counterInv_unten = 0                                                    # Durchläufe dieser Schleife
             Vp_zu = m_RL / __Modell_Stoffwerte("rho", T_Zustrom)
             start_inversion_status = __Modell_Inversionspruefung(Speicherzustand)   # überprüfen, ob Inversionen vorhanden sind
             inversion_status = start_inversion_status
-            while inversion_status != "keine":                                      # so lange Inversionen vorhanden sind, werden diese in der Schleife aufgelöst
-                counterInv += 1
+            while inversion_status != "keine" and frist.weiter(counterInv_unten):   # so lange Inversionen vorhanden sind, werden diese in der Schleife aufgelöst
+                counterInv_unten += 1
                 Speicherzustand = __Modell_Inversion(start_inversion_status,
                                                      "unten", 
                                                      Vp_zu, 
                                                      dt_sub, 
                                                      Speicherzustand)               #  Inversionen werden aufgelöst
                 Speicherzustand = __Modell_Aufraumen(Speicherzustand)               # Aufräumen des Speichers
-                if counterInv == 1:                                                 # beim ersten Durchlauf der Schleife wird das Impulsmodell durchgeführt
+                if counterInv_unten == 1:                                           # beim ersten Durchlauf der Schleife wird das Impulsmodell durchgeführt
                     Speicherzustand = __Modell_Impuls(start_inversion_status,
                                                       dt_sub,
                                                       Speicherzustand)
@@ -274,6 +334,7 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
             Masse_Global_Modellgrenzen += masse_ab    
             Energie_Global_Modellgrenzen += masse_ab * h_ab
             H_Abstrom += -masse_ab * h_ab
+            M_Abstrom += -masse_ab
             # zugefuehrte energie
             micro_energie = __Modell_Stoffwerte("cp", (T_Zustrom+theta_ab)/2 ) * m_VL * (T_Zustrom - theta_ab) * dt_sub
             macro_energie += micro_energie
@@ -293,20 +354,20 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
                                                Speicherzustand)                         # neuen Speicherzustand nach Hinzufügen von Zellen oben berechnen
 
             # \\ Inversionen auflösen
-            counterInv = 0
+            counterInv_oben = 0                                                         # Durchläufe dieser Schleife
             Vp_zu = m_VL / __Modell_Stoffwerte("rho", T_Zustrom)
             start_inversion_status = __Modell_Inversionspruefung(Speicherzustand)       # Prüfen, ob Inversionen vorhanden sind
             inversion_status = start_inversion_status
             Speicherzustand = __Modell_Aufraumen(Speicherzustand)
-            while inversion_status != "keine":                                          # Schleife läuft so lange, bis keine Inversionen mehr vorhanden sind
-                counterInv += 1
+            while inversion_status != "keine" and frist.weiter(counterInv_oben):        # Schleife läuft so lange, bis keine Inversionen mehr vorhanden sind
+                counterInv_oben += 1
 
 
                 Speicherzustand = __Modell_Inversion(start_inversion_status,
                                                      "oben", Vp_zu, dt_sub,
                                                      Speicherzustand)                   # Inversionen auflösen
                 Speicherzustand = __Modell_Aufraumen(Speicherzustand)                   # Speicher aufräumen
-                if counterInv == 1:
+                if counterInv_oben == 1:
                     Speicherzustand = __Modell_Impuls(start_inversion_status,
                                                        dt_sub, Speicherzustand)    # bei erstem Durchlauf der Schleife wird Impulsmodell durcgheführt
                     Speicherzustand = __Modell_Aufraumen(Speicherzustand)               # Speicher aufräumen
@@ -346,22 +407,22 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
             Masse_Global_Modellgrenzen += masse_ab
             Energie_Global_Modellgrenzen += masse_ab * h_ab
             H_Abstrom += -masse_ab * h_ab
+            M_Abstrom += -masse_ab
 
             #abgefuerhte energie
             micro_energie = __Modell_Stoffwerte("cp", (T_Zustrom+theta_ab)/2 ) * m_VL * (T_Zustrom - theta_ab)
             macro_energie += micro_energie
         # ende if m_VL < 0
-        # TODO counterInv ist eigenlich nicht noetig
 
         # // Zellgrößen anpassen (durch Teilen oder Zusammenlegen von Zellen)
         Speicherzustand = __Modell_Zellgroesse(j, "beides", Speicherzustand)
 
         # // Inversionen auflösen
-        counterInv = 1
+        counterInv_zellen = 0                                                           # Durchläufe dieser Schleife
         start_inversion_status = __Modell_Inversionspruefung(Speicherzustand)           # auf Inversionen prüfen
         inversion_status = start_inversion_status
-        while inversion_status != "keine":                                              # Schleife solange, bis alle Inversionen aufgelöst sind
-            counterInv += 1
+        while inversion_status != "keine" and frist.weiter(counterInv_zellen):          # Schleife solange, bis alle Inversionen aufgelöst sind
+            counterInv_zellen += 1
             Speicherzustand = __Modell_Inversion(start_inversion_status,
                                                  "nicht_definiert", 0, dt_sub,
                                                  Speicherzustand)                       # Inversionen auflösen
@@ -379,11 +440,29 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
 
         #Speicherzustand[max(list(Speicherzustand))][0] = theta_DR
 
-        Fundamentzustand, Speicherzustand = __Modell_Waermeleitung(dt_sub,
+        if n_sub_Fundament == 1:
+            Fundamentzustand, Speicherzustand = __Modell_Waermeleitung(dt_sub,
                                                         theta_DR,
                                                         speicher_param["q_Punkt_U"],
                                                         Fundamentzustand,
                                                         Speicherzustand)                    # neuen Speicher- und Fundamentzustand nach Wärmeleitung berechnen
+        else:
+            bilanz = {}
+            Fundamentzustand, Speicherzustand = __Modell_Waermeleitung(dt_sub,
+                                                        theta_DR,
+                                                        speicher_param["q_Punkt_U"],
+                                                        Fundamentzustand,
+                                                        Speicherzustand,
+                                                        bilanz)                             # Fundament eingefroren, nur das Wasser wird gelöst
+            Q_Fundament_offen += bilanz["q_Fundament"] * dt_sub
+            dt_Fundament_offen += dt_sub
+            if j % n_sub_Fundament == 0 or j == n_sub:
+                Fundamentzustand = __Modell_Waermeleitung_Fundament(dt_Fundament_offen,
+                                                        Q_Fundament_offen / dt_Fundament_offen,
+                                                        speicher_param["q_Punkt_U"],
+                                                        Fundamentzustand)
+                Q_Fundament_offen = 0
+                dt_Fundament_offen = 0
         all_h_pos = sorted(list(Speicherzustand))
         q_punkt_oben = (theta_DR - (theta_o_Rand+Speicherzustand[all_h_pos[-1]][0]) / 2)\
             / (Speicherzustand[all_h_pos[-1]][1]/2)\
@@ -395,11 +474,18 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
                           * speicher_param["A_Quer"] * dt_sub                               # Frage: Was wird hier berechnet? Ist das eine Größe für die Änderung der Energie?
         Q_oben += q_punkt_oben * speicher_param["A_Quer"] * dt_sub                          # Wärmemenge, die vom DR an das Wasser abgegeben wird
 
-        E_Verlust_Mantel, Kapazitaeten, Speicherzustand = __Modell_Kapazitaeten(
-                                                                    dt_sub,
+        dt_Mantel_offen += dt_sub
+        E_Verlust_Mantel = 0
+        if j % n_sub_Mantel == 0 or j == n_sub:
+            E_Verlust_Mantel, Kapazitaeten, Speicherzustand = __Modell_Kapazitaeten(
+                                                                    dt_Mantel_offen,
                                                                     T_amb,
                                                                     Kapazitaeten,
-                                                                    Speicherzustand)        # Verluste über den Mantel berechnen (Wärmeübertragung zwischen Wasser und Mantel sowie Mantel und Umgebung)
+                                                                    Speicherzustand,
+                                                                    stabil=n_sub_Mantel > 1 or frist.dt_faktor > 1)  # Verluste über den Mantel berechnen (Wärmeübertragung zwischen Wasser und Mantel sowie Mantel und Umgebung)
+            dt_Mantel_offen = 0
+            if speicher_param.get("mantel_gitter", "uniform") == "adaptiv":
+                Kapazitaeten = __Modell_Mantelgitter(Kapazitaeten, Speicherzustand)       # Mantelgitter der Thermokline nachführen
         
         Speicherzustand = __Modell_Aufraumen(Speicherzustand)                               # kleine Zellen löschen, neue hPos berechnen
         E_Verlust_Mantel_alle_dt_sub += E_Verlust_Mantel                                    # Verlust über Mantel über alle Subzeitschritte aufaddieren
@@ -416,6 +502,8 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
         #     v[2] = 0
         #     v[3] = 0
 
+        T_Austritt_sub.append(theta_ab)
+
         last = 1 if j==n_sub else 0                                                         # last wird 1, wenn letzter Zeitschritt erreicht ist, sonst 0
 
         # // Fuellstand und Bodendruck bestimmen
@@ -465,6 +553,8 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
         Energie_Speicher = speicher_param["A_Quer"] * sum(alle_H)                           # Energie im Speicherwasser aus Enthalpien berechnen
         Energie_Speicher += speicher_param["A_Quer"] * sum(alle_C_fundament)                # Energie im Fundament addieren
         Energie_Speicher += sum(alle_C_speicher)
+        Energie_Speicher += speicher_param["A_Quer"]\
+                            * (Q_Fundament_offen - speicher_param["q_Punkt_U"] * dt_Fundament_offen)  # noch nicht an das Fundament übergebene Wärme
         e_ges = sum(alle_H) * speicher_param["A_Quer"]/1E09                                      # Energie im Speichermantel addieren
         Energie_Bilanz_Speicher = Energie_Speicher - Energie_Global_Speicherzustand         # Differenz zu Energie vor dem Zeitschritt berechnen
         Ausgabewerte["m_Abw_global_in_kg"][ausgabezeit] = Masse_Bilanz_Speicher\
@@ -473,21 +563,28 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
                                             - Energie_Global_Modellgrenzen) / 1000          # Prüfen, ob im Speicher so viel Energie hinzugefügt wurde, wie
         Ausgabewerte["check"][ausgabezeit] = speicher_param["A_Quer"] * sum(alle_H)         # Frage: Was wird hier gecheckt?
         #Speicherzustand = zone_finden(Speicherzustand)
-        alle_Temperaturprofile = __Modell_Ausgabe_Zeitschritt(last,
+        if modellzustand is None:                                                           # Zustand im Speicher: keine Dateien
+            alle_Temperaturprofile = __Modell_Ausgabe_Zeitschritt(last,
                                                         ausgabezeit,
                                                         alle_Temperaturprofile,
                                                         Fundamentzustand,
                                                         Speicherzustand,
                                                         Kapazitaeten)                       # Temperaturprofile
 
+        # // Frist prüfen und ggf. die restlichen Subzeitschritte verlängern
+        if frist.pruefen(n_sub - j) == _echtzeit.TEILSCHRITTE:
+            zeit_versatz += dt_sub * (j - j_versatz)
+            j_versatz = j
+            n_rest = max(1, round((n_sub - j) / frist.verlaengerung))
+            dt_sub = dt_sub * (n_sub - j) / n_rest                                          # gleiche Restzeit in weniger Schritten
+            n_sub = j + n_rest
+
+    if modellzustand is not None:
+        modellzustand.setzen(Speicherzustand, Fundamentzustand, Kapazitaeten, t + dt / 3600)
 
     # // Rueckgabewerte bestimmen
     #----------------------------
-    m_Abstrom = 0
-    if m_VL < 0:
-        m_Abstrom = -m_VL * dt
-    if m_RL < 0:
-        m_Abstrom = -m_RL * dt
+    m_Abstrom = M_Abstrom                                   # bei Eingabeprofilen nicht m * dt
     T_Abstrom = -1
     if m_Abstrom > 0:
         T_Abstrom = __Modell_Stoffwerte("h_rev", H_Abstrom / m_Abstrom)
@@ -502,87 +599,172 @@ def main(t, dt, m_VL,  m_RL, T_Zustrom, T_amb, eingabe_volumen=False, zustand_ue
     lastKey = all_h_pos[-1]
     h_WS = lastKey + Speicherzustand[lastKey][1] / 2
     logger.debug("h_WS=%s", h_WS)
-    h_pos_OK_oberer_Diff = h_WS - speicher_param["H_WS_OK_Dif"]
-    logger.debug("h_pos_OK_oberer_Diff=%s", h_pos_OK_oberer_Diff)
-    T_grenz = speicher_param["T_grenz"]
-    m_nutz = __masse_nutz(Speicherzustand, h_WS)
-    m_nutz_momentan = __masse_nutz(Speicherzustand, h_WS, T_RL)
-    E_nutz = __energie_nutz(Speicherzustand, h_WS)
-    E_nutz_momentan = __energie_nutz(Speicherzustand, h_WS, T_RL)
-    if abs(m_RL) != 0:
-        t_bis_leer = m_nutz*1000 / abs(m_RL)
-    else:
-        t_bis_leer = "inf"
-    T_Diff_U = __Modell_Temperatur_Diffusorhoehe("unten", h_WS, Speicherzustand)
-    T_Diff_O = __Modell_Temperatur_Diffusorhoehe("oben", h_WS, Speicherzustand)
+    param = speicher_param                                  # Parameter dieses Aufrufs, main() kann sie vor dem Zugriff neu setzen
+    T_grenz = param["T_grenz"]
 
-    if T_Diff_O < T_grenz:
-        warnings.warn("Die mittlere Temperatur am oberen Diffusor T_Diff_O ist kleiner als die Grenztemperatur")
+    # Die Kennzahlen werden erst beim ersten Zugriff berechnet (s. FreeTTES_outputs),
+    # die meisten Kopplungen lesen nur T_Austritt und gelegentlich E_nutz.
+    def _T_Diff_O(o):
+        T_Diff_O = __Modell_Temperatur_Diffusorhoehe("oben", h_WS, Speicherzustand)
+        if T_Diff_O < T_grenz:
+            warnings.warn("Die mittlere Temperatur am oberen Diffusor T_Diff_O ist kleiner als die Grenztemperatur")
+        return T_Diff_O
 
-    m_nutz_max = __masse_nutz_max(Speicherzustand, h_WS)
+    def _mp_max_P_BL(o):
+        return param["Vp_max"] / 3600 * __Modell_Stoffwerte("rho", o["T_Diff_O"])
 
-    mp_max_P_BL = speicher_param["Vp_max"] / 3600 * __Modell_Stoffwerte("rho", T_Diff_O)
-    mp_max_P_EL = speicher_param["Vp_max"] / 3600 * __Modell_Stoffwerte("rho", T_Diff_U)
+    def _mp_max_P_EL(o):
+        return param["Vp_max"] / 3600 * __Modell_Stoffwerte("rho", o["T_Diff_U"])
 
-    mp_max_BL = min((m_nutz_max - m_nutz) * 1000 / dt , mp_max_P_BL)
-    mp_max_BL = max(mp_max_BL, 0)
-    mp_max_EL = min(m_nutz * 1000 / dt, mp_max_P_EL)
+    def _mp_max_BL(o):
+        mp_max_BL = min((o["m_nutz_max"] - o["m_nutz"]) * 1000 / dt , _mp_max_P_BL(o))
+        return max(mp_max_BL, 0)
 
-    mp_min_BL = speicher_param["Vp_min_rel"] * mp_max_P_BL
-    mp_min_EL = speicher_param["Vp_min_rel"] * mp_max_P_EL
+    def _mp_min(o):
+        mp_min_BL = param["Vp_min_rel"] * _mp_max_P_BL(o)
+        mp_min_EL = param["Vp_min_rel"] * _mp_max_P_EL(o)
+        return max(mp_min_EL, mp_min_BL)
 
-    mp_min = max(mp_min_EL, mp_min_BL)
+    def _t_bis_leer(o):
+        if abs(m_RL) != 0:
+            return o["m_nutz"] * 1000 / abs(m_RL)
+        return "inf"
 
     # // Verluste berechnen
-    Q_V_DR = -Q_oben / dt # Q_oben wird berechnet mit Bezug auf Dampftemperatur (T_DR - T_medium) also DR erwaermt das Medium
-    Q_V_Zyl = E_Verlust_Mantel_alle_dt_sub / dt
-    Q_V_Erd = speicher_param["q_Punkt_U"] * speicher_param["A_Quer"]
-    Q_V_ges = Q_V_Zyl + Q_V_Erd + Q_V_DR # Positive VERLUSTE
-
-    # locating the thermocline 
-    low_t = high_t = partial_volume_thermocline = charge_factor = thermocline_heights = None
-    thermocline_min_h = None
-    thermocline_max_h = None
+    # Q_oben wird berechnet mit Bezug auf Dampftemperatur (T_DR - T_medium) also DR erwaermt das Medium
+    Q_V_DR = lambda o: -Q_oben / dt
+    Q_V_Zyl = lambda o: E_Verlust_Mantel_alle_dt_sub / dt
+    Q_V_Erd = lambda o: param["q_Punkt_U"] * param["A_Quer"]
+    Q_V_ges = lambda o: o["Q_V_Zyl"] + o["Q_V_Erd"] + o["Q_V_DR"] # Positive VERLUSTE
+
     # // Rückgabewerte in eine Datei schreiben
-    outputs = {
+    werte = {
     "t" : t,
     "T_Austritt" : T_Abstrom,
-    "m_nutz" : m_nutz,
-    "m_nutz_momentan" : m_nutz_momentan,
-    "m_nutz_max" : m_nutz_max,
-    "E_nutz" : E_nutz,
-    "E_nutz_momentan" : E_nutz_momentan,
+    "T_Austritt_sub" : np.array(T_Austritt_sub),
+    "m_nutz" : lambda o: __masse_nutz(Speicherzustand, h_WS),
+    "m_nutz_momentan" : lambda o: __masse_nutz(Speicherzustand, h_WS, T_RL),
+    "m_nutz_max" : lambda o: __masse_nutz_max(Speicherzustand, h_WS),
+    "E_nutz" : lambda o: __energie_nutz(Speicherzustand, h_WS),
+    "E_nutz_momentan" : lambda o: __energie_nutz(Speicherzustand, h_WS, T_RL),
     "m_ges" : m_ges,
     "enthalpie_alle" : e_ges,
     "E_ges" : E_ges,
-    "T_Diff_U" : T_Diff_U,
-    "T_Diff_O" : T_Diff_O,
+    "T_Diff_U" : lambda o: __Modell_Temperatur_Diffusorhoehe("unten", h_WS, Speicherzustand),
+    "T_Diff_O" : _T_Diff_O,
     "Q_V_ges" : Q_V_ges,
     "Q_V_DR" : Q_V_DR,
     "Q_V_Zyl" : Q_V_Zyl,
     "Q_V_Erd" : Q_V_Erd,
-    "t_bis_leer" : t_bis_leer,
+    "t_bis_leer" : _t_bis_leer,
     "H_WS" : h_WS,
-    "mp_max_BL" : mp_max_BL,
-    "mp_max_EL" : mp_max_EL,
-    "mp_min" :  mp_min,
-    "untere_temperatur_mischzone" : low_t,
-    "obere_temperatur_mischzone" : high_t,
-    "untere_hoehe_mischzone" : thermocline_min_h,
-    "obere_hoehe_mischzone" : thermocline_max_h,
-    "mischzone_groesse_relativ" : partial_volume_thermocline,
-    "beladefaktor_nach_mischzone" : charge_factor,
-    "speicherzustand" : Speicherzustand
+    "mp_max_BL" : _mp_max_BL,
+    "mp_max_EL" : lambda o: min(o["m_nutz"] * 1000 / dt, _mp_max_P_EL(o)),
+    "mp_min" :  _mp_min,
+    "untere_temperatur_mischzone" : None,
+    "obere_temperatur_mischzone" : None,
+    "untere_hoehe_mischzone" : None,
+    "obere_hoehe_mischzone" : None,
+    "mischzone_groesse_relativ" : None,
+    "beladefaktor_nach_mischzone" : None,
+    "speicherzustand" : Speicherzustand,
+    "degradationen" : list(frist.stufen)
     }
+    # die Hilfsfunktionen lesen speicher_param: beim Zugriff gelten die Parameter dieses Aufrufs
+    outputs = _outputs.LazyOutputs({k: __Modell_mit_Parametern(param, v) if callable(v) else v
+                                    for k, v in werte.items()})
+    # alle nutzbaren Massen/Energien in einem vektorisierten Durchlauf, falls alle gebraucht werden
+    outputs.set_gruppe(("m_nutz", "m_nutz_momentan", "m_nutz_max", "E_nutz", "E_nutz_momentan"),
+                       __Modell_mit_Parametern(param, lambda o: __nutzbare_integrale(Speicherzustand, h_WS, T_RL)))
+    # locating the thermocline: alle sechs Kennzahlen aus einem Durchlauf
+    outputs.set_gruppe(("untere_temperatur_mischzone", "obere_temperatur_mischzone",
+                        "untere_hoehe_mischzone", "obere_hoehe_mischzone",
+                        "mischzone_groesse_relativ", "beladefaktor_nach_mischzone"),
+                       __Modell_mit_Parametern(param, lambda o: __Modell_Mischzone(Speicherzustand, h_WS)),
+                       einzeln=True)
 
     #outputs = Speicherzustand
 
+    latenzen.add(time.perf_counter() - start_aufruf, frist.stufen)
     return outputs
 
 # // Ab jetzt folgen die weiteren definierten Funktionen:
 # // ____________________________________________________
 
 
+def startzustand(zustand=None, parameter=None):
+    """
+    Startzustand eines Speichers im Arbeitsspeicher (wie main() bei t = 0).
+    zustand: gemessenes Profil Höhe:Temperatur, sonst aus H_UEB_start/Beladefaktor_start
+    parameter: SPEICHER_PARAMETER statt config.json
+     Modellzustand mit t = 0
+    """
+    global speicher_param
+    _cfg.ensure_initialized(force_config_reload=True)
+    _sync_legacy_globals()
+    if parameter is not None:
+        speicher_param = parameter
+    _, Speicherzustand, Fundamentzustand, Kapazitaeten = __Modell_Startzustand(zustand is not None, zustand or {})
+    return _zustand.Modellzustand(Speicherzustand, Fundamentzustand, Kapazitaeten, t=0.0)
+
+
+def __Modell_mit_Parametern(param, func):
+    """Wrap the lazy output `func` so that it is evaluated with the parameters `param`.
+
+    The helpers read the module global speicher_param, which a later call of
+    `main(..., parameter=...)` for another tank replaces before the output is read.
+    """
+    def auswerten(o):
+        global speicher_param
+        with modell_sperre:
+            vorher, speicher_param = speicher_param, param
+            try:
+                return func(o)
+            finally:
+                speicher_param = vorher
+    return auswerten
+
+def __Modell_Startzustand(zustand_uebernehmen, zustand):
+    """
+    Startzustand (Temperaturprofile, Speicher-, Fundament-, Mantelzustand) aus den Speicherparametern.
+    Bei gleicher Konfiguration, gleichem Startprofil und gleichem Modellcode wird er aus
+    init_cache genommen; Temperaturprofil, last_profile_*.csv und sz0.dat werden dann wie bei
+    der Initialisierung aus dem gecachten Zustand geschrieben.
+    """
+    init_schluessel = _cache.schluessel(speicher_param, bool(zustand_uebernehmen),
+                                        zustand if zustand_uebernehmen else {}, _cache.code_version())
+    initial_Zustand = init_cache.get(init_schluessel)
+    if initial_Zustand is not None:
+        _, Speicherzustand, Fundamentzustand, Kapazitaeten = initial_Zustand
+        __Modell_Ausgabe_Zeitschritt(1, 0.00, {}, Fundamentzustand,
+                                     Speicherzustand, Kapazitaeten)                 # Dateien des Initialzustands
+    else:
+        initial_Zustand = __Modell_Initialisierung(
+                                            speicher_param["H_UEB_start"],
+                                            speicher_param["Beladefaktor_start"],
+                                            0.00,
+                                            alle_Temperaturprofile={}, spline_uebernehmen=zustand_uebernehmen, zustand=zustand)
+        init_cache.put(init_schluessel, initial_Zustand)
+    return initial_Zustand
+
+
+def __Modell_Profil(wert, t, dt):
+    """
+    Eingabegröße als Funktion der Sekunden seit Beginn des Zeitschritts.
+    wert: Skalar (konstant über dt), Array (teilt dt in gleich lange Abschnitte) oder
+          Funktion der Zeit in Stunden (wie t)
+    """
+    if callable(wert):
+        return lambda sekunden: wert(t + sekunden / 3600)
+    if np.ndim(wert) == 0:
+        return lambda sekunden: wert
+    werte = np.asarray(wert, dtype=float)
+    if werte.ndim != 1 or len(werte) == 0:
+        raise ValueError("Eingabeprofil muss ein eindimensionales, nicht leeres Array sein")
+    n = len(werte)
+    return lambda sekunden: float(werte[min(int(sekunden * n / dt + 1e-9), n - 1)])   # Abschnitt, in dem der Subzeitschritt beginnt
+
+
 def __energie_nutz(sz: dict, h_ws: float, T_bezug: float = None) -> float:
     if T_bezug is None:
         T_bezug = speicher_param["T_grenz"]
@@ -636,6 +818,44 @@ def __masse_nutz(speicherzustand: dict, h_WS: float, T_bezug: float = None) -> f
     m_nutz_gesamt = speicher_param["A_Quer"] * m_nutz / 1000         # nutzbare Masse in Tonnen
     logger.debug("m_nutz_gesamt=%s", m_nutz_gesamt)
     return m_nutz_gesamt
+def __nutzbare_integrale(speicherzustand: dict, h_WS: float, T_RL: float) -> dict:
+    """
+    Berechnet m_nutz, m_nutz_momentan, m_nutz_max, E_nutz und E_nutz_momentan in einem
+    vektorisierten Durchlauf ueber alle Zellen. Entspricht __masse_nutz, __masse_nutz_max
+    und __energie_nutz bis auf die Summationsreihenfolge.
+    speicherzustand: Speicherzustand
+    h_WS: Höhe des Wasserspiegels
+     dict mit den fuenf Kennzahlen (Massen in Tonnen, Energien in GJ)
+    """
+    werte = np.array(list(speicherzustand.values()), dtype=float)
+    hPos = np.fromiter(speicherzustand.keys(), dtype=float, count=len(werte))
+    theta = werte[:, 0]
+    dh = werte[:, 1]
+    h_u = hPos - dh / 2                                                 # Unterkanten
+    h_o = hPos + dh / 2                                                 # Oberkanten
+    h_OK = h_WS - speicher_param["H_WS_OK_Dif"]                         # Oberkante des oberen Diffusors
+    h_UK = speicher_param["H_B_UK_Dif"]                                 # Unterkante des unteren Diffusors
+    rho = __Modell_Stoffwerte("rho", theta)
+    h = __Modell_Stoffwerte("h", theta)
+
+    # Zellhoehe zwischen den Diffusoren, Fallunterscheidung wie in __masse_nutz_max
+    dh_nutz = np.select([(h_u >= h_UK) & (h_o <= h_OK),
+                         (h_u < h_OK) & (h_o > h_OK),
+                         (h_o > h_UK) & (h_u < h_UK)],
+                        [dh, h_OK - h_u, h_o - h_UK], 0.0)
+    # Zellhoehe unter dem oberen Diffusor, Fallunterscheidung wie in __energie_nutz
+    dh_energie = np.select([h_o <= h_OK, h_u < h_OK], [dh, h_OK - h_u], 0.0)
+    m_nutz_zelle = dh_nutz * rho
+
+    ergebnis = {"m_nutz_max": speicher_param["A_Quer"] * m_nutz_zelle.sum() / 1000}
+    for suffix, T_bezug in (("", speicher_param["T_grenz"]), ("_momentan", T_RL)):
+        h_diff = h - __Modell_Stoffwerte("h", T_bezug)
+        ergebnis["m_nutz" + suffix] = (speicher_param["A_Quer"]
+                                       * m_nutz_zelle[theta >= T_bezug].sum() / 1000)
+        ergebnis["E_nutz" + suffix] = (speicher_param["A_Quer"]
+                                       * (dh_energie * rho * h_diff)[theta > T_bezug].sum() / 1E09)
+    return ergebnis
+
 def __masse_nutz_max(speicherzustand, h_WS):
     """
     Berechnet die Masse im Speicher in Tonnen, die maximal beladen werden kann (d. h. die Masse zwischen den Diffusoren)
@@ -658,6 +878,55 @@ def __masse_nutz_max(speicherzustand, h_WS):
     m_nutz_max = speicher_param["A_Quer"] * m_plug_nutz / 1000         # nutzbare Masse in Tonnen
     return m_nutz_max
 
+def __Modell_Mischzone(speicherzustand: dict, h_WS: float) -> dict:
+    """
+    Lokalisiert die Mischzone (Thermokline) in einem vektorisierten O(n)-Durchlauf.
+    Im aktiven Bereich (Unterkante unterer bis Oberkante oberer Diffusor) werden die
+    Schwellentemperaturen T_min + f * (T_max - T_min) mit f = mischzone_anteil_unten bzw.
+    mischzone_anteil_oben gebildet. Ihre Höhen ergeben sich aus dem ersten Überschreiten
+    im monoton gemachten Profil und dem Temperaturgradienten zwischen den Zellmitten.
+    Der Beladefaktor ist der Anteil des aktiven Bereichs oberhalb der Mitte (f = 0.5).
+    speicherzustand: Speicherzustand
+    h_WS: Höhe des Wasserspiegels
+     dict mit den sechs Mischzonen-Kennzahlen (None, wenn keine Mischzone vorliegt)
+    """
+    ergebnis = dict.fromkeys(("untere_temperatur_mischzone", "obere_temperatur_mischzone",
+                              "untere_hoehe_mischzone", "obere_hoehe_mischzone",
+                              "mischzone_groesse_relativ", "beladefaktor_nach_mischzone"))
+    werte = np.array([v for k, v in sorted(speicherzustand.items())], dtype=float)
+    dh = werte[:, 1]
+    hPos = np.cumsum(dh) - dh / 2                                       # Zellmitten
+    h_UK = speicher_param["H_B_UK_Dif"]
+    h_OK = h_WS - speicher_param["H_WS_OK_Dif"]
+    aktiv = (hPos >= h_UK) & (hPos <= h_OK)
+    if np.count_nonzero(aktiv) < 2:
+        return ergebnis
+    z = hPos[aktiv]
+    theta = np.maximum.accumulate(werte[aktiv, 0])                      # monoton steigendes Profil
+    T_min = werte[aktiv, 0].min()
+    dT = theta[-1] - T_min
+    if dT < speicher_param.get("mischzone_dT_min", 1.0):                # (nahezu) homogener Speicher
+        return ergebnis
+
+    anteile = np.array([speicher_param.get("mischzone_anteil_unten", 0.1), 0.5,
+                        speicher_param.get("mischzone_anteil_oben", 0.9)])
+    T_schwelle = T_min + anteile * dT
+    grad = np.diff(theta) / np.diff(z)                                  # Temperaturgradient zwischen den Zellmitten
+    i = np.clip(np.searchsorted(theta, T_schwelle), 1, len(z) - 1)      # erste Zelle oberhalb der Schwelle
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dz = np.where(grad[i - 1] > 0, (T_schwelle - theta[i - 1]) / grad[i - 1], 0.0)
+    h_schwelle = z[i - 1] + np.clip(dz, 0.0, z[i] - z[i - 1])
+    h_u, h_mitte, h_o = (float(x) for x in h_schwelle)
+
+    H_aktiv = h_OK - h_UK
+    ergebnis["untere_temperatur_mischzone"] = float(T_schwelle[0])
+    ergebnis["obere_temperatur_mischzone"] = float(T_schwelle[2])
+    ergebnis["untere_hoehe_mischzone"] = h_u
+    ergebnis["obere_hoehe_mischzone"] = h_o
+    ergebnis["mischzone_groesse_relativ"] = (h_o - h_u) / H_aktiv
+    ergebnis["beladefaktor_nach_mischzone"] = min(max((h_OK - h_mitte) / H_aktiv, 0.0), 1.0)
+    return ergebnis
+
 def __Modell_Temperaturabsenkung_rohr(T_in, mp, t_amb, method="VDI_2055"):
     lambda_iso = 0.0275 # W/m*K waermeleitkoeff
     lambda_rohr = 52.33 # W/m*K
@@ -1009,14 +1278,17 @@ def __Modell_Initialisierung(H_UEB=None, BeladeFaktor=None, iniZeitstempel=0.00,
     h_Fundament = lambda_Fundament \
                   * (theta_Kontakt - theta_Erdreich) \
                   / q_punkt_Erdreich                                                        # Höhe des Fundment wird BERECHNET! Frage: ist das so gewollt? Kennen wir nicht die exakte Höhe?
-    n_Fundament = 500                                                                       # Stützstellen im Fundament = Zellenanzahl
-    dh_Fundament = h_Fundament / n_Fundament                                                # Zellenhöhe
     theta_Grad_Fundament = q_punkt_Erdreich / lambda_Fundament                              # Temperaturgradient im Fundament in K/m
-    for i in range(0,n_Fundament):
-        hPos = -(i + 0.5) * dh_Fundament                                                    # Positionen der Zellen
-        theta = theta_Kontakt + hPos * theta_Grad_Fundament                                 # Temperatur der Zellen
-        Fundamentzustand[hPos] = [theta, dh_Fundament]                                      # Fundamentzustand schreiben
-    
+    dh_F = __Modell_Fundamentgitter(h_Fundament)                                            # Zellenhöhen von oben nach unten
+    if speicher_param.get("fundament_gitter", "uniform") == "uniform":
+        hPos_F = -(np.arange(len(dh_F)) + 0.5) * dh_F[0]                                    # Positionen der Zellen
+    else:
+        hPos_F = -(np.cumsum(dh_F) - dh_F / 2)
+    theta_F = theta_Kontakt + hPos_F * theta_Grad_Fundament                                 # Temperatur der Zellen
+    Fundamentzustand = {hPos: [theta, dh]
+                        for hPos, theta, dh in zip(hPos_F.tolist(), theta_F.tolist(),
+                                                   dh_F.tolist())}                          # Fundamentzustand schreiben
+
 
     # // Zustand Kapazitaeten feste Einbauten und Wand
     # Kapazitaeten sind nicht spezifisch!
@@ -1031,13 +1303,14 @@ def __Modell_Initialisierung(H_UEB=None, BeladeFaktor=None, iniZeitstempel=0.00,
     # Spline aus vertikalen Temperaturfeld bestimmen
     all_theta = [v[0] for k,v in sorted(Speicherzustand.items())]                           # Temperaturen aus Speicherzustand in eine Variable schreiben
     spline = interpolate.CubicSpline(all_h_pos,all_theta,bc_type="natural")                 # Spline für Temperatur im Speicher erstellen
-    for i in range(0, n_steps):
-        hPos = (i + 0.5) * dh_kapa                                                          # Position der Mantelzellen
-        if hPos < all_h_pos[-1]:
-            theta = float(spline(hPos))                                                            # wenn Mantelzelle unter Wasserspiegel liegt, wird Temperatur aus Spline verwendet
-        else:
-            theta = float(all_theta[-1])                                                           # über dem Wasserspiegel wird Temperatur auf Temperatur der obersten Speicherzelle gesetzt
-        Kapazitaeten[hPos] = [theta, dh_kapa, kapazitaet]                                   # Kapazitäten schreiben
+    hPos_K = (np.arange(n_steps) + 0.5) * dh_kapa                                           # Position der Mantelzellen
+    theta_K = np.where(hPos_K < all_h_pos[-1],
+                       spline(hPos_K),                                                      # wenn Mantelzelle unter Wasserspiegel liegt, wird Temperatur aus Spline verwendet
+                       all_theta[-1])                                                       # über dem Wasserspiegel wird Temperatur auf Temperatur der obersten Speicherzelle gesetzt
+    Kapazitaeten = {hPos: [theta, dh_kapa, kapazitaet]
+                    for hPos, theta in zip(hPos_K.tolist(), theta_K.tolist())}              # Kapazitäten schreiben
+    if speicher_param.get("mantel_gitter", "uniform") == "adaptiv":
+        Kapazitaeten = __Modell_Mantelgitter(Kapazitaeten, Speicherzustand)               # gleichmäßige Bereiche zusammenfassen
 
     alle_Temperaturprofile = __Modell_Ausgabe_Zeitschritt(1, iniZeitstempel,
                                                           alle_Temperaturprofile,
@@ -1048,6 +1321,49 @@ def __Modell_Initialisierung(H_UEB=None, BeladeFaktor=None, iniZeitstempel=0.00,
     #return Speicherzustand
     return alle_Temperaturprofile, Speicherzustand, Fundamentzustand, Kapazitaeten
 
+# // Funktion: Gitter im Fundament
+def fundament_zellenzahl(h_Fundament, dh_min=None, wachstum=None):
+    """
+    Empfohlene Zellenanzahl für das geometrisch gestufte Fundamentgitter: so viele Zellen,
+    dass bei erster Zellhöhe dh_min am Speicherboden und Wachstumsfaktor wachstum die Tiefe
+    h_Fundament erreicht wird.
+    h_Fundament: Tiefe des Fundaments in m
+    dh_min: Höhe der obersten Fundamentzelle in m (Standard: fundament_dh_min)
+    wachstum: Verhältnis der Höhen benachbarter Zellen (Standard: fundament_wachstum)
+     Zellenanzahl
+    """
+    if dh_min is None:
+        dh_min = speicher_param.get("fundament_dh_min", 0.01)
+    if wachstum is None:
+        wachstum = speicher_param.get("fundament_wachstum", 1.15)
+    if wachstum <= 1:
+        return max(1, int(np.ceil(h_Fundament / dh_min)))
+    return max(1, int(np.ceil(log(1 + h_Fundament * (wachstum - 1) / dh_min) / log(wachstum))))
+
+def __Modell_Fundamentgitter(h_Fundament):
+    """
+    Zellenhöhen des Fundaments vom Speicherboden nach unten.
+    fundament_gitter = "uniform": n_Fundament (Standard 500) gleich hohe Zellen
+    fundament_gitter = "geometrisch": fein am Speicherboden, nach unten um den Faktor
+    fundament_wachstum wachsend. Ohne n_Fundament wird fundament_zellenzahl() verwendet,
+    die erste Zellhöhe wird so gewählt, dass die Summe genau h_Fundament ergibt.
+    h_Fundament: Tiefe des Fundaments in m
+     numpy-Array der Zellenhöhen
+    """
+    gitter = speicher_param.get("fundament_gitter", "uniform")
+    n_Fundament = speicher_param.get("n_Fundament")
+    if gitter == "uniform":
+        n_Fundament = int(n_Fundament or 500)                                               # Stützstellen im Fundament = Zellenanzahl
+        return np.full(n_Fundament, float(h_Fundament / n_Fundament))
+    elif gitter == "geometrisch":
+        wachstum = speicher_param.get("fundament_wachstum", 1.15)
+        n_Fundament = int(n_Fundament or fundament_zellenzahl(h_Fundament, wachstum=wachstum))
+        if wachstum == 1:
+            return np.full(n_Fundament, float(h_Fundament / n_Fundament))
+        dh_0 = h_Fundament * (wachstum - 1) / (wachstum**n_Fundament - 1)
+        return dh_0 * wachstum ** np.arange(n_Fundament, dtype=float)
+    raise ValueError("fundament_gitter '%s' ist nicht bekannt (uniform, geometrisch)" % gitter)
+
 # // Funktion: Zellgrößen anpassen
 def __Modell_Zellgroesse(step, teilenZusammen, Speicherzustand):
     """
@@ -1057,7 +1373,19 @@ def __Modell_Zellgroesse(step, teilenZusammen, Speicherzustand):
     Speicherzustand: Speicherzustand
      Speicherzustand
     """
-    dh_max = speicher_param["max_cell_height"]                                                                    # maximal zulässige Zellenhöhe
+    dh_max = speicher_param["max_cell_height"] * _frist.zellhoehe_faktor                                          # maximal zulässige Zellenhöhe (im Echtzeitbetrieb ggf. vergröbert)
+    dh_plateau = speicher_param.get("plateau_dh_max", 0)                            # maximale Höhe einer Plateau-Zelle (0: aus)
+    if dh_plateau > dh_max:
+        h_pos_max = max(Speicherzustand)
+        h_WS = h_pos_max + Speicherzustand[h_pos_max][1] / 2
+        h_plateau_u = speicher_param["H_B_UK_Dif"] + speicher_param["H_RS_Dif"] + dh_max    # Plateaus nur zwischen den Diffusoren,
+        h_plateau_o = h_WS - speicher_param["H_WS_OK_Dif"] - speicher_param["H_RS_Dif"] - dh_max  # dort wird nicht entnommen oder eingeschichtet
+    else:
+        dh_plateau = 0
+
+    def im_plateau(hPos, dh):                                                       # Zelle darf größer als dh_max sein
+        return (dh_plateau > 0 and dh <= dh_plateau
+                and hPos - dh / 2 >= h_plateau_u and hPos + dh / 2 <= h_plateau_o)
 
     # maximal zullaessige zellenhoehe * Delta_theta
 
@@ -1080,7 +1408,7 @@ def __Modell_Zellgroesse(step, teilenZusammen, Speicherzustand):
                 theta_plus = Speicherzustand[hPos_plus][0]                          # Temperatur der Zelle darüber
                 dh_i = Speicherzustand[hPos][1]                                     # Größe der Zelle selbst
                 
-                if ((dh_i > dh_max)                                                 # wenn Zelle größer als maximal erlaubte Höhe ist
+                if ((dh_i > dh_max and not im_plateau(hPos, dh_i))                  # wenn Zelle größer als maximal erlaubte Höhe ist (außer in Plateaus)
                 or ((abs(theta_i - theta_minus))**0.75 * dh_i > dh_max_theta)       # oder die Temperaturdifferenz zwischen dieser und der unteren Zelle zu groß ist
                 or ((abs(theta_plus - theta_i))**0.75 * dh_i > dh_max_theta)):      # oder die Temperaturdifferenz zwischen dieser und der oberen Zelle zu groß ist
                     # with open("pyCheck.dat", "a") as f:
@@ -1147,7 +1475,7 @@ def __Modell_Zellgroesse(step, teilenZusammen, Speicherzustand):
             for i in [0, len(all_h_pos)-1]:                                         # oberste und unterste Speicherzelle
                 hPos = all_h_pos[i]
                 dh_i = Speicherzustand[hPos][1]
-                if dh_i > dh_max:
+                if dh_i > dh_max and not im_plateau(hPos, dh_i):
                     Speicherzustand_neu[hPos - dh_i / 4] = [
                                                     Speicherzustand[hPos][0],
                                                     dh_i / 2,
@@ -1213,8 +1541,44 @@ def __Modell_Zellgroesse(step, teilenZusammen, Speicherzustand):
 
     Speicherzustand = __Modell_Aufraumen(Speicherzustand)                               # kleine Zellen löschen und Positionen der Zellen neu bestimmen
 
+    # gleichmäßige Bereiche zu Plateau-Zellen zusammenfassen; sie werden oben wieder
+    # geteilt, sobald ein Temperaturgradient sie erreicht
+    if dh_plateau > 0 and teilenZusammen in ["beides", "zusammen"]:
+        Speicherzustand = __Modell_Plateaus(Speicherzustand, im_plateau,
+                                            dh_max_theta / f_hyst)
+
     return Speicherzustand
 
+# // Funktion: Plateaus zusammenfassen
+def __Modell_Plateaus(Speicherzustand, im_plateau, dh_max_theta):
+    """
+    Legt benachbarte Zellen fast gleicher Temperatur zu einer Zelle zusammen (plateau_dh_max).
+    Es gilt dasselbe Kriterium wie beim Teilen mit Hysterese, |dtheta|^0.75 * dh < dh_max_theta;
+    Masse und Enthalpie bleiben erhalten.
+    """
+    all_h_pos = sorted(Speicherzustand)
+    neu = {}
+    hPos_alt = all_h_pos[0]
+    theta_alt, dh_alt, I_alt, M_alt = Speicherzustand[hPos_alt]
+    for hPos in all_h_pos[1:]:
+        theta, dh, I, M = Speicherzustand[hPos]
+        uG = hPos_alt - dh_alt / 2
+        dh_neu = dh_alt + dh
+        if (I_alt == 0 and M_alt == 0 and I == 0 and M == 0
+                and im_plateau(uG + dh_neu / 2, dh_neu)
+                and abs(theta - theta_alt)**0.75 * dh_neu < dh_max_theta):
+            m_alt = dh_alt * __Modell_Stoffwerte("rho", theta_alt)
+            m = dh * __Modell_Stoffwerte("rho", theta)
+            theta_alt = __Modell_Stoffwerte("h_rev", (m_alt * __Modell_Stoffwerte("h", theta_alt)
+                                                      + m * __Modell_Stoffwerte("h", theta)) / (m_alt + m))
+            dh_alt = (m_alt + m) / __Modell_Stoffwerte("rho", theta_alt)
+            hPos_alt = uG + dh_alt / 2
+        else:
+            neu[hPos_alt] = [theta_alt, dh_alt, I_alt, M_alt]
+            hPos_alt, theta_alt, dh_alt, I_alt, M_alt = hPos, theta, dh, I, M
+    neu[hPos_alt] = [theta_alt, dh_alt, I_alt, M_alt]
+    return __Modell_Aufraumen(neu)
+
 # // Funktion: Aufräumen
 def __Modell_Aufraumen(Speicherzustand):
     """
@@ -1237,191 +1601,214 @@ def __Modell_Aufraumen(Speicherzustand):
 
     return Speicherzustand
 
+# // Funktion: Numba-Kernel für eine Routine verwenden?
+# \\ numba_kernels = "auto": nur die Inversion, sobald numba importiert werden kann. Impuls und Horizontal-
+# \\ mischung berühren nur wenige Zellen, dort kostet das Umkopieren des Speichers mehr als der Kernel spart.
+# \\ "alle": alle drei Kernel, "aus": immer die Python-Routinen
+def __Modell_Kernel_aktiv(routine):
+    modus = speicher_param.get("numba_kernels", "auto")
+    if not _kernels.VERFUEGBAR or modus == "aus":
+        return False
+    return modus == "alle" or routine == "inversion"
+
 # // Modell: Horizontalmischung
+# \\ Nur die unterste Zelle mit Mischungsproxy M > 0 (die neu eingeschichtete Diffusorschicht) wird mit
+# \\ ihren Nachbarn gemischt. Die Nachbarn ändern beim Mischen nur ihre Höhe, ihre Dichte und Enthalpie
+# \\ werden deshalb je Zelle nur einmal berechnet
 def __Modell_Horizontalmischung(Speicherzustand):
-    all_h_pos = sorted(list(Speicherzustand))
-
-    for i in range(0,len(all_h_pos)):
-        hPos = all_h_pos[i]
-        if Speicherzustand[hPos][3] <=0 :
-            continue
-        counter_plus = 1
-        counter_minus = 1
-        mix_plus = 1
-        mix_minus = 1
-        v_wirk = Speicherzustand[hPos][3]
-        dh_drho_plus = 0
-        dh_drho_minus = 0
-        dh_plus_sum = 0
-        dh_minus_sum = 0
-        dh_max = tan(6.5/180*pi)\
-                 * (speicher_param["R_innen"] - speicher_param["R_Dif"]) 
-        
-        oberste_start = 0
-        unterste_start = 0
-
-        if i >= len(all_h_pos) - 2:
-            oberste_start = 1
-            counter_plus = 0
-        if i <= 1:
-            unterste_start = 1
-            counter_minus = 0
-
-        while mix_plus==1 or mix_minus==1:
-            hPos_plus = all_h_pos[i+counter_plus]
-            hPos_minus = all_h_pos[i-counter_minus]
-            dh_plus = Speicherzustand[hPos_plus][1]
-            dh_plus_sum += dh_plus
-            dh_minus = Speicherzustand[hPos_minus][1]
-            dh_minus_sum += dh_minus
-            theta_plus = Speicherzustand[hPos_plus][0]
-            theta_minus = Speicherzustand[hPos_minus][0]
-
-            rho = __Modell_Stoffwerte("rho", Speicherzustand[hPos][0])
-            rho_plus = __Modell_Stoffwerte("rho", theta_plus)
-            rho_minus = __Modell_Stoffwerte("rho", theta_minus)
-
-            dh_pot_plus = 0
-            # B: ACHTUNG: bitte checken ob das eigentlich so ist (unless)
+    all_h_pos = sorted(Speicherzustand)
+    zellen = [Speicherzustand[hPos] for hPos in all_h_pos]
+    aktiv = [i for i, zelle in enumerate(zellen) if zelle[3] > 0]
+    if not aktiv:
+        return __Modell_Aufraumen(Speicherzustand)
+
+    dh_max = tan(6.5/180*pi) * (speicher_param["R_innen"] - speicher_param["R_Dif"])
+    h_f_minus = 1.5 * (speicher_param["H_B_UK_Dif"] + speicher_param["H_RS_Dif"])
+    if __Modell_Kernel_aktiv("horizontalmischung"):
+        _, arrays = _kernels.felder(Speicherzustand)
+        h_pos, T, dh, I, M = arrays
+        _kernels.horizontalmischung(aktiv[0], dh_max, h_f_minus, h_pos, T, dh, M)
+        _kernels.zurueckschreiben(zellen, arrays)
+        return __Modell_Aufraumen(Speicherzustand)
+    n = len(all_h_pos)
+    rho_nachbar = {}
+    h_nachbar = {}
+
+    def stoffwerte_nachbar(k):
+        if k not in rho_nachbar:
+            rho_nachbar[k] = __Modell_Stoffwerte("rho", zellen[k][0])
+            h_nachbar[k] = __Modell_Stoffwerte("h", zellen[k][0])
+        return rho_nachbar[k]
+
+    i = aktiv[0]
+    zelle = zellen[i]
+    counter_plus = 1
+    counter_minus = 1
+    mix_plus = 1
+    mix_minus = 1
+    v_wirk = zelle[3]
+    dh_drho_plus = 0
+    dh_drho_minus = 0
+    dh_plus_sum = 0
+    dh_minus_sum = 0
+
+    oberste_start = 0
+    unterste_start = 0
+
+    if i >= n - 2:
+        oberste_start = 1
+        counter_plus = 0
+    if i <= 1:
+        unterste_start = 1
+        counter_minus = 0
+
+    rho = __Modell_Stoffwerte("rho", zelle[0])
+    while mix_plus==1 or mix_minus==1:
+        k_plus = i + counter_plus
+        k_minus = i - counter_minus
+        zelle_plus = zellen[k_plus]
+        zelle_minus = zellen[k_minus]
+        dh_plus = zelle_plus[1]
+        dh_plus_sum += dh_plus
+        dh_minus = zelle_minus[1]
+        dh_minus_sum += dh_minus
+
+        rho_plus = stoffwerte_nachbar(k_plus)
+        rho_minus = stoffwerte_nachbar(k_minus)
+
+        # potentielle Mischhöhe aus dem Impuls der Schicht gegen den bisher verbrauchten Dichteunterschied
+        dh_pot_plus = 0
+        if not (oberste_start==1 or mix_plus==0):
             if rho == rho_plus:
-                if not(oberste_start==1 or mix_plus==0):
-                    dh_pot_plus = dh_plus
+                dh_pot_plus = dh_plus
             else:
-                if not (oberste_start==1 or mix_plus==0):
-                    dh_pot_plus = (rho / (2 * g) *v_wirk**2 - dh_drho_plus)\
-                                /abs(rho - rho_plus)
-            dh_pot_minus = 0
+                dh_pot_plus = (rho / (2 * g) *v_wirk**2 - dh_drho_plus) / abs(rho - rho_plus)
+        dh_pot_minus = 0
+        if not (unterste_start==1 or mix_minus==0):
             if rho == rho_minus:
-                if not (unterste_start==1 or mix_minus==0):
-                    dh_pot_minus = dh_minus
+                dh_pot_minus = dh_minus
             else:
-                if not (unterste_start==1 or mix_minus==0):
-                    dh_pot_minus = (rho / (2 * g) *v_wirk**2 - dh_drho_minus)\
-                                    /abs(rho - rho_minus)
-            dh_pot_minus = min(dh_pot_minus, dh_minus)
-            dh_pot_plus = min(dh_pot_plus, dh_plus)
+                dh_pot_minus = (rho / (2 * g) *v_wirk**2 - dh_drho_minus) / abs(rho - rho_minus)
+        dh_pot_minus = min(dh_pot_minus, dh_minus)
+        dh_pot_plus = min(dh_pot_plus, dh_plus)
 
+        mix_plus = 1 if dh_pot_plus > 1.0E-09 else 0
+        mix_minus = 1 if dh_pot_minus > 1.0E-09 else 0
+        if dh_plus_sum > dh_max or oberste_start == 1:
             mix_plus = 0
+        if dh_minus_sum > dh_max or unterste_start == 1:
             mix_minus = 0
-            if dh_pot_plus > 1.0E-09:
-                mix_plus = 1
-            if dh_pot_minus > 1.0E-09:
-                mix_minus= 1
-            
-            # B: ACHTUNG: abweichung von perl check if richtig
-            #FIXED
-            if dh_plus_sum > dh_max:
-                mix_plus = 0
-            if dh_minus_sum > dh_max:
-                mix_minus = 0
-            if oberste_start == 1:
-                mix_plus = 0
-            if unterste_start == 1:
-                mix_minus = 0
-            if (i + counter_plus == len(all_h_pos) - 2) and (dh_plus == 0):
-                mix_plus = 0
-            if (i - counter_minus == 1) and (dh_minus == 0):
-                mix_minus = 0
-
-            dh_drho_plus += 1 * dh_pot_plus * abs(rho - rho_plus)
-            # B: ACHTUNG: Abweichung vom PERL
-            f_minus = (hPos_minus / (1.5 * (speicher_param["H_B_UK_Dif"]+speicher_param["H_RS_Dif"]))) ** 2
-            f_minus = min(f_minus, 1)
-            f_minus = max(f_minus, 0.1)
-            dh_drho_minus += f_minus * dh_pot_minus * abs(rho - rho_minus)
-
-            if mix_plus == 1:
-                dh = Speicherzustand[hPos][1]
-                theta = Speicherzustand[hPos][0]
-                rho = __Modell_Stoffwerte("rho", theta)
-                m = dh * rho
-                m_plus = rho_plus * dh_pot_plus
-                H = m * __Modell_Stoffwerte("h", theta)\
-                    + m_plus * __Modell_Stoffwerte("h", theta_plus)
-                Speicherzustand[hPos][0] = __Modell_Stoffwerte("h_rev", (H/(m+m_plus)) )
-                rho = __Modell_Stoffwerte("rho",Speicherzustand[hPos][0])
-                Speicherzustand[hPos][1] = (m + m_plus) / rho
-                Speicherzustand[hPos][3] = Speicherzustand[hPos][3]*m / (m+m_plus)
-                Speicherzustand[hPos_plus][1] -= dh_pot_plus
-                if i + counter_plus < len(all_h_pos) - 2:
-                    counter_plus += 1
-            
-            if mix_minus == 1:
-                dh = Speicherzustand[hPos][1]
-                theta = Speicherzustand[hPos][0]
-                rho = __Modell_Stoffwerte("rho", theta)
-                m = dh * rho
-                m_minus = rho_minus * dh_pot_minus
-                H = m * __Modell_Stoffwerte("h", theta)\
-                    + m_minus * __Modell_Stoffwerte("h", theta_minus)
-                Speicherzustand[hPos][0] = __Modell_Stoffwerte("h_rev",
-                                                               H / (m + m_minus))
-                rho = __Modell_Stoffwerte("rho",Speicherzustand[hPos][0])
-                Speicherzustand[hPos][1] = (m + m_minus) / rho
-                Speicherzustand[hPos][3] = Speicherzustand[hPos][3]\
-                                           * m / (m + m_minus)
-                Speicherzustand[hPos_minus][1] -= dh_pot_minus
-                if i - counter_minus > 1:
-                    counter_minus += 1     
-       # ende While
-        break
-    # end for i in range()
+        if (k_plus == n - 2) and (dh_plus == 0):
+            mix_plus = 0
+        if (k_minus == 1) and (dh_minus == 0):
+            mix_minus = 0
+
+        dh_drho_plus += 1 * dh_pot_plus * abs(rho - rho_plus)
+        # B: ACHTUNG: Abweichung vom PERL
+        f_minus = (all_h_pos[k_minus] / h_f_minus) ** 2
+        f_minus = min(f_minus, 1)
+        f_minus = max(f_minus, 0.1)
+        dh_drho_minus += f_minus * dh_pot_minus * abs(rho - rho_minus)
+
+        if mix_plus == 1:
+            m = zelle[1] * rho
+            m_plus = rho_plus * dh_pot_plus
+            H = m * __Modell_Stoffwerte("h", zelle[0]) + m_plus * h_nachbar[k_plus]
+            zelle[0] = __Modell_Stoffwerte("h_rev", (H/(m+m_plus)) )
+            rho = __Modell_Stoffwerte("rho", zelle[0])
+            zelle[1] = (m + m_plus) / rho
+            zelle[3] = zelle[3]*m / (m+m_plus)
+            zelle_plus[1] -= dh_pot_plus
+            if k_plus < n - 2:
+                counter_plus += 1
+
+        if mix_minus == 1:
+            m = zelle[1] * rho
+            m_minus = rho_minus * dh_pot_minus
+            H = m * __Modell_Stoffwerte("h", zelle[0]) + m_minus * h_nachbar[k_minus]
+            zelle[0] = __Modell_Stoffwerte("h_rev", H / (m + m_minus))
+            rho = __Modell_Stoffwerte("rho", zelle[0])
+            zelle[1] = (m + m_minus) / rho
+            zelle[3] = zelle[3] * m / (m + m_minus)
+            zelle_minus[1] -= dh_pot_minus
+            if k_minus > 1:
+                counter_minus += 1
+    # ende While
     Speicherzustand = __Modell_Aufraumen(Speicherzustand)
     return Speicherzustand
 
 # // Funktion: Impuls
+# \\ Eine Schicht b mit Impuls I wandert in Richtung der Inversion (steigend nach oben, fallend nach unten),
+# \\ tauscht dabei den Platz mit der Nachbarschicht r und nimmt einen Teil von ihr auf. Die Zellen werden
+# \\ in umgekehrter Laufrichtung besucht, eine wandernde Schicht berührt deshalb nur schon besuchte Zellen
+# \\ und es genügt, die Zellen mit Impuls oder Mischungsproxy vorab zu bestimmen
 def __Modell_Impuls(inversion_status, Zeitabstand, Speicherzustand):
 
-    all_h_pos = sorted(list(Speicherzustand))
+    all_h_pos = sorted(Speicherzustand)
+    zellen = [Speicherzustand[hPos] for hPos in all_h_pos]
+    n = len(zellen)
+    A_Quer = speicher_param["A_Quer"]
     # empirisch
-    f_imp_an_b =  Zeitabstand / 3
+    teiler = speicher_param.get("impuls_an_b_teiler", 3)
+    f_imp_an_b =  Zeitabstand / teiler
 
-    for k,v in Speicherzustand.items():
-        if v[2] < 4E-03:
-            v[2] = 0
-    indices = [i for i in range(0, (len(Speicherzustand) - 1) )]
+    for zelle in zellen:
+        if zelle[2] < 4E-03:
+            zelle[2] = 0
     if inversion_status == "fallend":
-        Speicherzustand[all_h_pos[0]][2] = 0
+        zellen[0][2] = 0
+        richtung = -1
+        start = range(1, n)                                                     # b = i+1 für i = 0 ... n-2
     elif inversion_status == "steigend":
-        Speicherzustand[all_h_pos[-1]][2] = 0
-        indices.reverse()
-    n=0
-    for i in indices:
-        if inversion_status == "steigend":
-            hPos_b = all_h_pos[i]
-            hPos_r = all_h_pos[i+1]
-        elif inversion_status == "fallend":
-            hPos_b = all_h_pos[i+1]
-            hPos_r = all_h_pos[i]
-
-        Impuls = Speicherzustand[hPos_b][2]
-        if Speicherzustand[hPos_b][3] > 0:
-            f_imp_an_b = 0.1 * Speicherzustand[hPos_b][1] * speicher_param["A_Quer"]
-        f_imp_an_b = min(f_imp_an_b, speicher_param["A_Quer"])
-        counter = 0
+        zellen[-1][2] = 0
+        richtung = 1
+        start = range(n - 2, -1, -1)                                            # b = i für i = n-2 ... 0
+    else:
+        return __Modell_Aufraumen(Speicherzustand)
+
+    if __Modell_Kernel_aktiv("impuls"):
+        _, arrays = _kernels.felder(Speicherzustand)
+        _kernels.impuls(richtung == 1, float(Zeitabstand), float(teiler), A_Quer, *arrays[1:])
+        _kernels.zurueckschreiben(zellen, arrays)
+        return __Modell_Aufraumen(Speicherzustand)
+
+    # Dichte je Zelle, erst bei Bedarf berechnet und beim Tauschen mitgeführt
+    rho = [None] * n
+
+    def dichte(k):
+        if rho[k] is None:
+            rho[k] = __Modell_Stoffwerte("rho", zellen[k][0])
+        return rho[k]
+
+    for k_start in [k for k in start if zellen[k][2] > 0 or zellen[k][3] > 0]:
+        if zellen[k_start][3] > 0:
+            f_imp_an_b = 0.1 * zellen[k_start][1] * A_Quer
+        f_imp_an_b = min(f_imp_an_b, A_Quer)
+        Impuls = zellen[k_start][2]
+        k_b = k_start
+        k_r = k_start + richtung
         while Impuls > 0:
-            theta_b = Speicherzustand[hPos_b][0]
-            theta_r = Speicherzustand[hPos_r][0]
-
+            zelle_b = zellen[k_b]
+            zelle_r = zellen[k_r]
+            theta_b = zelle_b[0]
+            theta_r = zelle_r[0]
 
-            V_b = Speicherzustand[hPos_b][1] * speicher_param["A_Quer"]
-            dh_r = Speicherzustand[hPos_r][1]
+            V_b = zelle_b[1] * A_Quer
+            dh_r = zelle_r[1]
 
-
-            rho_b = __Modell_Stoffwerte("rho", theta_b)
-            rho_r = __Modell_Stoffwerte("rho", theta_r)
+            rho_b = dichte(k_b)
+            rho_r = dichte(k_r)
             if inversion_status == "steigend":
                 d_rho_inv = rho_b - rho_r
-            elif inversion_status == "fallend":
+            else:
                 d_rho_inv = rho_r - rho_b
-            
+
             d_V_an_b = f_imp_an_b * dh_r
-            Speicherzustand[hPos_b][3] = Speicherzustand[hPos_b][3]\
-                                         * V_b / (d_V_an_b + V_b)
-            
+            zelle_b[3] = zelle_b[3] * V_b / (d_V_an_b + V_b)
+
             if Impuls**2 - g * d_rho_inv / rho_b * dh_r < 0:
                 Impuls = 0
-                Speicherzustand[hPos_b][2] = 0
+                zelle_b[2] = 0
                 break
             Impuls_qdrt = (Impuls**2 * (1 
                                         - 2 * log((V_b * rho_b + d_V_an_b * rho_r)
@@ -1431,40 +1818,27 @@ def __Modell_Impuls(inversion_status, Zeitabstand, Speicherzustand):
                 Impuls = 0
             else:
                 Impuls = Impuls_qdrt**0.5
-            
+
             theta_b = (V_b * theta_b * rho_b + d_V_an_b * theta_r * rho_r)\
                       / (V_b * rho_b + d_V_an_b * rho_r)
-            V_b = (V_b * rho_b + d_V_an_b * rho_r)\
-                  / __Modell_Stoffwerte("rho",theta_b)
-            dh_r -= d_V_an_b / speicher_param["A_Quer"]
-
-            Speicherzustand[hPos_r][1] = V_b / speicher_param["A_Quer"]
-            Speicherzustand[hPos_b][1] = dh_r
-
-            Speicherzustand[hPos_r][0] = theta_b
-            Speicherzustand[hPos_b][0] = theta_r
-
-            tmp = Speicherzustand[hPos_r][2]
-            Speicherzustand[hPos_r][2] = Impuls
-            Speicherzustand[hPos_b][2] = tmp
-
-            tmp = Speicherzustand[hPos_r][3]
-            Speicherzustand[hPos_r][3] = Speicherzustand[hPos_b][3]
-            Speicherzustand[hPos_b][3] = tmp
-
-            counter += 1
-
-            if inversion_status == "steigend":
-                if i + counter + 1 > len(Speicherzustand) - 1:
-                    break
-                hPos_b = all_h_pos[i+counter]
-                hPos_r = all_h_pos[i+1+counter]
-            elif inversion_status == "fallend":
-                if i - counter < 0:
-                    break
-                hPos_b = all_h_pos[i+1-counter]
-                hPos_r = all_h_pos[i-counter]
-            n += 1
+            rho_neu = __Modell_Stoffwerte("rho", theta_b)
+            V_b = (V_b * rho_b + d_V_an_b * rho_r) / rho_neu
+            dh_r -= d_V_an_b / A_Quer
+
+            # Schicht b rückt auf den Platz von r, der Rest von r auf den Platz von b
+            zelle_r[1] = V_b / A_Quer
+            zelle_b[1] = dh_r
+            zelle_r[0] = theta_b
+            zelle_b[0] = theta_r
+            rho[k_r] = rho_neu
+            rho[k_b] = rho_r
+            zelle_r[2], zelle_b[2] = Impuls, zelle_r[2]
+            zelle_r[3], zelle_b[3] = zelle_b[3], zelle_r[3]
+
+            k_b = k_r
+            k_r += richtung
+            if k_r < 0 or k_r > n - 1:
+                break
     Speicherzustand = __Modell_Aufraumen(Speicherzustand)
     return Speicherzustand
 
@@ -1526,6 +1900,34 @@ def __Modell_Inversionspruefung(Speicherzustand):
 # // Funktion: Inversionen auflösen
 # Inversionen im Temperaturfeld aufloesen
 def __Modell_Inversion(inversion_status, unten_oben, Vp_zu, dt, Speicherzustand):
+    # empirische Einmischkonstanten (alt_d ... alt_j); alt_g überdeckt auch die Erdbeschleunigung g
+    d = speicher_param.get("inversion_d", 15.6)
+    e = speicher_param.get("inversion_e", 0.165)
+    f = speicher_param.get("inversion_f", 0.123)
+    g = speicher_param.get("inversion_g", 1.08)
+    h = speicher_param.get("inversion_h", 25)
+    j = speicher_param.get("inversion_j", 5.54)
+    # Einmischung am unteren Diffusor
+    d_unten = speicher_param.get("inversion_unten_d", 3)
+    e_unten = speicher_param.get("inversion_unten_e", 0.04)
+    f_unten = speicher_param.get("inversion_unten_f", 0.03)
+    g_unten = speicher_param.get("inversion_unten_g", 3)
+    h_unten = speicher_param.get("inversion_unten_h", 10)
+    j_unten = speicher_param.get("inversion_unten_j", 10)
+    if __Modell_Kernel_aktiv("inversion"):
+        if inversion_status not in ("steigend", "fallend"):
+            raise ValueError("'inversion_status' ist falsch")
+        zellen, arrays = _kernels.felder(Speicherzustand)
+        ergebnis = _kernels.inversion(inversion_status == "steigend", unten_oben == "unten", float(Vp_zu),
+                                      float(dt), speicher_param["A_Quer"],
+                                      (float(d), float(e), float(f), float(g), float(h), float(j),
+                                       float(d_unten), float(e_unten), float(f_unten),
+                                       float(g_unten), float(h_unten), float(j_unten)), *arrays)
+        if ergebnis == 2:
+            raise ValueError("Inversion: verschwindende ruhende Zelle ohne Nachbarzelle")
+        _kernels.zurueckschreiben(zellen, arrays)
+        return __Modell_Aufraumen(Speicherzustand)
+
     all_h_pos = sorted(list(Speicherzustand))
     any_inv = True
     all_inv_counter = 0
@@ -1597,21 +1999,9 @@ def __Modell_Inversion(inversion_status, unten_oben, Vp_zu, dt, Speicherzustand)
                 """
 
 
-                alt_d = 15.6
-                alt_e = 0.165
-                alt_f = 0.123
-                alt_g = 1.08
-                alt_h = 25
-                alt_j = 5.54
-                d = alt_d * 1
-                e = alt_e * 1
-                f = alt_f * 1
-                g = alt_g * 1
-                h = alt_h * 1
-                j = alt_j * 1
                 if unten_oben =="unten":
-                    f_inv_an_b = (3 * Vp_zu - 0.04) * dt
-                    f_inv_an_b = max(0.03 * dt, f_inv_an_b)
+                    f_inv_an_b = (d_unten * Vp_zu - e_unten) * dt
+                    f_inv_an_b = max(f_unten * dt, f_inv_an_b)
                 else: 
                     
                     f_inv_an_b = (d * Vp_zu - e) * dt
@@ -1620,7 +2010,7 @@ def __Modell_Inversion(inversion_status, unten_oben, Vp_zu, dt, Speicherzustand)
                 if Speicherzustand[hPos_b][3] == 0:
                     f_inv_an_b = f * dt
                 if unten_oben == "unten":
-                    f_inv_an_r = 3 - d_theta_inv / 10 - Vp_zu * 10
+                    f_inv_an_r = g_unten - d_theta_inv / h_unten - Vp_zu * j_unten
                 else:
                     f_inv_an_r = g - d_theta_inv / h - Vp_zu * j
                 f_inv_an_r = max(f_inv_an_r, 0)
@@ -1837,8 +2227,9 @@ def __Modell_Zustrom(unten_oben, aktuellSekunden, ausgabezeit, Begleitdaten,
     Es werden die Position und Eigenschaften der Zell berechnet.
     
     """
-    all_h_pos = sorted(list(Speicherzustand))
-    h_WS = max(all_h_pos) + Speicherzustand[max(all_h_pos)][1] / 2
+    index = _index.Hoehenindex(Speicherzustand)
+    all_h_pos = index.h_pos
+    h_WS = index.h_WS
     if unten_oben == "unten":
         h_zu_min = speicher_param["H_B_UK_Dif"] + 0.01 * speicher_param["H_RS_Dif"]
         h_zu_max = speicher_param["H_B_UK_Dif"] + 0.99 * speicher_param["H_RS_Dif"]
@@ -1869,32 +2260,15 @@ def __Modell_Zustrom(unten_oben, aktuellSekunden, ausgabezeit, Begleitdaten,
 
     # das Plug im Hoehenbereich bestimmen, dessen Temperatur am naechsten an der Zu-
     # trittstemperatur liegt, diesem dann das Fluid zufuehren
-    if unten_oben == "unten":
-        for hPos in all_h_pos:
-            if hPos < h_zu_min:
-                continue
-            elif (hPos <= h_zu_max and hPos >= h_zu_min):
-                if abs(theta_zu - Speicherzustand[hPos][0]) < d_theta_h_zu_theta:
-                    h_zu_theta = hPos
-                    d_theta_h_zu_theta = abs(theta_zu - Speicherzustand[hPos][0])
-            elif hPos > h_zu_max:
-                break
-            else:
-                raise ValueError("hPos comparison error in __Modell_Zustrom()")
-    # Ende if unten_oben == "unten"
-    elif unten_oben == "oben":
-        for hPos in reversed(all_h_pos):
-            if hPos > h_zu_max:
-                continue
-            elif (hPos <= h_zu_max and hPos >= h_zu_min):
-                if abs(theta_zu - Speicherzustand[hPos][0]) < d_theta_h_zu_theta:
-                    h_zu_theta = hPos
-                    d_theta_h_zu_theta = abs(theta_zu - Speicherzustand[hPos][0])
-            elif hPos < h_zu_min:
-                break
-            else:
-                raise ValueError("hPos Comparison error in __Modell_Zustrom()")
-    # Ende elif unten_oben == "oben"
+    s = index.mitten(h_zu_min, h_zu_max)                                # Zellen, deren Mitte im Diffusorbereich liegt
+    if s.stop > s.start:
+        d_theta = np.abs(theta_zu - index.theta[s])
+        if unten_oben == "unten":                                       # bei gleichem Abstand die unterste (unten) bzw. oberste (oben) Zelle
+            i = s.start + int(np.argmin(d_theta))
+        else:
+            i = s.stop - 1 - int(np.argmin(d_theta[::-1]))
+        h_zu_theta = index.h_pos[i]
+        d_theta_h_zu_theta = float(d_theta[i - s.start])
 
     fak_neben = 0
 
@@ -1985,19 +2359,12 @@ def __Modell_Abstrom(unten_oben, aktuellSekunden, ausgabezeit, Ausgabewerte,
     und anschließend die Ausstromtemperatur berechnet
     """
     Speicherzustand = __Modell_Aufraumen(Speicherzustand)
-    all_h_pos = sorted(list(Speicherzustand))
-    lastKey = max(all_h_pos)
-    h_WS = lastKey + Speicherzustand[lastKey][1] / 2
-    theta_diffusor = __Modell_Temperatur_Diffusorhoehe(unten_oben, h_WS, Speicherzustand)
+    index = _index.Hoehenindex(Speicherzustand)
+    h_WS = index.h_WS
+    theta_diffusor = __Modell_Temperatur_Diffusorhoehe(unten_oben, h_WS, Speicherzustand, index)
     F_ab = Begleitdaten[aktuellSekunden]["m_Punkt"] / __Modell_Stoffwerte("rho", theta_diffusor)
-    if unten_oben == "unten":
-        h_ab_min = speicher_param["H_B_UK_Dif"]
-        h_ab_max = speicher_param["H_B_UK_Dif"] + speicher_param["H_RS_Dif"]
-        Ausgabename = "T_RL"
-    elif unten_oben == "oben":
-        h_ab_min = h_WS - speicher_param["H_WS_OK_Dif"] - speicher_param["H_RS_Dif"]
-        h_ab_max = h_WS - speicher_param["H_WS_OK_Dif"] # Änderung um die Abweichungen zu beheben (oben beim Entladen wenn der Speicher fast leer ist)
-        Ausgabename = "T_VL"
+    h_ab_min, h_ab_max = __Modell_Diffusorbereich(unten_oben, h_WS)
+    Ausgabename = "T_RL" if unten_oben == "unten" else "T_VL"
 
     F_neben = 0
     theta_neben = 0
@@ -2005,67 +2372,18 @@ def __Modell_Abstrom(unten_oben, aktuellSekunden, ausgabezeit, Ausgabewerte,
     # TODO FIXME
     if unten_oben == "oben":
         theta_neben, F_neben, Speicherzustand = __Modell_Nebenstrom_ab(F_ab,h_WS, Zeitabstand,Speicherzustand)
+        if F_neben > 0:
+            index = _index.Hoehenindex(Speicherzustand)                 # Zellhöhen wurden im Nebenstrom geändert
 
     Ausgabewerte[Ausgabename] = {} 
-    dh_ab_rel= {}
-    rho_mittel = 0
 
-    if unten_oben == "unten":
-        for hPos in all_h_pos:
-            theta = Speicherzustand[hPos][0]
-            h_zelle_min = hPos - Speicherzustand[hPos][1] / 2
-            h_zelle_max = hPos + Speicherzustand[hPos][1] / 2
-            if h_zelle_max < h_ab_min:
-                continue
-
-            elif h_zelle_min <= h_ab_min and h_zelle_max >= h_ab_max:
-                dh_ab_rel[hPos] = 1
-                rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho",theta)
-
-            elif h_zelle_min <= h_ab_min and h_zelle_max >= h_ab_min:
-                dh_ab_rel[hPos] = (h_zelle_max - h_ab_min) / speicher_param["H_RS_Dif"]
-                rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho", theta)
-
-            elif h_zelle_min >= h_ab_min and h_zelle_max <= h_ab_max:
-                dh_ab_rel[hPos] = Speicherzustand[hPos][1] / speicher_param["H_RS_Dif"]
-                rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho", theta)
-
-            elif h_zelle_min <= h_ab_max and h_zelle_max >= h_ab_max:
-                dh_ab_rel[hPos] = (h_ab_max - h_zelle_min) / speicher_param["H_RS_Dif"]
-                rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho", theta)
-
-            elif h_zelle_min > h_ab_max:
-                break
-        # ende for hpos
-    # ende if
-    elif unten_oben == "oben":
-        for hPos in reversed(all_h_pos):
-            theta = Speicherzustand[hPos][0]
-            h_zelle_min = hPos - Speicherzustand[hPos][1] / 2
-            h_zelle_max = hPos + Speicherzustand[hPos][1] / 2
-            if h_zelle_min > h_ab_max:
-                continue
-
-            elif h_zelle_min <= h_ab_min and h_zelle_max >= h_ab_max:
-                dh_ab_rel[hPos] = 1
-                rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho",theta)
-
-            elif h_zelle_min <= h_ab_min and h_zelle_max >= h_ab_min:
-                dh_ab_rel[hPos] = (h_zelle_max - h_ab_min) / (speicher_param["H_RS_Dif"])
-                rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho", theta)
-
-            elif h_zelle_min >= h_ab_min and h_zelle_max <= h_ab_max:
-                dh_ab_rel[hPos] = Speicherzustand[hPos][1] / (speicher_param["H_RS_Dif"])
-                rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho", theta)
-
-            elif h_zelle_min <= h_ab_max and h_zelle_max >= h_ab_max:
-                dh_ab_rel[hPos] = (h_ab_max - h_zelle_min) / (speicher_param["H_RS_Dif"])
-                rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho", theta)
+    # Zellen im Diffusorbereich und ihr Anteil an der Diffusorhöhe
+    s, anteile = index.anteile(h_ab_min, h_ab_max, speicher_param["H_RS_Dif"])
+    dh_ab_rel = dict(zip(index.h_pos[s], anteile.tolist()))
+    rho_mittel = 0
+    for hPos in (reversed(list(dh_ab_rel)) if unten_oben == "oben" else dh_ab_rel):   # Reihenfolge wie beim Durchlauf über alle Zellen
+        rho_mittel += dh_ab_rel[hPos] * __Modell_Stoffwerte("rho", Speicherzustand[hPos][0])
 
-            elif h_zelle_max < h_ab_min:
-                break
-        # ende for hpos
-    # ende elif
     sum_dh_ab_rel = sum([v for v in dh_ab_rel.values()])
     if abs(sum_dh_ab_rel - 1) > 1.0E-06:
         raise ValueError("sum_dh_ab_rel ist nicht gleich 1 : %s" %sum_dh_ab_rel)
@@ -2113,14 +2431,23 @@ def __Modell_Abstrom(unten_oben, aktuellSekunden, ausgabezeit, Ausgabewerte,
 
 # // Funktion: Wärmeleitung
 def __Modell_Waermeleitung(Zeitabstand, thetaRand, q_punkt, 
-                           Fundamentzustand, Speicherzustand):
+                           Fundamentzustand, Speicherzustand, bilanz=None):
     """
     Berechnet die Wärmeleitung im Inneren des Speichers anhand der Wärmeleitungsgleichung
 
+    Mit `bilanz` (dict) wird das Fundament eingefroren: nur die oberste Fundamentzelle
+    geht als feste Randtemperatur ein, und der Wärmestrom vom Wasser in das Fundament
+    (W/m², Crank-Nicolson-Mittel über den Zeitschritt) wird unter "q_Fundament"
+    zurückgegeben. Das Fundament wird dann mit __Modell_Waermeleitung_Fundament
+    auf dem langsamen Takt nachgeführt.
     """
 
-    Gesamtzustand = {}
-    Gesamtzustand = {**Fundamentzustand,**Speicherzustand}          # Fundament- und Speicherzustand werden in eine Variable geschrieben
+    fundament_fest = bilanz is not None
+    if fundament_fest:
+        hPos_F = max(Fundamentzustand)
+        Gesamtzustand = {hPos_F: Fundamentzustand[hPos_F], **Speicherzustand}
+    else:
+        Gesamtzustand = {**Fundamentzustand,**Speicherzustand}      # Fundament- und Speicherzustand werden in eine Variable geschrieben
     all_h_pos = (sorted(list(Gesamtzustand)))                       # Sortierung aller Höhenpositionen in einer Liste
     all_h_pos.reverse()                                             # Reihenfolge vertauschen, Index 0 ist oben, Speicher wird von oben nach unten durchgegangen
     thetaWL = [Gesamtzustand[h][0] for h in all_h_pos]              # Liste aller Temperaturen der Zellen
@@ -2172,6 +2499,11 @@ def __Modell_Waermeleitung(Zeitabstand, thetaRand, q_punkt,
     d_WL[maxIndex] = thetaWL[maxIndex] * (1 - tlf_mod[maxIndex] * lambda_[maxIndex - 1] / dx_[maxIndex - 1])\
                     + thetaWL[maxIndex - 1] * tlf_mod[maxIndex] * lambda_[maxIndex - 1] / dx_[maxIndex - 1]\
                     - q_punkt * Zeitabstand / (dx[maxIndex] * rho_f * cp_f)
+    if fundament_fest:                                                          # oberste Fundamentzelle bleibt fest (Dirichlet-Rand für das Wasser)
+        a_WL[maxIndex] = 0
+        b_WL[maxIndex] = 1
+        d_WL[maxIndex] = thetaWL[maxIndex]
+        theta_W_alt = thetaWL[maxIndex - 1]
 
 
     for j in range(1,maxIndex):                                                 # Berechnung der Koeffizienten zur Lösung des linearen Gleichungssystems der Wärmeleitungsgleichung für jede Zelle
@@ -2183,6 +2515,9 @@ def __Modell_Waermeleitung(Zeitabstand, thetaRand, q_punkt,
                  + thetaWL[j-1] * tlf_mod[j] * lambda_[j-1] / dx_[j-1]
 
     thetaWL = __Modell_TDMASolve(a_WL, b_WL, c_WL, d_WL)                        # Berechnung der neuen Temperatur jeder Zelle durch Lösung der Wärmeleitungsgleichung
+    if fundament_fest:                                                          # derselbe Fluss, den die unterste Wasserzelle im Gleichungssystem abgibt
+        bilanz["q_Fundament"] = lambda_[maxIndex - 1] / dx_[maxIndex - 1]\
+                                * ((theta_W_alt + thetaWL[maxIndex - 1]) / 2 - thetaWL[maxIndex])
     j = 0
     thetaWL[0] = thetaRand
     for hPos in all_h_pos:                                                      # neue Temperaturen und Zellhöhen in Speicherzustand und Fundamentzustand schreiben
@@ -2197,6 +2532,37 @@ def __Modell_Waermeleitung(Zeitabstand, thetaRand, q_punkt,
             
     return Fundamentzustand, Speicherzustand
 
+# // Funktion: Wärmeleitung im Fundament
+def __Modell_Waermeleitung_Fundament(Zeitabstand, q_oben, q_unten, Fundamentzustand):
+    """
+    Wärmeleitung nur im Fundament, mit vorgegebenem Wärmestrom oben (vom Wasser, W/m²)
+    und unten (an das Erdreich, W/m²). Crank-Nicolson in Erhaltungsform: die Energie im
+    Fundament ändert sich genau um (q_oben - q_unten) * Zeitabstand.
+    """
+    all_h_pos = sorted(Fundamentzustand, reverse=True)                          # Index 0 ist oben
+    thetaF = [Fundamentzustand[h][0] for h in all_h_pos]
+    dx = [Fundamentzustand[h][1] for h in all_h_pos]
+    n = len(thetaF)
+    rho_cp = __Modell_Stoffwerte("rho_Fundament") * __Modell_Stoffwerte("cp_Fundament")
+    Lambda = __Modell_Stoffwerte("lambda_Fundament")
+    tlf = [Zeitabstand / (rho_cp * 2 * dx[j]) for j in range(n)]
+    k = [2 * Lambda / (dx[j] + dx[j+1]) for j in range(n - 1)]                  # lambda / mittlerer Zellabstand
+    k_oben = [0] + k                                                            # Kopplung zur Zelle darüber
+    k_unten = k + [0]                                                           # Kopplung zur Zelle darunter
+    a_F = [-tlf[j] * k_oben[j] for j in range(n)]
+    b_F = [1 + tlf[j] * (k_oben[j] + k_unten[j]) for j in range(n)]
+    c_F = [-tlf[j] * k_unten[j] for j in range(n)]
+    d_F = [thetaF[j] * (1 - tlf[j] * (k_oben[j] + k_unten[j]))
+           + (thetaF[j-1] * tlf[j] * k_oben[j] if j > 0 else 0)
+           + (thetaF[j+1] * tlf[j] * k_unten[j] if j < n - 1 else 0)
+           for j in range(n)]
+    d_F[0] += q_oben * Zeitabstand / (dx[0] * rho_cp)
+    d_F[n-1] -= q_unten * Zeitabstand / (dx[n-1] * rho_cp)
+    thetaF = __Modell_TDMASolve(a_F, b_F, c_F, d_F)
+    for j, hPos in enumerate(all_h_pos):
+        Fundamentzustand[hPos][0] = thetaF[j]
+    return Fundamentzustand
+
 # // Funktion: TDMASolve
 def __Modell_TDMASolve(aL,bL, cL, dL):                              # Tridiagonales Matrixalgorithmus-Verfahren
     """
@@ -2217,11 +2583,15 @@ def __Modell_TDMASolve(aL,bL, cL, dL):                              # Tridiagona
     return x
 
 # // Funktion: Kapazitäten
-def __Modell_Kapazitaeten(dt_sub, T_amb, Kapazitaeten, Speicherzustand):
+def __Modell_Kapazitaeten(dt_sub, T_amb, Kapazitaeten, Speicherzustand, stabil=False):
     """
     Berechnet den Wärmeübergang zwischen Mantel und Wasser und anschließend zwischen Mantel und Umgebung
+
+    Mit `stabil=True` (langer Takt, s. n_sub_mantel) wird der Übergang Wasser-Mantel als
+    exakte Relaxation zweier Kapazitäten integriert statt explizit; die Zeitkonstante
+    der Mantelzellen liegt bei etwa einer Minute, der explizite Schritt wäre für längere
+    Zeitabstände instabil. Die ausgetauschte Energie bleibt in beiden Fällen exakt bilanziert.
     """
-    U_Wert = 800 # Wärmeübergangskoeffizient !!!! (eigentlich) ALPHA  (von wasser zu innere Manteloberfläche) W/m2K (nicht wie in config)
     E_an_W = {} # von bauteilkapa an wasser energie
     all_h_pos_K = sorted(list(Kapazitaeten))
     all_h_pos_W = sorted(list(Speicherzustand))
@@ -2262,6 +2632,12 @@ def __Modell_Kapazitaeten(dt_sub, T_amb, Kapazitaeten, Speicherzustand):
 
 
             E = dt_sub * speicher_param["alpha_water_innerwall"] * A * (theta_K - theta_W)               # Berechnung wie viel Energie zwischen Mantel und Wasser übertragen wird
+            if stabil and A > 0:
+                c_K = Kapazitaeten[hPosK][2] / (dh_K * pi * 2 * speicher_param["R_innen"])  # Kapazität je Kontaktfläche im Mantel
+                c_W = __Modell_Stoffwerte("rho", theta_W) * __Modell_Stoffwerte("cp", theta_W)\
+                      * speicher_param["R_innen"] / 2                                   # und im Wasser
+                x = dt_sub * speicher_param["alpha_water_innerwall"] * (1 / c_K + 1 / c_W)
+                E *= (1 - exp(-x)) / x
             E_an_W[hPosW] += E                                          # übertragene Energie an jede Wasserzelle wird berechnet
             Kapazitaeten[hPosK][0] -= E / Kapazitaeten[hPosK][2]        # Temperatur des Mantels wird korrigiert mit übertragener Energie
         # ende while next_k
@@ -2288,76 +2664,93 @@ def __Modell_Kapazitaeten(dt_sub, T_amb, Kapazitaeten, Speicherzustand):
         E_Verlust_Mantel += E_Verlust                                                   # Gesamtverlust der Energie über den Mantel an die Umgebung
     return E_Verlust_Mantel, Kapazitaeten, Speicherzustand                              # Frage: Müsste man nicht Kapazitäten[2] für die neue Temperatur berechnen, da sich cp und rho ändern?
 
-# // Funktion: Temperatur Diffusorhöhe
-def __Modell_Temperatur_Diffusorhoehe(unten_oben, h_WS, Speicherzustand):
+# // Funktion: Gitter im Mantel
+def __Modell_Mantelgitter(Kapazitaeten, Speicherzustand):
+    """
+    Passt das Gitter der Mantelzellen an das Temperaturfeld im Wasser an (mantel_gitter = "adaptiv").
 
-    dh_rel = {}
-    theta_mittel = 0
-    all_h_pos = sorted(list(Speicherzustand))
+    Mantelzellen, hinter denen sich die Wassertemperatur um mehr als mantel_dT_max ändert
+    (Thermokline) oder in denen der Wasserspiegel liegt, werden bis auf mantel_dh_min halbiert.
+    Benachbarte Zellen, die sich um weniger als die Hälfte davon unterscheiden, werden bis
+    mantel_dh_max zusammengefasst. Beim Teilen behalten beide Hälften die Temperatur, beim
+    Zusammenfassen wird mit den Kapazitäten gemittelt; die Energie im Mantel bleibt exakt erhalten.
+    """
+    dh_min = speicher_param.get("mantel_dh_min", 0.1)
+    dh_max = speicher_param.get("mantel_dh_max", 2.0)
+    dT_max = speicher_param.get("mantel_dT_max", 0.5)
+    all_h_pos_W = sorted(Speicherzustand)
+    h_W = np.array(all_h_pos_W)
+    theta_W = np.array([Speicherzustand[h][0] for h in all_h_pos_W])
+    Fuellstand = all_h_pos_W[-1] + Speicherzustand[all_h_pos_W[-1]][1] / 2
+
+    def spanne(uG, oG):                                                         # Temperaturspanne im Wasser zwischen uG und oG
+        innen = theta_W[np.searchsorted(h_W, uG):np.searchsorted(h_W, oG)]
+        rand = np.interp((uG, oG), h_W, theta_W)
+        return max(rand.max(), innen.max(initial=-np.inf)) - min(rand.min(), innen.min(initial=np.inf))
+
+    zellen = []                                                                 # [Unterkante, Oberkante, Temperatur, Kapazität]
+    uG = 0.0
+    for hPos in sorted(Kapazitaeten):
+        theta, dh, C = Kapazitaeten[hPos]
+        zellen.append([uG, uG + dh, theta, C])
+        uG += dh
+
+    # Verfeinern an der Thermokline und am Wasserspiegel
+    i = 0
+    while i < len(zellen):
+        uG, oG, theta, C = zellen[i]
+        if oG - uG >= 2 * dh_min and (uG < Fuellstand < oG or spanne(uG, oG) > dT_max):
+            mitte = (uG + oG) / 2
+            zellen[i:i+1] = [[uG, mitte, theta, C / 2], [mitte, oG, theta, C / 2]]
+            continue                                                            # untere Hälfte erneut prüfen
+        i += 1
+
+    # Zusammenfassen gleichmäßiger Bereiche
+    neu = [zellen[0]]
+    for zelle in zellen[1:]:
+        unten = neu[-1]
+        dh = zelle[1] - unten[0]
+        if dh <= dh_min or (dh <= dh_max
+                            and abs(zelle[2] - unten[2]) <= dT_max / 2
+                            and not unten[0] < Fuellstand < zelle[1]
+                            and spanne(unten[0], zelle[1]) <= dT_max / 2):
+            C = unten[3] + zelle[3]
+            neu[-1] = [unten[0], zelle[1], (unten[2] * unten[3] + zelle[2] * zelle[3]) / C, C]
+        else:
+            neu.append(zelle)
+
+    return {(uG + oG) / 2: [theta, oG - uG, C] for uG, oG, theta, C in neu}
+
+# // Funktion: Temperatur Diffusorhöhe
+def __Modell_Temperatur_Diffusorhoehe(unten_oben, h_WS, Speicherzustand, index=None):
+    """
+    Mittlere Temperatur im Höhenbereich des unteren oder oberen Diffusors (über die Höhe gewichtet).
+    index: Hoehenindex des Speicherzustands, falls schon vorhanden
+    """
+    if index is None:
+        index = _index.Hoehenindex(Speicherzustand)
+    h_ab_min, h_ab_max = __Modell_Diffusorbereich(unten_oben, h_WS)
+    return index.mittel_theta(h_ab_min, h_ab_max, speicher_param["H_RS_Dif"],
+                              von_oben=unten_oben == "oben")            # nur die Zellen im Diffusorbereich
+
+# // Funktion: Höhenbereich des Diffusors
+def __Modell_Diffusorbereich(unten_oben, h_WS):
     if unten_oben == "unten":
         h_ab_min = speicher_param["H_B_UK_Dif"]
         h_ab_max = speicher_param["H_B_UK_Dif"] + speicher_param["H_RS_Dif"]
-        for hPos in all_h_pos:
-            h_plug_min = hPos - Speicherzustand[hPos][1] / 2
-            h_plug_max = hPos + Speicherzustand[hPos][1] / 2
-
-            if h_plug_max < h_ab_min:
-                continue
-            elif (h_plug_min <= h_ab_min and h_plug_max >= h_ab_max):
-                dh_rel[hPos] = 1
-                theta_mittel += dh_rel[hPos] * Speicherzustand[hPos][0]
-            elif (h_plug_min <= h_ab_min and h_plug_max >= h_ab_min):
-                dh_rel[hPos] = (h_plug_max - h_ab_min) / speicher_param["H_RS_Dif"]
-                theta_mittel += dh_rel[hPos] * Speicherzustand[hPos][0]
-            elif (h_plug_min >= h_ab_min and h_plug_max <= h_ab_max):
-                dh_rel[hPos] = Speicherzustand[hPos][1] / speicher_param["H_RS_Dif"]
-                theta_mittel += dh_rel[hPos] * Speicherzustand[hPos][0]
-            elif (h_plug_min <= h_ab_max and h_plug_max >= h_ab_max):
-                dh_rel[hPos] = (h_ab_max - h_plug_min) / speicher_param["H_RS_Dif"]
-                theta_mittel += dh_rel[hPos] * Speicherzustand[hPos][0]
-            elif (h_plug_min > h_ab_max):
-                break
     elif unten_oben == "oben":
         h_ab_min = h_WS - speicher_param["H_WS_OK_Dif"] - speicher_param["H_RS_Dif"]
         h_ab_max = h_WS - speicher_param["H_WS_OK_Dif"]
-        for hPos in reversed(all_h_pos):
-            h_plug_min = hPos - Speicherzustand[hPos][1] / 2
-            h_plug_max = hPos + Speicherzustand[hPos][1] / 2
-
-            if h_plug_min > h_ab_max:
-                continue
-
-            elif (h_plug_min <= h_ab_min and h_plug_max >= h_ab_max):
-                dh_rel[hPos] = 1
-                theta_mittel += dh_rel[hPos] * Speicherzustand[hPos][0]
-
-            elif (h_plug_max >= h_ab_max and h_plug_min <= h_ab_max):
-                dh_rel[hPos] = (h_ab_max - h_plug_min) / speicher_param["H_RS_Dif"]
-                theta_mittel += dh_rel[hPos] * Speicherzustand[hPos][0]
-
-            elif (h_plug_min >= h_ab_min and h_plug_max <= h_ab_max):
-                dh_rel[hPos] = Speicherzustand[hPos][1] / speicher_param["H_RS_Dif"]
-                theta_mittel += dh_rel[hPos] * Speicherzustand[hPos][0]
-
-            elif (h_plug_min <= h_ab_min and h_plug_max >= h_ab_min):
-                dh_rel[hPos] = (h_plug_max - h_ab_min) / speicher_param["H_RS_Dif"]
-                theta_mittel += dh_rel[hPos] * Speicherzustand[hPos][0]
+    else:
+        raise ValueError("'unten' oder 'oben' spezifizieren")
+    return h_ab_min, h_ab_max
 
-            elif h_plug_max < h_ab_min:
-                break
-    # if abs(sum(dh_rel.values()) - 1)>1.0E-06:
-    #     print("ERROR IN TEMPERATUR DIFFUSORHOEHOE %s" %(sum(dh_rel.values())))
-        #raise ValueError("dh_rel muss 1 ergeben (Diffusor temperatur) %s"%(sum(dh_rel)))
-    return theta_mittel
-    
 # // Funktion: Nebenstrom zu
 # \\ nur für Speicher Dessau notwendig
 def __Modell_Nebenstrom_zu(theta_zu, F_zu, h_WS, dh_zu, Speicherzustand):
 
     all_h_pos = sorted(list(Speicherzustand))
-    fak_neben = 0
     rho_1 = __Modell_Stoffwerte("rho", theta_zu)
-    u_1 = F_zu / (pi * speicher_param["r_i_Gleitrohr"]**2)
 
     h_0 = h_WS - speicher_param["H_WS_OK_Dif"] - speicher_param["H_RS_Dif"]
     h_2 = h_0 - speicher_param["L_Fuehrung"]
@@ -2394,48 +2787,17 @@ def __Modell_Nebenstrom_zu(theta_zu, F_zu, h_WS, dh_zu, Speicherzustand):
     theta_1_2 /= dh_1_2
 
     theta_2 = Speicherzustand[all_h_pos[i_2]][0]
-    f_WUE = 0.05
+    f_WUE = speicher_param.get("nebenstrom_f_WUE", 0.05)
     theta_1_stern = (1 - f_WUE) * theta_2 + f_WUE * (Speicherzustand[all_h_pos[i_0]][0] + theta_1_2) / 2
 
     rho_2 = __Modell_Stoffwerte("rho", theta_2)
     rho_r = __Modell_Stoffwerte("rho", (theta_2 + theta_1_stern)/2)
     rho_1_stern = __Modell_Stoffwerte("rho", theta_1_stern)
-    rho_w = rho_1
-
-    zeta_B = 2.6
-    zeta_M_0_stern = 1
-    zeta_2_stern_1_stern = 1
-
-    u_2_stern = u_1
-    fak_neben_alt = 1
-    wiederholen = True
-    
-    p_dyn = rho_1 * A_1 / A_m * u_1**2
-
-    p_stat = 0
-    alleTerme = 0
-    
-    while wiederholen:
-        wiederholen = False
-        p_stat = g * (rho_0_2 * h_0_2 - rho_r * h_1_2 - rho_w * h_0_1)
-        u_1_stern = rho_2 * A_b * u_2_stern / (rho_1_stern * A_1_stern)
-        u_M = (rho_1 * A_1 * u_1 + rho_1_stern * A_1_stern * u_1_stern) / (rho_w * A_m)
-        u_0_stern = rho_w * A_m * u_M / (rho_w * A_0_stern)
-        u_R = rho_2 * A_b * u_2_stern / (rho_r * A_r)
-
-        alleTerme = p_stat + p_dyn - rho_w / 2 * u_M**2 + rho_1_stern * u_1_stern**2 * (A_1_stern/A_m - 0.5)\
-                    - rho_w/2 * u_0_stern**2 * (1+zeta_M_0_stern) - zeta_2_stern_1_stern * rho_r/2 * u_R**2
-        
-        if alleTerme <= 0:
-            fak_neben = 0
-            break
 
-        u_2_stern = (2/(rho_2*zeta_B)* alleTerme)**0.5
-        fak_neben = u_2_stern / u_1 * A_b / A_1
-        rho_w = (rho_1 + fak_neben *rho_2) / (fak_neben + 1)
-        if abs(fak_neben_alt - fak_neben) > 1.0E-03:
-            wiederholen = True
-        fak_neben_alt = fak_neben
+    flaechen = (A_r, A_b, A_1, A_m, A_1_stern, A_0_stern)
+    fak_neben = __Modell_Nebenstrom_zu_loesen(*__Modell_Nebenstrom_Schluessel(
+        F_zu, rho_1, rho_0_2, rho_2, rho_r, rho_1_stern, h_0_2, h_1_2, h_0_1), flaechen,
+        __Modell_Nebenstrom_Loeser())
     m_neben_Plug_soll = dh_zu * fak_neben * rho_1
     m_neben_Plug = 0
     H_neben = 0
@@ -2468,7 +2830,6 @@ def __Modell_Nebenstrom_zu(theta_zu, F_zu, h_WS, dh_zu, Speicherzustand):
 def __Modell_Nebenstrom_ab(F_ab, h_WS, dt, Speicherzustand):
 
     all_h_pos = sorted(list(Speicherzustand))
-    F_neben = 0
     h_0 = h_WS - speicher_param["H_WS_OK_Dif"] - speicher_param["H_RS_Dif"]
     h_2 = h_0 - speicher_param["L_Fuehrung"]
 
@@ -2488,8 +2849,8 @@ def __Modell_Nebenstrom_ab(F_ab, h_WS, dt, Speicherzustand):
     h_0_1 = all_h_pos[i_0] - all_h_pos[i_1]
 
     theta_2 = Speicherzustand[all_h_pos[i_2]][0]
-    f_wue = 0.05 # fuer Dessau, 0.25 fuer Bautzen
-    theta_1_stern = (1 - f_wue) * theta_2 + f_wue * Speicherzustand[all_h_pos[i_0]][0]
+    f_WUE = speicher_param.get("nebenstrom_f_WUE", 0.05)                    # 0.05 fuer Dessau, 0.25 fuer Bautzen
+    theta_1_stern = (1 - f_WUE) * theta_2 + f_WUE * Speicherzustand[all_h_pos[i_0]][0]
 
     rho_0_2 = 0
     dh_0_2 = 0
@@ -2504,39 +2865,11 @@ def __Modell_Nebenstrom_ab(F_ab, h_WS, dt, Speicherzustand):
     rho_1_stern = __Modell_Stoffwerte("rho", theta_1_stern)
     rho_w = __Modell_Stoffwerte("rho", Speicherzustand[all_h_pos[i_0]][0])
 
-    zeta_B = 2.6 # fuer Dessau
-    zeta_M_0_stern = 1
-    zeta_2_stern_1_stern = 1
-
-    u_1 = F_ab / A_1
-    u_2_stern = u_1
-    F_neben_alt = -1
-    wiederholen = True
-
-    p_dyn = rho_w * A_1 / A_m * u_1**2
-    p_dyn += 0.75 # fuer Dessau
+    flaechen = (A_r, A_b, A_1, A_m, A_1_stern, A_0_stern)
+    F_neben = __Modell_Nebenstrom_ab_loesen(*__Modell_Nebenstrom_Schluessel(
+        F_ab, rho_0_2, rho_2, rho_R, rho_1_stern, rho_w, h_0_2, h_1_2, h_0_1), flaechen,
+        __Modell_Nebenstrom_Loeser())
 
-    counter = 0
-    while wiederholen:
-        counter += 1
-        wiederholen = False
-        p_stat = g * (rho_0_2 * h_0_2 - rho_R * h_1_2 - rho_w * h_0_1)
-        u_1_stern = rho_2 * A_b * u_2_stern / (rho_1_stern * A_1_stern)
-        u_R = rho_2 * A_b * u_2_stern / (rho_R * A_r)
-        u_0_stern = (F_ab - F_neben) / A_0_stern
-        u_M = (F_ab - F_neben) / A_m
-
-        alleTerme = p_stat + p_dyn - rho_w/2 * u_M**2 - rho_1_stern * u_1_stern**2 *(A_1_stern/A_m+0.5)\
-                    + rho_w/2 * u_0_stern**2 * zeta_M_0_stern - zeta_2_stern_1_stern * rho_R / 2 * u_R**2
-        if alleTerme <= 0:
-            F_neben = 0
-            break
-        u_2_stern = (2/(rho_2 * zeta_B)*alleTerme)**0.5
-        F_neben = u_2_stern * A_b
-        if abs(F_neben_alt - F_neben) > 1.0E-03:
-            wiederholen = True
-        F_neben_alt = F_neben
-        
     F_neben = min(F_neben, 0.99 * F_ab)
 
     V_neben_soll = F_neben * dt
@@ -2571,22 +2904,135 @@ def __Modell_Nebenstrom_ab(F_ab, h_WS, dt, Speicherzustand):
 
     return theta_neben, F_neben, Speicherzustand
 
-# // Funktion: find index of h_pos, muss nicht sein, aber ist halt so
-def __Modell_find_index_h_pos(h_such, all_h_pos):
-    ug = 0
-    og = len(all_h_pos)
-    while og - ug > 1:
-        uneven = (ug + og) % 2
-        i_mitte = (ug + og + uneven) / 2
-        if h_such > all_h_pos[int(i_mitte)]:
-            ug = int(i_mitte)
+# // Funktion: Eingangsgrößen der Nebenstrom-Hydraulik auf nebenstrom_stellen signifikante Stellen runden
+# \\ Die Gleichung wird mit den gerundeten Werten gelöst, ein Cache-Treffer liefert also dasselbe Ergebnis
+def __Modell_Nebenstrom_Schluessel(*werte):
+    stellen = int(speicher_param.get("nebenstrom_stellen", 0))
+    if stellen <= 0:                                                            # nicht runden
+        return tuple(float(wert) for wert in werte)
+    return tuple(float("%.*g" % (stellen, wert)) for wert in werte)
+
+# // Funktion: Löser-Einstellungen der Nebenstrom-Hydraulik (loeser, xtol, max_iter)
+# \\ Sie gehören zum Schlüssel der gecachten Lösungen: andere Einstellungen, andere Lösung
+def __Modell_Nebenstrom_Loeser():
+    return (speicher_param.get("nebenstrom_loeser", "iteration"),
+            float(speicher_param.get("nebenstrom_xtol", 1.0E-06)),
+            int(speicher_param.get("nebenstrom_max_iter", 50)))
+
+# // Funktion: Fixpunkt x = G(x) mit x >= 0 suchen
+# \\ x_start ist der erste Schritt der Fixpunktiteration, x_vorher der Vergleichswert für dessen Abbruchprüfung.
+# \\ nebenstrom_loeser = "iteration": x -> G(x), bis sich x um höchstens 1E-03 ändert (wie früher).
+# \\ "brent" (oder wenn die Iteration nach nebenstrom_max_iter Schritten nicht steht): von x_start aus wird in
+# \\ Richtung der Iteration eine Nullstelle von x - G(x) eingeschlossen und mit dem Brent-Verfahren auf
+# \\ nebenstrom_xtol gelöst; das ist derselbe Fixpunkt, gegen den die Iteration läuft, auch wenn x - G(x)
+# \\ weitere Nullstellen hat. x_start = 0 (Druckbilanz schon beim Startwert negativ) heißt kein Nebenstrom
+def __Modell_Fixpunkt(G, x_start, loeser, x_vorher=-1.0):
+    nebenstrom_statistik["loesungen"] += 1
+    if x_start <= 0:
+        return 0.0
+    verfahren, xtol, max_iter = loeser
+    if verfahren == "iteration":
+        x = x_start
+        for schritte in range(1, max_iter + 1):
+            if abs(x_vorher - x) <= 1.0E-03:
+                break
+            x_vorher, x = x, G(x)
+            if x <= 0:
+                break
         else:
-            og = int(i_mitte)
-    if abs(h_such - all_h_pos[ug]) < abs(h_such - all_h_pos[og]):
-        index = ug
+            logger.warning("Nebenstrom: Iteration steht nach %s Schritten nicht, Brent-Verfahren", max_iter)
+            schritte = None
+        if schritte is not None:
+            nebenstrom_statistik["iterationen"] += schritte
+            nebenstrom_statistik["max_iterationen"] = max(nebenstrom_statistik["max_iterationen"], schritte)
+            return max(x, 0.0)
+    x_a = x_start
+    f_a = x_a - G(x_a)
+    if f_a == 0:
+        return x_a
+    schritt = -f_a                                                              # G(x_a) - x_a
+    for _ in range(60):
+        x_b = max(x_a + schritt, 0.0)
+        f_b = x_b - G(x_b)
+        if f_b == 0:
+            return x_b
+        if (f_a < 0) != (f_b < 0):                                              # eingeschlossen
+            break
+        x_a, f_a = x_b, f_b
+        schritt *= 2
     else:
-        index = og
-    return index
+        logger.warning("Nebenstrom: kein Vorzeichenwechsel gefunden")
+        return x_a
+    x, info = optimize.brentq(lambda x: x - G(x), min(x_a, x_b), max(x_a, x_b),
+                              xtol=xtol,
+                              maxiter=max_iter, full_output=True, disp=False)
+    if not info.converged:
+        logger.warning("Nebenstrom: keine Konvergenz nach %s Iterationen", info.iterations)
+    nebenstrom_statistik["iterationen"] += info.iterations
+    nebenstrom_statistik["max_iterationen"] = max(nebenstrom_statistik["max_iterationen"], info.iterations)
+    return x
+
+# // Funktion: Druckbilanz Nebenstrom zu nach dem Faktor fak_neben = Nebenstrom / Zustrom lösen
+@lru_cache(maxsize=4096)
+def __Modell_Nebenstrom_zu_loesen(F_zu, rho_1, rho_0_2, rho_2, rho_r, rho_1_stern, h_0_2, h_1_2, h_0_1, flaechen,
+                                  loeser):
+    A_r, A_b, A_1, A_m, A_1_stern, A_0_stern = flaechen
+    zeta_B = 2.6
+    zeta_M_0_stern = 1
+    zeta_2_stern_1_stern = 1
+
+    u_1 = F_zu / A_1
+    p_dyn = rho_1 * A_1 / A_m * u_1**2
+
+    def G(fak_neben, fak_rho=None):                                             # fak_rho: Faktor für die Mischdichte rho_w
+        if fak_rho is None:
+            fak_rho = fak_neben
+        rho_w = (rho_1 + fak_rho * rho_2) / (fak_rho + 1)
+        u_2_stern = fak_neben * u_1 * A_1 / A_b
+        p_stat = g * (rho_0_2 * h_0_2 - rho_r * h_1_2 - rho_w * h_0_1)
+        u_1_stern = rho_2 * A_b * u_2_stern / (rho_1_stern * A_1_stern)
+        u_M = (rho_1 * A_1 * u_1 + rho_1_stern * A_1_stern * u_1_stern) / (rho_w * A_m)
+        u_0_stern = rho_w * A_m * u_M / (rho_w * A_0_stern)
+        u_R = rho_2 * A_b * u_2_stern / (rho_r * A_r)
+
+        alleTerme = p_stat + p_dyn - rho_w / 2 * u_M**2 + rho_1_stern * u_1_stern**2 * (A_1_stern/A_m - 0.5)\
+                    - rho_w/2 * u_0_stern**2 * (1+zeta_M_0_stern) - zeta_2_stern_1_stern * rho_r/2 * u_R**2
+        if alleTerme <= 0:
+            return 0.0
+        return (2/(rho_2*zeta_B) * alleTerme)**0.5 / u_1 * A_b / A_1
+
+    return __Modell_Fixpunkt(G, G(A_b / A_1, 0), loeser, 1.0)                          # erster Schritt wie früher: u_2_stern = u_1, rho_w = rho_1
+
+# // Funktion: Druckbilanz Nebenstrom ab nach dem Nebenvolumenstrom F_neben lösen
+@lru_cache(maxsize=4096)
+def __Modell_Nebenstrom_ab_loesen(F_ab, rho_0_2, rho_2, rho_R, rho_1_stern, rho_w, h_0_2, h_1_2, h_0_1, flaechen,
+                                  loeser):
+    A_r, A_b, A_1, A_m, A_1_stern, A_0_stern = flaechen
+    zeta_B = 2.6 # fuer Dessau
+    zeta_M_0_stern = 1
+    zeta_2_stern_1_stern = 1
+
+    u_1 = F_ab / A_1
+    p_dyn = rho_w * A_1 / A_m * u_1**2
+    p_dyn += 0.75 # fuer Dessau
+    p_stat = g * (rho_0_2 * h_0_2 - rho_R * h_1_2 - rho_w * h_0_1)
+
+    def G(F_neben, F_rohr=None):                                                # F_rohr: Strom im Leitrohr für u_2_stern
+        if F_rohr is None:
+            F_rohr = F_neben
+        u_2_stern = F_rohr / A_b
+        u_1_stern = rho_2 * A_b * u_2_stern / (rho_1_stern * A_1_stern)
+        u_R = rho_2 * A_b * u_2_stern / (rho_R * A_r)
+        u_0_stern = (F_ab - F_neben) / A_0_stern
+        u_M = (F_ab - F_neben) / A_m
+
+        alleTerme = p_stat + p_dyn - rho_w/2 * u_M**2 - rho_1_stern * u_1_stern**2 *(A_1_stern/A_m+0.5)\
+                    + rho_w/2 * u_0_stern**2 * zeta_M_0_stern - zeta_2_stern_1_stern * rho_R / 2 * u_R**2
+        if alleTerme <= 0:
+            return 0.0
+        return (2/(rho_2 * zeta_B) * alleTerme)**0.5 * A_b
+
+    return __Modell_Fixpunkt(G, G(0.0, u_1 * A_b), loeser)                              # erster Schritt wie früher: u_2_stern = u_1, F_neben = 0
 
 # // Funktion: Stoffwerte für bestimmte Temperatur ausgeben
 def __Modell_Stoffwerte(groesse, theta=None):
@@ -0,0 +1,169 @@
+"""Result container for the TES tank model.
+
+`main()` used to evaluate every metric of the outputs dict at the end of each
+call, although most couplings only read ``T_Austritt`` and occasionally
+``E_nutz``. :class:`LazyOutputs` keeps the dict interface but defers the
+expensive entries until they are first read and caches the result.
+"""
+
+from __future__ import annotations
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Platzhalter fuer noch nicht berechnete Eintraege
+_AUSSTEHEND = object()
+
+
+class LazyOutputs(dict):
+    """Dict of model results whose metrics are computed on first access.
+
+    Values in `werte` that are callables are not stored but registered with
+    :meth:`set_lazy`: they receive the container itself, so that a metric can
+    read other (possibly lazy) entries, and are evaluated on first access.
+    Groups registered with :meth:`set_gruppe` compute several keys in one pass;
+    they are used when all keys of the group are still pending and the whole
+    dict is requested (``items()``, ``values()``, ``materialize()``, and
+    ``keys()``, which ``dict(result)`` and ``{**result}`` call).
+
+    Pending entries are invisible to callers: indexing, ``get``, iteration,
+    comparison, ``repr`` and pickling behave as for the plain dict.
+    """
+
+    def __init__(self, werte=()):
+        super().__init__()
+        self._lazy = {}
+        self._gruppen = []
+        for key, value in dict(werte).items():
+            if callable(value):
+                self.set_lazy(key, value)
+            else:
+                dict.__setitem__(self, key, value)
+
+    # -- Registrierung ----------------------------------------------------
+    def set_lazy(self, key, func):
+        """Register `func(self)` as the deferred computation of `key`."""
+        self._lazy[key] = func
+        dict.__setitem__(self, key, _AUSSTEHEND)
+
+    def set_gruppe(self, keys, func, einzeln=False):
+        """Register `func(self) -> dict` computing all `keys` in one pass.
+
+        With ``einzeln=True`` the keys are registered as lazy entries as well,
+        so that reading any one of them evaluates the whole group once.
+        """
+        keys = tuple(keys)
+        self._gruppen.append((keys, func))
+        if einzeln:
+            for key in keys:
+                self.set_lazy(key, lambda o, key=key: o._gruppe_berechnen(keys, func)[key])
+
+    def is_pending(self, key) -> bool:
+        """True if `key` has not been computed yet."""
+        return key in self._lazy
+
+    # -- Berechnung -------------------------------------------------------
+    def _berechnen(self, key):
+        func = self._lazy.pop(key)
+        value = func(self)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def _gruppe_berechnen(self, keys, func):
+        werte = func(self)
+        for k in keys:
+            self._lazy.pop(k, None)
+            dict.__setitem__(self, k, werte[k])
+        return werte
+
+    def _gruppen_berechnen(self):
+        for keys, func in self._gruppen:
+            if all(k in self._lazy for k in keys):
+                self._gruppe_berechnen(keys, func)
+
+    def materialize(self):
+        """Compute all pending entries (groups first) and return `self`."""
+        self._gruppen_berechnen()
+        for key in list(self._lazy):
+            if key in self._lazy:                                   # kann durch Abhaengigkeiten schon berechnet sein
+                self._berechnen(key)
+        return self
+
+    # -- dict-Schnittstelle -----------------------------------------------
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if value is _AUSSTEHEND:
+            value = self._berechnen(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._lazy.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._lazy.pop(key, None)
+        dict.__delitem__(self, key)
+
+    def __iter__(self):
+        # ueberschrieben, damit dict(result) und {**result} ueber keys() und __getitem__ gehen
+        return dict.__iter__(self)
+
+    def keys(self):
+        # dict(result) und {**result} lesen danach jeden Eintrag: Gruppen vorher in einem Durchlauf
+        self._gruppen_berechnen()
+        return dict.keys(self)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            dict.__delitem__(self, key)
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self.materialize()
+        return dict.popitem(self)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def items(self):
+        return dict.items(self.materialize())
+
+    def values(self):
+        return dict.values(self.materialize())
+
+    def copy(self):
+        """Plain-dict copy with all metrics computed."""
+        return dict(self.materialize().items())
+
+    def __eq__(self, other):
+        if isinstance(other, LazyOutputs):
+            other.materialize()
+        return dict.__eq__(self.materialize(), other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, dict.__repr__(self.materialize()))
+
+    def __reduce__(self):
+        # die registrierten Funktionen sind Closures und nicht picklebar
+        return (type(self), (self.copy(),))
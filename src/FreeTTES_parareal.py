@@ -0,0 +1,221 @@
+"""Parallel-in-time (Parareal) simulation of long input series.
+
+A year of hourly steps is inherently sequential: every step needs the state of
+the one before. Parareal splits the series into `fenster` windows and iterates:
+
+- a cheap coarse propagator (:data:`GROB`: long substeps, coarse cells, no
+  side-stream) runs through all windows one after the other and predicts the
+  state at the start of every window;
+- the full model refines all windows at the same time in a process pool,
+  each from its predicted start state;
+- the start states are corrected with the difference between the fine and
+  the coarse result of the previous window (``U = G_neu + F_alt - G_alt``).
+
+After iteration k the first k windows equal the serial run, so the method
+stops after at most `fenster` iterations; usually the start states converge
+much earlier. The correction acts on the temperatures of water, foundation and
+wall, interpolated onto the cell grid of the fine result. Convergence is
+measured by the RMS temperature change over the height of the water column:
+the largest change at a single position is dominated by small shifts of the
+steep thermocline and hardly decreases between iterations.
+
+Run from ``src/``::
+
+    python FreeTTES_parareal.py --stunden 48 --fenster 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import FreeTTES_config as cfg
+import FreeTTES_model as model
+import FreeTTES_stream as stream
+from FreeTTES_zustand import Modellzustand
+
+# Grobe Konfiguration: 15-min-Subzeitschritte, 1-m-Zellen, kein Nebenstrom
+GROB = {"dt_sub": 900, "max_cell_height": 1.0, "nebenstrom": 0}
+
+
+def beispiel(n_stunden=8761):
+    """Hourly input rows of the schedule in ``example.py``, compressed to `n_stunden`.
+
+    Charge until 1/3 of the year, idle, discharge until 3/4, then idle again.
+    The flows are scaled with the compression, so that the same volume is
+    charged and discharged as in the year of ``example.py``.
+    """
+    f = n_stunden / 8761
+    m_laden = float(model.__Modell_Stoffwerte("rho", 90) * 14 / 3600) / f
+    m_entladen = float(model.__Modell_Stoffwerte("rho", 30) * 14 / 3600) / f
+    zeilen = []
+    for t in range(n_stunden):
+        if t < 2920 * f:
+            m, T_zu = m_laden, 90.0
+        elif t < 3650 * f:
+            m, T_zu = 0.0, 90.0
+        elif t <= 6570 * f:
+            m, T_zu = -m_entladen, 30.0
+        else:
+            m, T_zu = 0.0, 30.0
+        zeilen.append({"m_VL": m, "m_RL": -m, "T_Zustrom": T_zu, "T_amb": 10.0})
+    return zeilen
+
+
+def _temperaturen(teil, h):
+    """Temperatures of the cells in `teil` interpolated at the positions `h`."""
+    h_teil = sorted(teil)
+    return np.interp(h, h_teil, [teil[k][0] for k in h_teil])
+
+
+def _rms_abweichung(a, b, n=400):
+    """RMS temperature difference in K between the water columns of two states, over the height."""
+    h = np.linspace(0, max(max(a.speicher), max(b.speicher)), n)
+    return float(np.sqrt(np.mean((_temperaturen(a.speicher, h) - _temperaturen(b.speicher, h)) ** 2)))
+
+
+def _korrigieren(g_neu, f_alt, g_alt) -> Modellzustand:
+    """Parareal update ``G_neu + F_alt - G_alt`` on the cell grid of `f_alt`."""
+    teile = []
+    for neu, fein, alt in ((g_neu.speicher, f_alt.speicher, g_alt.speicher),
+                           (g_neu.fundament, f_alt.fundament, g_alt.fundament),
+                           (g_neu.kapazitaeten, f_alt.kapazitaeten, g_alt.kapazitaeten)):
+        if not (neu and fein and alt):
+            teile.append({k: list(v) for k, v in fein.items()})
+            continue
+        h = sorted(fein)
+        delta = _temperaturen(neu, h) - _temperaturen(alt, h)
+        teile.append({k: [fein[k][0] + d] + list(fein[k][1:]) for k, d in zip(h, delta.tolist())})
+    return Modellzustand(*teile, t=f_alt.t)
+
+
+def _lauf(zustand, zeilen, dt, t0, parameter, ausgaben):
+    """Run `zeilen` from `zustand` (copied); returns the end state, the outputs and the run time."""
+    beginn = time.perf_counter()
+    zustand = zustand.kopie()
+    ergebnisse = list(stream.simulieren(zeilen, dt, t0=t0, modellzustand=zustand,
+                                        parameter=parameter, ausgaben=ausgaben))
+    return zustand, ergebnisse, time.perf_counter() - beginn
+
+
+def parareal(eingaben, dt, start, fenster=8, grob=None, fein=None, toleranz=0.05, max_iter=None,
+             max_worker=None, ausgaben=stream.AUSGABEN):
+    """Simulate `eingaben` with Parareal over `fenster` time windows.
+
+    Parameters:
+        eingaben: input rows (sequence of dicts, see :func:`FreeTTES_stream.simulieren`)
+        dt (int): timestep of the rows in seconds
+        start (Modellzustand): state at the start of the first row (its `t` is the start time)
+        fenster (int): number of time windows
+        grob (dict): changes to SPEICHER_PARAMETER for the coarse propagator (default :data:`GROB`)
+        fein (dict): changes to SPEICHER_PARAMETER for the fine propagator (default: none)
+        toleranz (float): largest RMS change of the window start states in K to stop at
+        max_iter (int): iterations at most (default `fenster`: then the result is exact)
+        max_worker (int): processes for the fine propagator (default: `fenster`, at most the CPUs)
+        ausgaben: output keys of each record
+
+    Returns:
+        dict with the outputs of every row (``ausgaben``), the end state, the
+        number of iterations, the change of the start states per iteration and
+        the run times of the coarse and fine propagators per iteration
+    """
+    grob = cfg.parameter(GROB if grob is None else grob)
+    fein = cfg.parameter(fein) if fein else None
+    grenzen = [round(w * len(eingaben) / fenster) for w in range(fenster + 1)]
+    fenster_zeilen = [list(eingaben[grenzen[w]:grenzen[w + 1]]) for w in range(fenster)]
+    t_an = [start.t + grenzen[w] * dt / 3600 for w in range(fenster)]
+
+    def grob_lauf(zustand, w):
+        return _lauf(zustand, fenster_zeilen[w], dt, t_an[w], grob, ())
+
+    bericht = {"iterationen": 0, "abweichungen": [], "grob_s": [], "fein_max_s": [], "fein_summe_s": []}
+    # Startschätzung: Grobrechnung durch alle Fenster
+    beginn = time.perf_counter()
+    U, G = [start], []
+    for w in range(fenster):
+        G.append(grob_lauf(U[w], w)[0])
+        U.append(G[w])
+    bericht["grob_s"].append(time.perf_counter() - beginn)
+
+    F, ergebnisse = [None] * fenster, [None] * fenster
+    F_start = [None] * fenster                                          # Startzustand der letzten Feinrechnung
+    max_worker = max_worker or min(fenster, os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_worker) as pool:
+        for k in range(1, (max_iter or fenster) + 1):
+            # Feinrechnung aller Fenster, deren Startzustand sich geändert hat
+            offen = {w: U[w].to_bytes() for w in range(fenster)}
+            offen = {w: daten for w, daten in offen.items() if daten != F_start[w]}
+            laeufe = {w: pool.submit(_lauf, U[w], fenster_zeilen[w], dt, t_an[w], fein, tuple(ausgaben))
+                      for w in offen}
+            zeiten = [0.0]
+            for w, lauf in laeufe.items():
+                F[w], ergebnisse[w], laufzeit = lauf.result()
+                F_start[w] = offen[w]
+                zeiten.append(laufzeit)
+            bericht["fein_max_s"].append(max(zeiten))
+            bericht["fein_summe_s"].append(sum(zeiten))
+
+            # Korrektur der Startzustände, Fenster für Fenster
+            beginn = time.perf_counter()
+            neu, G_neu = [start], []
+            for w in range(fenster):
+                if neu[w].to_bytes() == F_start[w]:                     # Start wie in der Feinrechnung: exakt
+                    G_neu.append(G[w])
+                    neu.append(F[w].kopie())
+                else:
+                    G_neu.append(grob_lauf(neu[w], w)[0])
+                    neu.append(_korrigieren(G_neu[w], F[w], G[w]))
+            bericht["grob_s"].append(time.perf_counter() - beginn)
+            abweichung = max(_rms_abweichung(a, b) for a, b in zip(neu[1:], U[1:]))
+            bericht["iterationen"] = k
+            bericht["abweichungen"].append(abweichung)
+            U, G = neu, G_neu
+            if abweichung <= toleranz:
+                break
+    bericht["ausgaben"] = [ausgabe for teil in ergebnisse for ausgabe in teil]
+    bericht["zustand"] = U[-1]
+    return bericht
+
+
+def vergleich(eingaben, dt, start, **kwargs):
+    """Parareal against the serial run: run times, modelled speedup and errors."""
+    fein = cfg.parameter(kwargs["fein"]) if kwargs.get("fein") else None
+    beginn = time.perf_counter()
+    _, seriell, _ = _lauf(start, eingaben, dt, start.t, fein, kwargs.get("ausgaben", stream.AUSGABEN))
+    t_seriell = time.perf_counter() - beginn
+    beginn = time.perf_counter()
+    bericht = parareal(eingaben, dt, start, **kwargs)
+    t_parareal = time.perf_counter() - beginn
+    # Laufzeit mit einem Kern je Fenster: Grobrechnungen nacheinander, Feinrechnungen parallel
+    t_modell = sum(bericht["grob_s"]) + sum(bericht["fein_max_s"])
+    E_seriell = np.array([a["E_nutz"] for a in seriell])
+    E_parareal = np.array([a["E_nutz"] for a in bericht["ausgaben"]])
+    return {
+        "kerne": os.cpu_count(),
+        "iterationen": bericht["iterationen"],
+        "abweichung_letzte_K": bericht["abweichungen"][-1],
+        "seriell_s": t_seriell,
+        "parareal_s": t_parareal,
+        "speedup": t_seriell / t_parareal,
+        "speedup_je_fenster_ein_kern": t_seriell / t_modell,
+        "T_Austritt_abw_K": max(abs(a["T_Austritt"] - b["T_Austritt"]) for a, b in zip(bericht["ausgaben"], seriell)),
+        "E_nutz_abw_rel": float(np.max(np.abs(E_parareal / E_seriell - 1))),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stunden", type=int, default=8761, help="length of the example.py schedule in hours")
+    parser.add_argument("--fenster", type=int, default=8, help="number of time windows")
+    parser.add_argument("--toleranz", type=float, default=0.05, help="convergence tolerance (RMS) in K")
+    parser.add_argument("--worker", type=int, default=None, help="processes for the fine propagator")
+    args = parser.parse_args()
+    start_profil = {2.0: 27.63, 6.0: 28.39, 10.0: 28.39, 14.0: 28.39, 18.0: 28.39,
+                    22.0: 28.39, 26.0: 28.39, 30.0: 28.42, 34.0: 31.07, 38.0: 44.13}
+    for key, value in vergleich(beispiel(args.stunden), 3600, model.startzustand(start_profil),
+                                fenster=args.fenster, toleranz=args.toleranz, max_worker=args.worker).items():
+        print("%-32s %s" % (key, value))
@@ -0,0 +1,366 @@
+"""Global sensitivity analysis (Morris, Sobol) of the tank model.
+
+The empirical constants of the model are parameters of ``SPEICHER_PARAMETER``
+(see :data:`KONSTANTEN`); :func:`studie` samples them together with further
+parameters (:data:`PARAMETER`) in the ranges of `faktoren`, runs
+:func:`FreeTTES_model.main` over a scenario for every sample in a process pool
+and folds every finished group of runs into the indices at once:
+
+- ``"morris"``: `n` trajectories of ``k + 1`` runs, each changing one factor at
+  a time by 2/3 of its range (``stufen = 4``); elementary effects ``mu``,
+  ``mu_stern`` (mean of absolute effects) and ``sigma`` per unit of the
+  normalized factor;
+- ``"sobol"``: `n` rows of two scrambled Sobol matrices A and B and the ``k``
+  mixed matrices AB_i, ``k + 2`` runs per row; first-order indices ``S1``
+  (Saltelli 2010) and total indices ``ST`` (Jansen).
+
+With `pfad`, every finished run is appended to a JSON lines file behind a
+header describing the study. Calling :func:`studie` again with the same
+arguments reads the file, skips the runs it holds and continues::
+
+    bericht = studie("morris", 20, pfad="morris.jsonl", max_worker=8)
+    bericht["indizes"]["T_Austritt_mittel"]["inversion_d"]["mu_stern"]
+
+The sample plan only depends on the method, `n`, `faktoren`, `stufen` and
+`seed`, so a resumed study draws the same samples.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from scipy.stats import qmc
+
+import FreeTTES_config as cfg
+import FreeTTES_model as model
+import FreeTTES_stream as stream
+from FreeTTES_surrogat import reduzieren
+
+logger = logging.getLogger(__name__)
+
+# Empirische Konstanten des Modells mit Standardwert ± 25 % (alpha_water_innerwall ersetzt den früheren
+# U_Wert in __Modell_Kapazitaeten; nebenstrom_f_WUE fehlt: es wirkt nur mit nebenstrom = 1, das
+# Standardszenario rechnet mit der ausgelieferten Konfiguration ohne Nebenstrom)
+KONSTANTEN = {
+    "inversion_d": (11.7, 19.5),
+    "inversion_e": (0.124, 0.206),
+    "inversion_f": (0.092, 0.154),
+    "inversion_g": (0.81, 1.35),
+    "inversion_h": (18.75, 31.25),
+    "inversion_j": (4.16, 6.93),
+    "inversion_unten_d": (2.25, 3.75),
+    "inversion_unten_e": (0.03, 0.05),
+    "inversion_unten_f": (0.0225, 0.0375),
+    "inversion_unten_g": (2.25, 3.75),
+    "inversion_unten_h": (7.5, 12.5),
+    "inversion_unten_j": (7.5, 12.5),
+    "impuls_an_b_teiler": (2.25, 3.75),
+    "alpha_water_innerwall": (600, 1000),
+}
+# Weitere SPEICHER_PARAMETER, die standardmäßig mit untersucht werden (lambda_fundament fehlt: es formt nur
+# das Startprofil des Fundaments, die Wärmeleitung rechnet mit __Temperatur_Unabhaengige_Stoffwerte)
+PARAMETER = {
+    "U_Mantel": (0.1, 0.4),
+    "T_Erdreich": (5.0, 15.0),
+}
+FAKTOREN = {**KONSTANTEN, **PARAMETER}
+ZIELE = ("E_nutz_ende", "T_Austritt_mittel", "breite_ende")
+METHODEN = ("morris", "sobol")
+
+
+def standardszenario(stunden_laden=2, stunden_entladen=2, dt=900):
+    """Default scenario (start profile, input rows, dt): charge at 85 °C, then discharge at 45 °C.
+
+    The profile is stratified (90 °C above, 40 °C below 20 m), so charging
+    forms a falling inversion below the upper diffuser and discharging a
+    rising one above the bottom diffuser.
+    """
+    profil = {h: (90.0 if h > 20 else 40.0) for h in np.arange(2.0, 40.0, 2.0).tolist()}
+    laden = {"m_VL": 40.0, "m_RL": -40.0, "T_Zustrom": 85.0, "T_amb": 10.0}
+    entladen = {"m_VL": -40.0, "m_RL": 40.0, "T_Zustrom": 45.0, "T_amb": 10.0}
+    schritte = 3600 // dt
+    return profil, [laden] * (stunden_laden * schritte) + [entladen] * (stunden_entladen * schritte), dt
+
+
+def kennzahlen(zustand, ausgaben):
+    """Outputs of one run: usable energy and mixing zone width at the end, mean outlet temperature."""
+    return {
+        "E_nutz_ende": ausgaben[-1]["E_nutz"],
+        "T_Austritt_mittel": float(np.mean([a["T_Austritt"] for a in ausgaben])),
+        "breite_ende": float(reduzieren(zustand)[2]),
+    }
+
+
+# // Stichprobenplan
+def _morris(k, n, stufen, rng):
+    """`n` trajectories in the unit cube: points, factor changed per step and its direction."""
+    delta = stufen / (2 * (stufen - 1))
+    untere = np.arange(stufen // 2) / (stufen - 1)                     # Startwerte mit x + delta <= 1
+    plan = []
+    for _ in range(n):
+        richtung = rng.choice((-1, 1), k)
+        x = rng.choice(untere, k) + (richtung < 0) * delta
+        reihenfolge = rng.permutation(k)
+        punkte = [x.copy()]
+        for i in reihenfolge:
+            x[i] += richtung[i] * delta
+            punkte.append(x.copy())
+        plan.append({"punkte": np.array(punkte), "faktor": reihenfolge, "schritt": richtung[reihenfolge] * delta})
+    return plan
+
+
+def _sobol(k, n, seed):
+    """`n` groups ``A_j, B_j, AB_1j ... AB_kj`` in the unit cube from scrambled Sobol points."""
+    punkte = qmc.Sobol(2 * k, seed=seed).random(n)
+    A, B = punkte[:, :k], punkte[:, k:]
+    plan = []
+    for a, b in zip(A, B):
+        gemischt = np.repeat(a[None, :], k, axis=0)
+        gemischt[np.arange(k), np.arange(k)] = b
+        plan.append({"punkte": np.vstack([a, b, gemischt])})
+    return plan
+
+
+def plan(methode, n, faktoren=None, stufen=4, seed=0):
+    """Sample plan of a study: list of groups with the factor values of their runs (``werte``)."""
+    faktoren = dict(FAKTOREN if faktoren is None else faktoren)
+    if methode == "morris":
+        gruppen = _morris(len(faktoren), n, stufen, np.random.default_rng(seed))
+    elif methode == "sobol":
+        gruppen = _sobol(len(faktoren), n, seed)
+    else:
+        raise ValueError("methode must be one of %s, not %r" % (METHODEN, methode))
+    unten, oben = np.array(list(faktoren.values()), dtype=float).T
+    for gruppe in gruppen:
+        gruppe["werte"] = unten + gruppe["punkte"] * (oben - unten)
+    return gruppen
+
+
+# // Laufende Indizes
+class Morriseffekte:
+    """Running means of the elementary effects (per unit of the normalized factor)."""
+
+    def __init__(self, faktoren, ziele):
+        self.faktoren, self.ziele = list(faktoren), list(ziele)
+        k, m = len(self.faktoren), len(self.ziele)
+        self.n = 0
+        self._summe, self._betrag, self._quadrat = np.zeros((k, m)), np.zeros((k, m)), np.zeros((k, m))
+
+    def hinzufuegen(self, gruppe, y):
+        """Fold in one trajectory; `y` holds the outputs of its runs (rows)."""
+        effekte = np.diff(y, axis=0) / gruppe["schritt"][:, None]
+        self._summe[gruppe["faktor"]] += effekte
+        self._betrag[gruppe["faktor"]] += np.abs(effekte)
+        self._quadrat[gruppe["faktor"]] += effekte ** 2
+        self.n += 1
+
+    def indizes(self):
+        n = max(self.n, 1)
+        mu = self._summe / n
+        sigma = np.sqrt(np.maximum(self._quadrat - n * mu ** 2, 0) / max(self.n - 1, 1))
+        return {ziel: {faktor: {"mu": float(mu[i, z]), "mu_stern": float(self._betrag[i, z] / n),
+                                "sigma": float(sigma[i, z])}
+                       for i, faktor in enumerate(self.faktoren)}
+                for z, ziel in enumerate(self.ziele)}
+
+
+class Sobolindizes:
+    """Running sums of the Saltelli (S1) and Jansen (ST) estimators.
+
+    The outputs are shifted by those of the first group, so that the sums of
+    squares do not cancel for outputs with a large mean and a small spread.
+    """
+
+    def __init__(self, faktoren, ziele):
+        self.faktoren, self.ziele = list(faktoren), list(ziele)
+        k, m = len(self.faktoren), len(self.ziele)
+        self.n = 0
+        self._bezug = None
+        self._summe, self._quadrat = np.zeros(m), np.zeros(m)
+        self._erste, self._totale = np.zeros((k, m)), np.zeros((k, m))
+
+    def hinzufuegen(self, gruppe, y):
+        """Fold in one row; `y` holds the outputs of ``A_j, B_j, AB_1j ... AB_kj``."""
+        if self._bezug is None:
+            self._bezug = y[0].copy()
+        y = y - self._bezug
+        f_A, f_B, f_AB = y[0], y[1], y[2:]
+        self._summe += f_A + f_B
+        self._quadrat += f_A ** 2 + f_B ** 2
+        self._erste += f_B * (f_AB - f_A)
+        self._totale += (f_A - f_AB) ** 2 / 2
+        self.n += 1
+
+    def indizes(self):
+        n = max(self.n, 1)
+        mittel = self._summe / (2 * n)
+        varianz = self._quadrat / (2 * n) - mittel ** 2
+        varianz = np.where(varianz > 0, varianz, np.nan)
+        S1, ST = self._erste / n / varianz, self._totale / n / varianz
+        return {ziel: {faktor: {"S1": float(S1[i, z]), "ST": float(ST[i, z])}
+                       for i, faktor in enumerate(self.faktoren)}
+                for z, ziel in enumerate(self.ziele)}
+
+
+# // Checkpoint der Einzelläufe
+def _kopf(methode, n, faktoren, stufen, seed, ziele):
+    return {"methode": methode, "n": n, "faktoren": {k: list(v) for k, v in faktoren.items()},
+            "stufen": stufen, "seed": seed, "ziele": list(ziele)}
+
+
+def _einlesen(pfad, kopf):
+    """Runs recorded in `pfad` as {(group, run): outputs}; a line cut off at the end is dropped."""
+    fertig = {}
+    with open(pfad, "r+", encoding="utf-8") as datei:
+        gueltig = 0
+        for nummer, zeile in enumerate(iter(datei.readline, "")):
+            if not zeile.endswith("\n"):
+                break
+            eintrag = json.loads(zeile)
+            if nummer == 0:
+                if eintrag != kopf:
+                    raise ValueError("%s belongs to another study: %s" % (pfad, eintrag))
+            else:
+                fertig[(eintrag["g"], eintrag["p"])] = eintrag["y"]
+            gueltig = datei.tell()
+        datei.truncate(gueltig)
+    return fertig
+
+
+# // Worker
+_szenario = None
+
+
+def _vorbereiten(szenario):
+    """Worker initializer: the scenario is sent once per process, not with every run."""
+    global _szenario
+    _szenario = szenario
+
+
+def _lauf(aenderungen, ziele, auswerten):
+    """Worker: one run of the scenario with `aenderungen` to SPEICHER_PARAMETER; outputs or None."""
+    profil, zeilen, dt = _szenario
+    parameter = cfg.parameter(aenderungen)
+    try:
+        zustand = model.startzustand(profil, parameter=parameter)
+        ausgaben = list(stream.simulieren(zeilen, dt, modellzustand=zustand, parameter=parameter,
+                                          ausgaben=("E_nutz", "T_Austritt")))
+    except ValueError as fehler:                                        # Modell verlässt seinen Gültigkeitsbereich
+        logger.warning("run with %s failed: %s", aenderungen, fehler)
+        return None
+    werte = auswerten(zustand, ausgaben)
+    return [float(werte[ziel]) for ziel in ziele]
+
+
+def studie(methode, n, faktoren=None, szenario=None, pfad=None, stufen=4, seed=0, max_worker=None,
+           max_laeufe=None, ziele=ZIELE, auswerten=kennzahlen, zwischenstand=None):
+    """Run a Morris or Sobol study and return the indices.
+
+    Parameters:
+        methode (str): ``"morris"`` or ``"sobol"``
+        n (int): trajectories (Morris) or rows of the Sobol matrices (a power of 2)
+        faktoren (dict): SPEICHER_PARAMETER key -> (lower, upper bound) (default :data:`FAKTOREN`)
+        szenario (tuple): start profile, input rows, dt (default :func:`standardszenario`)
+        pfad (str): JSON lines file of the finished runs; an existing file of the same study is resumed
+        stufen (int): grid levels of the Morris method (even)
+        seed (int): seed of the sample plan
+        max_worker (int): processes (default: number of CPUs)
+        max_laeufe (int): stop after this many new runs (the study can be resumed from `pfad`)
+        ziele: keys of the outputs returned by `auswerten`
+        auswerten: ``auswerten(zustand, ausgaben) -> dict`` of the outputs of one run
+            (module level function, it is sent to the workers)
+        zwischenstand: called as ``zwischenstand(gruppen, indizes)`` after every finished group
+
+    Returns:
+        dict with the indices per output and factor (``indizes``), the finished
+        and total number of groups, the runs of this call, the failed runs
+        (their groups are left out) and the run time
+    """
+    faktoren = dict(FAKTOREN if faktoren is None else faktoren)
+    szenario = szenario or standardszenario()
+    gruppen = plan(methode, n, faktoren, stufen, seed)
+    index = (Morriseffekte if methode == "morris" else Sobolindizes)(faktoren, ziele)
+
+    fertig = {}
+    if pfad and os.path.exists(pfad) and os.path.getsize(pfad) > 0:
+        fertig = _einlesen(pfad, _kopf(methode, n, faktoren, stufen, seed, ziele))
+    protokoll = open(pfad, "a", encoding="utf-8") if pfad else None
+    if protokoll is not None and protokoll.tell() == 0:
+        protokoll.write(json.dumps(_kopf(methode, n, faktoren, stufen, seed, ziele)) + "\n")
+
+    y = [np.full((len(g["werte"]), len(ziele)), np.nan) for g in gruppen]
+    offen = [len(g["werte"]) for g in gruppen]
+    bericht = {"methode": methode, "gruppen": 0, "gruppen_gesamt": len(gruppen), "laeufe": 0,
+               "fehlgeschlagen": 0}
+
+    def eintragen(g, p, werte):
+        if werte is None:
+            bericht["fehlgeschlagen"] += 1
+        else:
+            y[g][p] = werte
+        offen[g] -= 1
+        if offen[g] == 0 and not np.isnan(y[g]).any():                 # Gruppe vollständig: in die Indizes
+            index.hinzufuegen(gruppen[g], y[g])
+            bericht["gruppen"] += 1
+            if zwischenstand is not None:
+                zwischenstand(bericht["gruppen"], index.indizes())
+
+    for (g, p), werte in fertig.items():
+        eintragen(g, p, werte)
+    aufgaben = [(g, p) for g, gruppe in enumerate(gruppen) for p in range(len(gruppe["werte"]))
+                if (g, p) not in fertig][:max_laeufe]
+
+    beginn = time.perf_counter()
+    max_worker = max_worker or os.cpu_count() or 1
+    namen = list(faktoren)
+    try:
+        with ProcessPoolExecutor(max_worker, initializer=_vorbereiten, initargs=(szenario,)) as pool:
+            laufend = {}
+            naechste = iter(aufgaben)
+            while True:
+                # höchstens zwei Läufe je Worker auf einmal einreichen, der Plan kann sehr lang sein
+                for g, p in naechste:
+                    aenderungen = dict(zip(namen, gruppen[g]["werte"][p].tolist()))
+                    laufend[pool.submit(_lauf, aenderungen, tuple(ziele), auswerten)] = (g, p)
+                    if len(laufend) >= 2 * max_worker:
+                        break
+                if not laufend:
+                    break
+                erledigt, _ = wait(laufend, return_when=FIRST_COMPLETED)
+                for lauf in erledigt:
+                    g, p = laufend.pop(lauf)
+                    werte = lauf.result()
+                    if protokoll is not None:
+                        protokoll.write(json.dumps({"g": g, "p": p, "y": werte}) + "\n")
+                        protokoll.flush()
+                    bericht["laeufe"] += 1
+                    eintragen(g, p, werte)
+    finally:
+        if protokoll is not None:
+            protokoll.close()
+    bericht["laufzeit_s"] = time.perf_counter() - beginn
+    bericht["indizes"] = index.indizes()
+    return bericht
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("methode", choices=METHODEN)
+    parser.add_argument("n", type=int, help="trajectories (morris) or rows (sobol, a power of 2)")
+    parser.add_argument("--pfad", default=None, help="JSON lines file of the runs, resumed if it exists")
+    parser.add_argument("--worker", type=int, default=None, help="number of processes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    ergebnis = studie(args.methode, args.n, pfad=args.pfad, seed=args.seed, max_worker=args.worker)
+    kennwert = "mu_stern" if args.methode == "morris" else "ST"
+    for ziel, je_faktor in ergebnis["indizes"].items():
+        print(ziel)
+        for faktor, werte in sorted(je_faktor.items(), key=lambda e: -abs(e[1][kennwert])):
+            print("    %-24s %s" % (faktor, "  ".join("%s %.4g" % kv for kv in werte.items())))
@@ -0,0 +1,364 @@
+"""Local co-simulation server hosting named TES tanks in memory.
+
+A plant simulator in another process couples to the tanks over a Unix socket
+(or localhost TCP where Unix sockets are not available) instead of Python calls
+and the shared ``datei/`` files. Every tank is a :class:`~FreeTTES_simulator.Speicher`.
+
+Message format (all little-endian): every message is framed by its length as
+``uint32``. A request starts with the operation code (``uint8``), a response
+with the status (0 = ok, 1 = error, followed by the message as UTF-8). Names
+are ``uint8`` length + UTF-8; inputs and outputs are float64.
+
+=========  ===========================================  ==========================
+operation  request body                                 response body
+=========  ===========================================  ==========================
+INIT       name, JSON {"zustand", "parameter", "t"}     --
+STEP       name, dt, m_VL, m_RL, T_Zustrom, T_amb       `AUSGABEN` as float64
+BATCH      uint16 n, n x STEP body                      uint16 n, n x `AUSGABEN`
+GET_STATE  name                                         Modellzustand.to_bytes()
+SET_STATE  name, Modellzustand.to_bytes()               --
+SNAPSHOT   name, marke                                  --
+RESTORE    name, marke                                  --
+METRIKEN   --                                           JSON of the server metrics
+=========  ===========================================  ==========================
+
+A BATCH is atomic: if one of its steps fails, every tank of the batch goes back
+to its state before the batch and the error is returned.
+
+Run from ``src/``::
+
+    python FreeTTES_server.py serve --adresse /tmp/freettes.sock
+    python FreeTTES_server.py last --adresse /tmp/freettes.sock --tanks 4 --batch 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from FreeTTES_echtzeit import Latenzen
+from FreeTTES_simulator import Speicher
+
+logger = logging.getLogger(__name__)
+
+INIT, STEP, BATCH, GET_STATE, SET_STATE, SNAPSHOT, RESTORE, METRIKEN = range(1, 9)
+_NAMEN = {INIT: "init", STEP: "step", BATCH: "batch", GET_STATE: "get_state",
+          SET_STATE: "set_state", SNAPSHOT: "snapshot", RESTORE: "restore", METRIKEN: "metriken"}
+OK, FEHLER = 0, 1
+
+# Ausgaben je Schritt in dieser Reihenfolge
+AUSGABEN = ("t", "T_Austritt", "E_nutz", "m_nutz", "H_WS")
+
+_LAENGE = struct.Struct("<I")
+_EINGABEN = struct.Struct("<5d")                # dt, m_VL, m_RL, T_Zustrom, T_amb
+_ERGEBNIS = struct.Struct("<%dd" % len(AUSGABEN))
+_ANZAHL = struct.Struct("<H")
+
+
+# -- Kodierung ---------------------------------------------------------------
+def _name(name):
+    daten = name.encode("utf-8")
+    if len(daten) > 255:
+        raise ValueError("name longer than 255 bytes: %r" % name)
+    return bytes((len(daten),)) + daten
+
+
+def _name_lesen(daten, pos):
+    n = daten[pos]
+    return bytes(daten[pos + 1:pos + 1 + n]).decode("utf-8"), pos + 1 + n
+
+
+def _senden(sock, nutzdaten):
+    sock.sendall(_LAENGE.pack(len(nutzdaten)) + nutzdaten)
+
+
+def _genau(sock, n):
+    puffer = bytearray()
+    while len(puffer) < n:
+        teil = sock.recv(n - len(puffer))
+        if not teil:
+            raise ConnectionError("connection closed")
+        puffer += teil
+    return bytes(puffer)
+
+
+def _empfangen(sock):
+    (n,) = _LAENGE.unpack(_genau(sock, _LAENGE.size))
+    return _genau(sock, n)
+
+
+def adresse_parsen(adresse):
+    """``"host:port"`` -> TCP address, anything else -> Unix socket path."""
+    if isinstance(adresse, tuple):
+        return socket.AF_INET, adresse
+    host, _, port = adresse.rpartition(":")
+    if port.isdigit() and os.sep not in adresse:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("Unix sockets are not available here, use host:port")
+    return socket.AF_UNIX, adresse
+
+
+# -- Server ------------------------------------------------------------------
+class _Verbindung(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                anfrage = _empfangen(self.request)
+            except (ConnectionError, OSError):
+                return
+            _senden(self.request, self.server.tanks.bearbeiten(anfrage))
+
+
+class Tankserver:
+    """Named tanks in memory and the dispatch of binary requests.
+
+    The model shares module-level parameters, so requests are executed one at
+    a time; connections are served by separate threads.
+    """
+
+    def __init__(self):
+        self.tanks = {}
+        self._sperre = threading.Lock()
+        self.start = time.perf_counter()
+        self.latenzen = {name: Latenzen() for name in _NAMEN.values()}
+        self.schritte = 0
+
+    def tank(self, name) -> Speicher:
+        if name not in self.tanks:
+            raise KeyError("unknown tank %r (INIT first)" % name)
+        return self.tanks[name]
+
+    def _schritt(self, daten, pos, vorher=None):
+        name, pos = _name_lesen(daten, pos)
+        dt, m_VL, m_RL, T_Zustrom, T_amb = _EINGABEN.unpack_from(daten, pos)
+        tank = self.tank(name)
+        if vorher is not None and name not in vorher:
+            vorher[name] = tank.get_state()
+        result = tank.step(dt, m_VL, m_RL, T_Zustrom, T_amb)
+        self.schritte += 1
+        return _ERGEBNIS.pack(*(float(result[k]) for k in AUSGABEN)), pos + _EINGABEN.size
+
+    def _ausfuehren(self, op, daten):
+        if op == STEP:
+            return self._schritt(daten, 1)[0]
+        if op == BATCH:
+            (n,) = _ANZAHL.unpack_from(daten, 1)
+            pos = 1 + _ANZAHL.size
+            teile = [_ANZAHL.pack(n)]
+            vorher = {}
+            schritte = self.schritte
+            try:
+                for _ in range(n):
+                    ergebnis, pos = self._schritt(daten, pos, vorher)
+                    teile.append(ergebnis)
+            except Exception:                                   # ganz oder gar nicht
+                for name, zustand in vorher.items():
+                    self.tanks[name].set_state(zustand)
+                self.schritte = schritte
+                raise
+            return b"".join(teile)
+        if op == METRIKEN:
+            return json.dumps(self.metriken()).encode("utf-8")
+        name, pos = _name_lesen(daten, 1)
+        if op == INIT:
+            optionen = json.loads(bytes(daten[pos:]) or b"{}")
+            zustand = optionen.get("zustand")
+            tank = Speicher(name, parameter=optionen.get("parameter"))
+            tank.init({float(h): T for h, T in zustand.items()} if zustand else None,
+                      t=optionen.get("t", 0.0))
+            self.tanks[name] = tank
+        elif op == GET_STATE:
+            return self.tank(name).zustand.to_bytes()
+        elif op == SET_STATE:
+            self.tank(name).set_state(bytes(daten[pos:]))
+        elif op == SNAPSHOT:
+            self.tank(name).snapshot(_name_lesen(daten, pos)[0])
+        elif op == RESTORE:
+            self.tank(name).restore(_name_lesen(daten, pos)[0])
+        else:
+            raise ValueError("unknown operation %d" % op)
+        return b""
+
+    def bearbeiten(self, anfrage) -> bytes:
+        """Execute one request and return the response (status + body)."""
+        op = anfrage[0] if anfrage else 0
+        start = time.perf_counter()
+        try:
+            with self._sperre:
+                antwort = bytes((OK,)) + self._ausfuehren(op, anfrage)
+        except Exception as fehler:                             # an den Client melden, Server läuft weiter
+            logger.warning("request %s failed: %s", _NAMEN.get(op, op), fehler)
+            antwort = bytes((FEHLER,)) + ("%s: %s" % (type(fehler).__name__, fehler)).encode("utf-8")
+        if op in _NAMEN:
+            self.latenzen[_NAMEN[op]].add(time.perf_counter() - start)
+        return antwort
+
+    def metriken(self) -> dict:
+        """Request latencies per operation, request and step throughput since start."""
+        laufzeit = time.perf_counter() - self.start
+        anfragen = sum(l.anzahl for l in self.latenzen.values())
+        return {
+            "laufzeit_s": laufzeit,
+            "tanks": len(self.tanks),
+            "anfragen": anfragen,
+            "schritte": self.schritte,
+            "anfragen_pro_s": anfragen / laufzeit,
+            "schritte_pro_s": self.schritte / laufzeit,
+            "latenzen": {name: l.statistik() for name, l in self.latenzen.items() if l.anzahl},
+        }
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+
+def server(adresse):
+    """Socket server for `adresse` (not yet serving); its tanks are ``server.tanks``."""
+    familie, adresse = adresse_parsen(adresse)
+    if familie == socket.AF_INET:
+        klasse = _TCPServer
+    else:
+        klasse = _UnixServer
+        if os.path.exists(adresse):
+            os.remove(adresse)
+    srv = klasse(adresse, _Verbindung)
+    srv.tanks = Tankserver()
+    return srv
+
+
+# -- Client ------------------------------------------------------------------
+class Client:
+    """Connection to a tank server; the methods mirror the operations."""
+
+    def __init__(self, adresse):
+        familie, adresse = adresse_parsen(adresse)
+        self.sock = socket.socket(familie, socket.SOCK_STREAM)
+        if familie == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(adresse)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def _anfrage(self, op, body=b""):
+        _senden(self.sock, bytes((op,)) + body)
+        antwort = _empfangen(self.sock)
+        if antwort[0] != OK:
+            raise RuntimeError(antwort[1:].decode("utf-8"))
+        return antwort[1:]
+
+    def init(self, name, zustand=None, parameter=None, t=0.0):
+        optionen = {"t": t}
+        if zustand:
+            optionen["zustand"] = {str(h): T for h, T in zustand.items()}
+        if parameter:
+            optionen["parameter"] = parameter
+        self._anfrage(INIT, _name(name) + json.dumps(optionen).encode("utf-8"))
+
+    def step(self, name, dt, m_VL, m_RL, T_Zustrom, T_amb) -> dict:
+        daten = self._anfrage(STEP, _name(name) + _EINGABEN.pack(dt, m_VL, m_RL, T_Zustrom, T_amb))
+        return dict(zip(AUSGABEN, _ERGEBNIS.unpack(daten)))
+
+    def batch(self, schritte) -> list:
+        """Several steps in one round trip; `schritte` holds (name, dt, m_VL, m_RL, T_Zustrom, T_amb)."""
+        body = [_ANZAHL.pack(len(schritte))]
+        for name, *eingaben in schritte:
+            body.append(_name(name) + _EINGABEN.pack(*eingaben))
+        daten = self._anfrage(BATCH, b"".join(body))
+        (n,) = _ANZAHL.unpack_from(daten, 0)
+        return [dict(zip(AUSGABEN, _ERGEBNIS.unpack_from(daten, _ANZAHL.size + i * _ERGEBNIS.size)))
+                for i in range(n)]
+
+    def get_state(self, name) -> bytes:
+        """State of the tank as Modellzustand bytes."""
+        return self._anfrage(GET_STATE, _name(name))
+
+    def set_state(self, name, zustand):
+        if not isinstance(zustand, (bytes, bytearray)):
+            zustand = zustand.to_bytes()
+        self._anfrage(SET_STATE, _name(name) + bytes(zustand))
+
+    def snapshot(self, name, marke=""):
+        self._anfrage(SNAPSHOT, _name(name) + _name(marke))
+
+    def restore(self, name, marke=""):
+        self._anfrage(RESTORE, _name(name) + _name(marke))
+
+    def metriken(self) -> dict:
+        return json.loads(self._anfrage(METRIKEN))
+
+
+# -- Lastgenerator -----------------------------------------------------------
+def last(adresse, n_tanks=4, n_schritte=20, batch=1, dt=900, zustand=None):
+    """Step `n_tanks` tanks `n_schritte` times, `batch` steps per round trip.
+
+    Returns the client-side round-trip latencies and the step throughput.
+    """
+    latenzen = Latenzen()
+    namen = ["tank_%d" % i for i in range(n_tanks)]
+    with Client(adresse) as client:
+        for name in namen:
+            client.init(name, zustand=zustand)
+        auftraege = []
+        for k in range(n_schritte):
+            m, T_zu = ((20, 80), (-20, 25), (0, 60))[k % 3]             # laden, entladen, Stillstand
+            auftraege.extend((name, dt, m, -m, T_zu, 10.0) for name in namen)
+        start = time.perf_counter()
+        for i in range(0, len(auftraege), batch):
+            teil = auftraege[i:i + batch]
+            beginn = time.perf_counter()
+            if batch == 1:
+                client.step(*teil[0])
+            else:
+                client.batch(teil)
+            latenzen.add(time.perf_counter() - beginn)
+        laufzeit = time.perf_counter() - start
+    werte = latenzen.statistik()
+    return {"anfragen": werte["anzahl"], "schritte": len(auftraege), "laufzeit_s": laufzeit,
+            "schritte_pro_s": len(auftraege) / laufzeit,
+            **{"latenz_%s_s" % k: werte[k] for k in ("mittel", "p50", "p95", "p99", "max")}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    unter = parser.add_subparsers(dest="befehl", required=True)
+    serve = unter.add_parser("serve", help="run the server")
+    lg = unter.add_parser("last", help="run the load generator against a server")
+    for p in (serve, lg):
+        p.add_argument("--adresse", default="127.0.0.1:7007",
+                       help="Unix socket path or host:port (default: %(default)s)")
+    lg.add_argument("--tanks", type=int, default=4)
+    lg.add_argument("--schritte", type=int, default=20)
+    lg.add_argument("--batch", type=int, default=1)
+    lg.add_argument("--dt", type=int, default=900)
+    args = parser.parse_args()
+    if args.befehl == "serve":
+        logging.basicConfig(level=logging.INFO)
+        with server(args.adresse) as srv:
+            logger.info("serving on %s", args.adresse)
+            srv.serve_forever()
+    else:
+        for key, value in last(args.adresse, args.tanks, args.schritte, args.batch, args.dt).items():
+            print("%-24s %12.6g" % (key, value))
@@ -0,0 +1,98 @@
+"""Tank instances with their state held in memory.
+
+:func:`FreeTTES_model.main` keeps the state of the single tank of a process in
+the ``last_profile_*.csv`` files. :class:`Speicher` holds the state of one tank
+in a :class:`~FreeTTES_zustand.Modellzustand` instead, so that any number of
+named tanks can be stepped side by side, and their states can be read, set,
+saved and restored without files.
+"""
+
+from __future__ import annotations
+
+import FreeTTES_cache as _cache
+import FreeTTES_config as cfg
+import FreeTTES_model as model
+from FreeTTES_model import modell_sperre
+from FreeTTES_zustand import Modellzustand
+
+
+class Speicher:
+    """One TES tank: its state, its model time and optionally its own parameters.
+
+    name: name of the instance (used by the server and in reprs)
+    parameter: changes to SPEICHER_PARAMETER of config.json for this tank
+    cache: :class:`~FreeTTES_cache.SchrittCache` for repeated steps (may be shared by
+        several tanks); hits return the stored state and outputs without running `main()`,
+        and cached steps return only the outputs the cache keeps, hit or miss
+    """
+
+    def __init__(self, name="speicher", parameter=None, cache=None):
+        self.name = name
+        self.parameter = cfg.parameter(parameter) if parameter else None
+        self.zustand = Modellzustand()
+        self.cache = cache
+        self._snapshots = {}
+
+    def __repr__(self):
+        return "Speicher(%r, %r)" % (self.name, self.zustand)
+
+    @property
+    def t(self) -> float:
+        """Model time in hours at the end of the last step."""
+        return self.zustand.t
+
+    def init(self, zustand=None, t=0.0):
+        """Initialize the tank (as `main()` at t = 0), optionally from a measured profile."""
+        with modell_sperre:
+            self.zustand = model.startzustand(zustand, parameter=self.parameter)
+        self.zustand.t = t
+        return self.zustand
+
+    def step(self, dt, m_VL, m_RL, T_Zustrom, T_amb, **kwargs):
+        """Advance the tank by `dt` seconds; arguments and result as :func:`FreeTTES_model.main`."""
+        if not self.zustand:
+            self.init(t=self.zustand.t)
+        key = self._schritt_schluessel(dt, m_VL, m_RL, T_Zustrom, T_amb, kwargs)
+        if key is not None:
+            eintrag = self.cache.laden(key)
+            if eintrag is not None:
+                self.zustand, result = eintrag
+                return result
+        with modell_sperre:
+            result = model.main(t=self.zustand.t, dt=dt, m_VL=m_VL, m_RL=m_RL, T_Zustrom=T_Zustrom,
+                                T_amb=T_amb, modellzustand=self.zustand, parameter=self.parameter,
+                                **kwargs)
+        if key is not None:
+            result = self.cache.speichern(key, self.zustand, result)    # gleiche Ausgaben wie bei einem Treffer
+        return result
+
+    def _schritt_schluessel(self, dt, m_VL, m_RL, T_Zustrom, T_amb, optionen):
+        """Key of the step in the cache, ``None`` if the step is not cached."""
+        if self.cache is None or not self.cache.zulaessig(dt, m_VL, m_RL, T_Zustrom, T_amb, *optionen.values()):
+            return None
+        parameter = self.parameter or cfg.load_speicher_param()
+        if parameter.get("echtzeit_budget", 0) > 0:                 # Frist macht das Ergebnis laufzeitabhängig
+            return None
+        kontext = _cache.schluessel(parameter, optionen)
+        return self.cache.schluessel(self.zustand, (dt, m_VL, m_RL, T_Zustrom, T_amb), kontext)
+
+    def get_state(self) -> Modellzustand:
+        """Copy of the current state."""
+        return self.zustand.kopie()
+
+    def set_state(self, zustand):
+        """Continue from `zustand` (a Modellzustand or its bytes); the argument is copied."""
+        if isinstance(zustand, (bytes, bytearray, memoryview)):
+            zustand = Modellzustand.from_bytes(zustand)
+        self.zustand = zustand.kopie()
+
+    def snapshot(self, marke="") -> Modellzustand:
+        """Keep a copy of the current state under `marke` and return it."""
+        self._snapshots[marke] = self.zustand.kopie()
+        return self._snapshots[marke]
+
+    def restore(self, marke=""):
+        """Go back to the state saved under `marke`."""
+        if marke not in self._snapshots:
+            raise KeyError("no snapshot %r of %r" % (marke, self.name))
+        self.zustand = self._snapshots[marke].kopie()
@@ -0,0 +1,269 @@
+"""Streaming pipeline for long input time series of the TES tank model.
+
+Operator logs over several years at minute resolution are too large to hold as
+Python lists. The pipeline works in three generator stages:
+
+- :func:`bloecke` / :func:`zeilen` read the input columns from a CSV file, an
+  ``.npy`` file or a directory of one ``.npy`` file per column, a block of
+  rows at a time.
+- :func:`simulieren` calls :func:`FreeTTES_model.main` for every row and
+  yields one output record per time step.
+- :class:`Spaltenspeicher` collects the records in a fixed-size buffer and
+  appends them to one ``.npy`` file per output column.
+
+Only one block of input and one buffer of output are held at a time, so the
+memory does not grow with the length of the series.
+
+Run from ``src/``::
+
+    python FreeTTES_stream.py eingabe.csv ergebnisse/ --dt 60
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import csv
+import os
+import struct
+
+import numpy as np
+
+import FreeTTES_model as model
+from FreeTTES_zustand import Modellzustand
+
+# Eingabespalten von main(); T_Abstrom nur für eingabe_volumen
+EINGABEN = ("m_VL", "m_RL", "T_Zustrom", "T_amb")
+OPTIONAL = ("T_Abstrom",)
+# Standardausgaben je Zeitschritt (nur diese Kennzahlen werden berechnet)
+AUSGABEN = ("t", "T_Austritt", "E_nutz", "m_nutz", "H_WS", "T_Diff_O", "T_Diff_U", "Q_V_ges")
+
+_NPY_KOPF = 128                 # feste Kopflänge, damit die Zeilenzahl am Ende eingetragen werden kann
+
+
+def _spalten_npy(pfad, spalten):
+    """Memory-mapped input columns of an ``.npy`` file or a directory of them."""
+    if os.path.isdir(pfad):
+        daten = {}
+        for name in spalten + OPTIONAL:
+            datei = os.path.join(pfad, name + ".npy")
+            if os.path.exists(datei):
+                daten[name] = np.load(datei, mmap_mode="r")
+        return daten
+    feld = np.load(pfad, mmap_mode="r")
+    if feld.dtype.names:                                                # strukturiertes Array mit Spaltennamen
+        return {name: feld[name] for name in spalten + OPTIONAL if name in feld.dtype.names}
+    if feld.ndim != 2 or feld.shape[1] < len(spalten):
+        raise ValueError(f"{pfad}: 2-D array with the columns {spalten} (+ {OPTIONAL}) expected")
+    return {name: feld[:, i] for i, name in enumerate(spalten + OPTIONAL[:feld.shape[1] - len(spalten)])}
+
+
+def bloecke(pfad, spalten=EINGABEN, blockgroesse=4096):
+    """Yield the input columns of `pfad` as dicts of float arrays, `blockgroesse` rows each.
+
+    CSV files need a header row with the column names; further columns are
+    ignored. Of the optional columns (`OPTIONAL`), those present are included.
+    """
+    spalten = tuple(spalten)
+    if os.path.isdir(pfad) or pfad.endswith(".npy"):
+        daten = _spalten_npy(pfad, spalten)
+        fehlend = [name for name in spalten if name not in daten]
+        if fehlend:
+            raise ValueError(f"{pfad}: missing input columns {fehlend}")
+        n = min(len(v) for v in daten.values())
+        for start in range(0, n, blockgroesse):
+            yield {name: np.asarray(v[start:start + blockgroesse], dtype=float)
+                   for name, v in daten.items()}
+        return
+
+    with open(pfad, newline="", encoding="utf-8") as f:
+        leser = csv.reader(f, delimiter=";" if ";" in f.readline() else ",")
+        f.seek(0)
+        kopf = [name.strip() for name in next(leser)]
+        fehlend = [name for name in spalten if name not in kopf]
+        if fehlend:
+            raise ValueError(f"{pfad}: missing input columns {fehlend}")
+        namen = [name for name in spalten + OPTIONAL if name in kopf]
+        indizes = [kopf.index(name) for name in namen]
+        puffer = []
+        for zeile in leser:
+            if not zeile:
+                continue
+            puffer.append([zeile[i] for i in indizes])
+            if len(puffer) == blockgroesse:
+                werte = np.array(puffer, dtype=float)
+                yield {name: werte[:, k] for k, name in enumerate(namen)}
+                puffer = []
+        if puffer:
+            werte = np.array(puffer, dtype=float)
+            yield {name: werte[:, k] for k, name in enumerate(namen)}
+
+
+def zeilen(pfad, spalten=EINGABEN, blockgroesse=4096):
+    """Yield the input rows of `pfad` one at a time as dicts of floats."""
+    for block in bloecke(pfad, spalten, blockgroesse):
+        namen = list(block)
+        for werte in zip(*(block[name].tolist() for name in namen)):
+            yield dict(zip(namen, werte))
+
+
+def simulieren(eingaben, dt, t0=0, zustand=None, eingabe_volumen=False, ausgaben=AUSGABEN,
+               modellzustand=None, checkpoints=None, dateien=False, **kwargs):
+    """Run :func:`FreeTTES_model.main` for every row of `eingaben` and yield the outputs.
+
+    Parameters:
+        eingaben: iterable of dicts with the keys of `EINGABEN` (optionally
+            ``T_Abstrom``), e.g. :func:`zeilen`
+        dt (int): timestep of the rows in seconds
+        t0 (float): time of the first row in hours; at 0 the model is initialized
+        zustand (dict): measured start profile height:temperature for t0 = 0
+        eingabe_volumen (bool): flows in `eingaben` are volume flows
+        ausgaben: output keys of each record; only these metrics are computed
+        modellzustand (Modellzustand): run on this state in memory (it is updated in
+            place). Without it, the run starts from a new state in memory: at t0 = 0
+            the initial state, otherwise the state last written to datei/
+        checkpoints (FreeTTES_checkpoint.Checkpointspeicher): write the start state
+            and the state after every `checkpoints.alle` steps; runs in memory
+        dateien (bool): run on the files in datei/ as main() does on its own. Every
+            row then reads and writes ``last_profile_*.csv`` and one ``sz/sz<t>.dat``
+        kwargs: further arguments of main(), e.g. ``T_RL``
+
+    Yields:
+        dict with the keys of `ausgaben`
+    """
+    if dateien:
+        if modellzustand is not None or checkpoints is not None:
+            raise ValueError("dateien=True runs on datei/, not with modellzustand or checkpoints")
+    elif modellzustand is None and t0 != 0:                             # Fortsetzung des letzten Laufs
+        modellzustand = Modellzustand(*model.__Modell_letzter_Zustand(), t=t0)
+    elif modellzustand is None or not modellzustand and checkpoints is not None:
+        modellzustand = model.startzustand(zustand, parameter=kwargs.get("parameter"))
+    if checkpoints is not None:
+        modellzustand.t = t0
+        checkpoints.schreiben(modellzustand)
+    for i, zeile in enumerate(eingaben):
+        t = t0 + i * dt / 3600
+        result = model.main(t=t, dt=dt, eingabe_volumen=eingabe_volumen,
+                            zustand_uebernehmen=(t == 0 and zustand is not None),
+                            zustand=dict(zustand or {}), modellzustand=modellzustand, **zeile, **kwargs)
+        if checkpoints is not None and (i + 1) % checkpoints.alle == 0:
+            checkpoints.schreiben(modellzustand)
+        yield {key: result[key] for key in ausgaben}
+
+
+def _npy_kopf(n):
+    """Header of a 1-D float64 ``.npy`` file (format 1.0) with `n` rows and fixed length."""
+    text = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d,), }" % n
+    text = text.ljust(_NPY_KOPF - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(text)) + text.encode("latin1")
+
+
+def _als_float(wert):
+    if wert is None:
+        return np.nan
+    try:
+        return float(wert)                                              # auch "inf" (t_bis_leer)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class Spaltenspeicher:
+    """Bounded-memory sink writing records as one ``.npy`` file per column.
+
+    Records are buffered up to `puffer` rows and then appended to
+    ``<pfad>/<spalte>.npy``. The row count in the file headers is updated on
+    every flush, so the files can be read with ``np.load`` after each flush and
+    after :meth:`schliessen`. The columns are taken from the first record
+    unless `spalten` is given; values that are not numbers are stored as NaN.
+    """
+
+    def __init__(self, pfad, spalten=None, puffer=4096):
+        self.pfad = pfad
+        self.spalten = tuple(spalten) if spalten else None
+        self.puffer = puffer
+        self.anzahl = 0                                                 # bereits geschriebene Zeilen
+        self._werte = None
+        self._n = 0
+        self._dateien = {}
+        os.makedirs(pfad, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.schliessen()
+
+    def _oeffnen(self):
+        self._werte = np.empty((self.puffer, len(self.spalten)))
+        for name in self.spalten:
+            f = open(os.path.join(self.pfad, name + ".npy"), "w+b")
+            f.write(_npy_kopf(0))
+            self._dateien[name] = f
+
+    def schreiben(self, record):
+        """Append one record (dict of output values)."""
+        if self._werte is None:
+            if self.spalten is None:
+                self.spalten = tuple(record)
+            self._oeffnen()
+        zeile = self._werte[self._n]
+        for k, name in enumerate(self.spalten):
+            zeile[k] = _als_float(record.get(name))
+        self._n += 1
+        if self._n == self.puffer:
+            self.leeren()
+
+    def alle_schreiben(self, records):
+        """Append all records of the iterable `records`; returns the row count."""
+        for record in records:
+            self.schreiben(record)
+        self.leeren()
+        return self.anzahl
+
+    def leeren(self):
+        """Write the buffered rows to the column files."""
+        if not self._n:
+            return
+        self.anzahl += self._n
+        for k, name in enumerate(self.spalten):
+            f = self._dateien[name]
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(self._werte[:self._n, k], dtype="<f8").tobytes())
+            f.seek(0)
+            f.write(_npy_kopf(self.anzahl))
+            f.flush()
+        self._n = 0
+
+    def schliessen(self):
+        self.leeren()
+        for f in self._dateien.values():
+            f.close()
+        self._dateien = {}
+
+
+def pipeline(eingabe, ausgabe, dt, t0=0, zustand=None, blockgroesse=4096, puffer=4096, **kwargs):
+    """Stream the inputs in `eingabe` through the model into the column files in `ausgabe`.
+
+    Returns the number of simulated time steps. Further arguments are passed to
+    :func:`simulieren`.
+    """
+    with Spaltenspeicher(ausgabe, spalten=kwargs.get("ausgaben", AUSGABEN), puffer=puffer) as senke:
+        return senke.alle_schreiben(simulieren(zeilen(eingabe, blockgroesse=blockgroesse),
+                                               dt, t0=t0, zustand=zustand, **kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("eingabe", help="CSV file, .npy file or directory of .npy columns")
+    parser.add_argument("ausgabe", help="directory for the output columns")
+    parser.add_argument("--dt", type=int, default=3600, help="timestep of the rows in seconds")
+    parser.add_argument("--t0", type=float, default=0, help="time of the first row in hours")
+    parser.add_argument("--zustand", type=ast.literal_eval, default=None,
+                        help="start profile as dict height:temperature, e.g. \"{2.0: 30, 38.0: 90}\"")
+    parser.add_argument("--volumen", action="store_true", help="flows are volume flows")
+    parser.add_argument("--dateien", action="store_true",
+                        help="carry the state through the files in datei/ (one sz file per row)")
+    args = parser.parse_args()
+    n = pipeline(args.eingabe, args.ausgabe, args.dt, t0=args.t0, zustand=args.zustand,
+                 eingabe_volumen=args.volumen, dateien=args.dateien)
+    print("%d Zeitschritte -> %s" % (n, args.ausgabe))
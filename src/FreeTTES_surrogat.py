@@ -0,0 +1,279 @@
+"""Fast surrogate of the TES tank model for optimization inner loops.
+
+MILP/MPC inner loops need thousands of tank evaluations per second. The
+surrogate describes the tank by a reduced state (:data:`ZUSTAND`)::
+
+    E_nutz   usable energy in GJ
+    h_mitte  height of the thermocline (middle of the mixing zone) in m
+    breite   width of the mixing zone in m
+    T_oben   temperature above the mixing zone in °C
+    T_unten  temperature below the mixing zone in °C
+
+and maps it and the inputs of one step to the reduced state after the step and
+the outlet temperature. The map is piecewise linear: one least-squares fit per
+operating mode (charge, discharge, idle) on the reduced state, the inputs and
+their products with the flow.
+
+Training data come from :func:`FreeTTES_model.main` (in memory, several
+processes at once) on sampled start profiles and inputs::
+
+    daten = trainingsdaten(200, 8, dt=900)
+    surrogat = Surrogat.trainieren(daten)
+    tank = SurrogatSpeicher(surrogat)
+    tank.init(start_profil)
+    tank.step(900, 50, -50, 85, 10.0)
+    fehlerbericht(surrogat, szenarien(10, 24, 900, seed=1))
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import FreeTTES_config as cfg
+import FreeTTES_model as model
+from FreeTTES_simulator import Speicher, modell_sperre
+
+ZUSTAND = ("E_nutz", "h_mitte", "breite", "T_oben", "T_unten")
+MODI = ("laden", "entladen", "ruhe")
+
+# Wertebereiche der Stichproben (Startprofil als Sigmoid über die Höhe und Eingaben)
+BEREICHE = {
+    "h_mitte": (8.0, 32.0), "breite": (0.5, 3.0), "T_oben": (70.0, 95.0), "T_unten": (25.0, 55.0),
+    "m": (20.0, 150.0), "T_laden": (75.0, 95.0), "T_entladen": (25.0, 45.0), "T_amb": (-10.0, 30.0),
+}
+_HOEHEN = np.arange(2.0, 40.0, 2.0)
+
+
+def reduzieren(zustand) -> np.ndarray:
+    """Reduced state (see :data:`ZUSTAND`) of a Modellzustand.
+
+    Without a mixing zone (homogeneous tank) the whole column is at the mean
+    temperature: ``T_oben = T_unten``, ``breite = 0`` and ``h_mitte`` at the
+    lower diffuser.
+    """
+    cfg.ensure_initialized()
+    model._sync_legacy_globals()                                        # Kennzahlen mit config.json
+    speicher_param = model.speicher_param
+    sz = zustand.speicher
+    oben = max(sz)
+    h_WS = oben + sz[oben][1] / 2
+    E_nutz = model.__energie_nutz(sz, h_WS)
+    mz = model.__Modell_Mischzone(sz, h_WS)
+    if mz["untere_hoehe_mischzone"] is None:
+        T = sum(v[0] * v[1] for v in sz.values()) / sum(v[1] for v in sz.values())
+        return np.array([E_nutz, speicher_param["H_B_UK_Dif"], 0.0, T, T])
+    h_u, h_o = mz["untere_hoehe_mischzone"], mz["obere_hoehe_mischzone"]
+    return np.array([E_nutz, (h_u + h_o) / 2, h_o - h_u,
+                     mz["obere_temperatur_mischzone"], mz["untere_temperatur_mischzone"]])
+
+
+def _merkmale(x, m, T_Zustrom, T_amb):
+    """Regressors of the fit: constant, state, inputs and the products with the flow."""
+    m = np.abs(m)[:, None]
+    return np.hstack([np.ones_like(m), x, m, T_Zustrom[:, None], T_amb[:, None], m * x, m * T_Zustrom[:, None]])
+
+
+def _modus(m):
+    """Operating mode per row: 0 charge, 1 discharge, 2 idle."""
+    return np.where(m > 1e-9, 0, np.where(m < -1e-9, 1, 2))
+
+
+class Surrogat:
+    """Piecewise-linear map (reduced state, inputs) -> (reduced state after `dt`, outlet temperature).
+
+    dt: timestep in seconds the surrogate was trained for
+    koeffizienten: least-squares coefficients per mode, shape (regressors, len(ZUSTAND) + 1)
+    """
+
+    def __init__(self, dt, koeffizienten):
+        self.dt = dt
+        self.koeffizienten = koeffizienten
+
+    def __repr__(self):
+        return "Surrogat(dt=%g, %s)" % (self.dt, ", ".join(self.koeffizienten))
+
+    @classmethod
+    def trainieren(cls, daten) -> "Surrogat":
+        """Fit the surrogate to the output of :func:`trainingsdaten`."""
+        x, u = daten["x"], daten["u"]
+        phi = _merkmale(x, u[:, 0], u[:, 1], u[:, 2])
+        ziel = np.hstack([daten["x_neu"] - x, daten["T_Austritt"][:, None]])
+        modus = _modus(u[:, 0])
+        koeffizienten = {}
+        for i, name in enumerate(MODI):
+            auswahl = modus == i
+            if np.count_nonzero(auswahl) < phi.shape[1]:
+                raise ValueError("too few training samples for mode %r" % name)
+            koeffizienten[name] = np.linalg.lstsq(phi[auswahl], ziel[auswahl], rcond=None)[0]
+        return cls(daten["dt"], koeffizienten)
+
+    def schritt(self, x, m_VL, T_Zustrom, T_amb):
+        """One step for one or many tanks at once.
+
+        x: reduced states, shape (len(ZUSTAND),) or (n, len(ZUSTAND))
+        m_VL, T_Zustrom, T_amb: inputs (scalars or arrays of length n); m_RL = -m_VL
+
+        Returns the reduced states after the step and the outlet temperatures
+        (-1 without flow).
+        """
+        x = np.asarray(x, dtype=float)
+        einzeln = x.ndim == 1
+        x = np.atleast_2d(x)
+        m, T_zu, T_a = (np.broadcast_to(np.asarray(w, dtype=float), len(x)) for w in (m_VL, T_Zustrom, T_amb))
+        phi = _merkmale(x, m, T_zu, T_a)
+        modus = _modus(m)
+        aenderung = np.empty((len(x), len(ZUSTAND) + 1))
+        for i, name in enumerate(MODI):
+            auswahl = modus == i
+            aenderung[auswahl] = phi[auswahl] @ self.koeffizienten[name]
+        x_neu = x + aenderung[:, :-1]
+        T_Austritt = np.where(modus == 2, -1.0, aenderung[:, -1])
+        return (x_neu[0], float(T_Austritt[0])) if einzeln else (x_neu, T_Austritt)
+
+    def speichern(self, pfad):
+        np.savez(pfad, dt=self.dt, **self.koeffizienten)
+
+    @classmethod
+    def laden(cls, pfad) -> "Surrogat":
+        with np.load(pfad) as daten:
+            return cls(float(daten["dt"]), {name: daten[name] for name in MODI})
+
+
+class SurrogatSpeicher:
+    """Tank driven by a :class:`Surrogat`, with the step interface of :class:`FreeTTES_simulator.Speicher`."""
+
+    def __init__(self, surrogat, name="surrogat"):
+        self.name = name
+        self.surrogat = surrogat
+        self.x = None
+        self.t = 0.0
+
+    def __repr__(self):
+        return "SurrogatSpeicher(%r, %s)" % (self.name, self.x)
+
+    def init(self, zustand=None, t=0.0):
+        """Start from a measured profile height:temperature (as `Speicher.init`) or a Modellzustand."""
+        if zustand is None or isinstance(zustand, dict):
+            with modell_sperre:
+                zustand = model.startzustand(zustand)
+        self.x = reduzieren(zustand)
+        self.t = t
+        return self.x
+
+    def step(self, dt, m_VL, m_RL, T_Zustrom, T_amb):
+        """Advance by `dt` seconds (a multiple of the trained timestep); `m_RL` is taken as ``-m_VL``."""
+        n = round(dt / self.surrogat.dt)
+        if n < 1 or abs(n * self.surrogat.dt - dt) > 1e-6:
+            raise ValueError("dt = %g s is no multiple of the surrogate timestep %g s" % (dt, self.surrogat.dt))
+        T_Austritt = []
+        for _ in range(n):
+            self.x, T = self.surrogat.schritt(self.x, m_VL, T_Zustrom, T_amb)
+            T_Austritt.append(T)
+        ergebnis = dict(zip(ZUSTAND, self.x.tolist()))
+        ergebnis.update(t=self.t, T_Austritt=T_Austritt[-1], T_Austritt_sub=np.array(T_Austritt))
+        self.t += dt / 3600
+        return ergebnis
+
+    def get_state(self) -> np.ndarray:
+        return self.x.copy()
+
+    def set_state(self, x):
+        self.x = np.array(x, dtype=float)
+
+
+def _profil(h_mitte, breite, T_oben, T_unten):
+    """Start profile height:temperature with a sigmoid thermocline."""
+    T = T_unten + (T_oben - T_unten) / (1 + np.exp(-(_HOEHEN - h_mitte) / breite))
+    return dict(zip(_HOEHEN.tolist(), T.round(2).tolist()))
+
+
+def szenarien(n, n_schritte, dt, seed=0):
+    """`n` sampled scenarios (start profile, input rows ``(m_VL, T_Zustrom, T_amb)``)."""
+    rng = np.random.default_rng(seed)
+    ziehen = lambda name: rng.uniform(*BEREICHE[name])
+    ergebnis = []
+    for _ in range(n):
+        profil = _profil(ziehen("h_mitte"), ziehen("breite"), ziehen("T_oben"), ziehen("T_unten"))
+        zeilen = []
+        for modus in rng.integers(0, 3, n_schritte):
+            if modus == 0:
+                zeilen.append((ziehen("m"), ziehen("T_laden"), ziehen("T_amb")))
+            elif modus == 1:
+                zeilen.append((-ziehen("m"), ziehen("T_entladen"), ziehen("T_amb")))
+            else:
+                zeilen.append((0.0, 60.0, ziehen("T_amb")))
+        ergebnis.append((profil, zeilen))
+    return ergebnis
+
+
+def _trajektorie(profil, zeilen, dt):
+    """Worker: run one scenario with the full model; reduced states and outlet temperatures."""
+    tank = Speicher()
+    tank.init(profil)
+    x = [reduzieren(tank.zustand)]
+    T_Austritt = []
+    for m, T_zu, T_amb in zeilen:
+        T_Austritt.append(tank.step(dt, m, -m, T_zu, T_amb)["T_Austritt"])
+        x.append(reduzieren(tank.zustand))
+    return np.array(x), np.array(T_Austritt)
+
+
+def _laeufe(liste, dt, max_worker):
+    with ProcessPoolExecutor(max_worker or os.cpu_count()) as pool:
+        return list(pool.map(_trajektorie, *zip(*liste), [dt] * len(liste)))
+
+
+def trainingsdaten(n_szenarien, n_schritte, dt=900, seed=0, max_worker=None):
+    """Samples of the full model from `n_szenarien` scenarios of `n_schritte` steps, run in a process pool.
+
+    Returns a dict of arrays: ``x`` (reduced state before the step), ``u``
+    (m_VL, T_Zustrom, T_amb), ``x_neu`` (after the step) and ``T_Austritt``,
+    and the timestep ``dt``.
+    """
+    liste = szenarien(n_szenarien, n_schritte, dt, seed)
+    laeufe = _laeufe(liste, dt, max_worker)
+    return {
+        "dt": dt,
+        "x": np.vstack([x[:-1] for x, _ in laeufe]),
+        "x_neu": np.vstack([x[1:] for x, _ in laeufe]),
+        "u": np.vstack([np.array(zeilen, dtype=float) for _, zeilen in liste]),
+        "T_Austritt": np.concatenate([T for _, T in laeufe]),
+    }
+
+
+def fehlerbericht(surrogat, liste, max_worker=None, n_bewertungen=10000):
+    """Open-loop errors of the surrogate against the full model on hold-out scenarios.
+
+    liste: scenarios as from :func:`szenarien` (use another seed than for training)
+    n_bewertungen: tanks per vectorized call for the throughput
+
+    Returns a dict with the mean and largest error of T_Austritt (steps with
+    flow), E_nutz and h_mitte, and the steps per second of both models.
+    """
+    beginn = time.perf_counter()
+    laeufe = _laeufe(liste, surrogat.dt, max_worker)
+    n_schritte = sum(len(zeilen) for _, zeilen in liste)
+    t_modell = (time.perf_counter() - beginn) / n_schritte
+    dT, dE, dh = [], [], []
+    for (profil, zeilen), (x_ref, T_ref) in zip(liste, laeufe):
+        x = x_ref[0]
+        for (m, T_zu, T_amb), x_soll, T_soll in zip(zeilen, x_ref[1:], T_ref):
+            x, T = surrogat.schritt(x, m, T_zu, T_amb)
+            if m != 0:
+                dT.append(abs(T - T_soll))
+            dE.append(abs(x[0] / x_soll[0] - 1))
+            dh.append(abs(x[1] - x_soll[1]))
+    x = np.repeat(laeufe[0][0][:1], n_bewertungen, axis=0)
+    beginn = time.perf_counter()
+    surrogat.schritt(x, np.linspace(-100, 100, n_bewertungen), 60.0, 10.0)
+    t_surrogat = (time.perf_counter() - beginn) / n_bewertungen
+    return {
+        "T_Austritt_mittel_K": float(np.mean(dT)), "T_Austritt_max_K": float(np.max(dT)),
+        "E_nutz_mittel_rel": float(np.mean(dE)), "E_nutz_max_rel": float(np.max(dE)),
+        "h_mitte_mittel_m": float(np.mean(dh)), "h_mitte_max_m": float(np.max(dh)),
+        "modell_schritte_je_s": 1 / t_modell, "surrogat_schritte_je_s": 1 / t_surrogat,
+    }
@@ -0,0 +1,94 @@
+"""In-memory model state of one TES tank.
+
+`main()` normally carries the state from one call to the next through the
+``last_profile_*.csv`` files in ``datei/``. :class:`Modellzustand` holds the
+same three dicts in memory, so that several tanks can be simulated side by side
+and states can be copied, sent and restored without touching the files:
+
+- ``speicher``: water layers ``{hPos: [T, dh, I, M]}``
+- ``fundament``: foundation cells ``{hPos: [T, dh]}`` (negative positions)
+- ``kapazitaeten``: wall cells ``{hPos: [T, dh, C]}``
+
+:meth:`Modellzustand.to_bytes` packs a state into a compact binary record of
+float64 arrays; :meth:`Modellzustand.from_bytes` restores it exactly.
+"""
+
+from __future__ import annotations
+
+import struct
+
+import numpy as np
+
+_KENNUNG = b"FTZ1"
+_KOPF = struct.Struct("<4sd")                   # Kennung, Modellzeit in h
+_TEIL = struct.Struct("<IB")                    # Zeilen, Spalten (Position + Werte)
+
+
+def _packen(teil):
+    if not teil:
+        return _TEIL.pack(0, 0)
+    zeilen = [[k] + list(v) for k, v in sorted(teil.items())]
+    feld = np.array(zeilen, dtype="<f8")
+    return _TEIL.pack(*feld.shape) + feld.tobytes()
+
+
+def _entpacken(daten, pos):
+    n, m = _TEIL.unpack_from(daten, pos)
+    pos += _TEIL.size
+    feld = np.frombuffer(daten, dtype="<f8", count=n * m, offset=pos).reshape(n, m)
+    return {zeile[0]: zeile[1:] for zeile in feld.tolist()}, pos + 8 * n * m
+
+
+class Modellzustand:
+    """Water column, foundation and wall of one tank and the model time `t` in hours.
+
+    An empty state (no water layers) is false; `main()` then initializes the
+    tank as at ``t = 0``.
+    """
+
+    __slots__ = ("speicher", "fundament", "kapazitaeten", "t")
+
+    def __init__(self, speicher=None, fundament=None, kapazitaeten=None, t=0.0):
+        self.speicher = speicher or {}
+        self.fundament = fundament or {}
+        self.kapazitaeten = kapazitaeten or {}
+        self.t = t
+
+    def __bool__(self):
+        return bool(self.speicher)
+
+    def __repr__(self):
+        return "Modellzustand(t=%g, %d Schichten, %d Fundament-, %d Mantelzellen)" % (
+            self.t, len(self.speicher), len(self.fundament), len(self.kapazitaeten))
+
+    def teile(self):
+        """Independent copies of the three state dicts, as `main()` mutates them."""
+        return ({k: list(v) for k, v in self.speicher.items()},
+                {k: list(v) for k, v in self.fundament.items()},
+                {k: list(v) for k, v in self.kapazitaeten.items()})
+
+    def setzen(self, speicher, fundament, kapazitaeten, t):
+        """Take over the state at the end of a step (the dicts are not copied)."""
+        self.speicher = speicher
+        self.fundament = fundament
+        self.kapazitaeten = kapazitaeten
+        self.t = t
+
+    def kopie(self) -> "Modellzustand":
+        return Modellzustand(*self.teile(), t=self.t)
+
+    def to_bytes(self) -> bytes:
+        """Compact binary record: header, then each dict as a float64 array of position and values."""
+        return (_KOPF.pack(_KENNUNG, self.t) + _packen(self.speicher)
+                + _packen(self.fundament) + _packen(self.kapazitaeten))
+
+    @classmethod
+    def from_bytes(cls, daten) -> "Modellzustand":
+        kennung, t = _KOPF.unpack_from(daten, 0)
+        if kennung != _KENNUNG:
+            raise ValueError("no FreeTTES state record")
+        pos = _KOPF.size
+        speicher, pos = _entpacken(daten, pos)
+        fundament, pos = _entpacken(daten, pos)
+        kapazitaeten, pos = _entpacken(daten, pos)
+        return cls(speicher, fundament, kapazitaeten, t=t)